@@ -1,22 +1,19 @@
 #!/usr/bin/env python
 
-from typing import Optional
+import os
+import time
+
+from typing import List, Optional
 
 import typer
 import asyncio
 from loguru import logger
 
 from yuri.config import Config, ConfigFactory
-from yuri.listener import ListenerFactory
-from yuri.speaker import SpeakerFactory
-from yuri.lights import Lights
-from yuri.input import Input
-from yuri.servos import Servos
-from yuri.yuri import Yuri
-
-# from yuri.textgen import TextGen
 
 app = typer.Typer()
+bench = typer.Typer()
+app.add_typer(bench, name="bench")
 
 DEFAULT_CONFIG_LOCATION = "yuri.json"
 
@@ -27,15 +24,59 @@ def get_config(config_path: Optional[str]) -> Config:
 
 
 @app.command()
-def respond(prompt: str, config_path: Optional[str] = None):
+def respond(
+    prompt: str, speak: bool = False, config_path: Optional[str] = None
+):
+    from yuri.speaker import SpeakerFactory
+    from yuri.textgen import TextGen
+
     config = get_config(config_path)
-    # tg = TextGen(config)
-    # tg.generate(prompt)
-    logger.error("respond is not yet implemented")
+    textgen = TextGen(config)
+    textgen.ensure_server()
+    if not speak:
+        started_at = time.monotonic()
+        text = textgen.generate(prompt)
+        logger.info(f"{text} ({time.monotonic() - started_at:.2f}s)")
+        return
+
+    speaker = SpeakerFactory.create(config)
+
+    async def respond_aloud():
+        # Each sentence is queued to speak as soon as it's generated
+        utterances = [
+            speaker.submit(sentence) for sentence in textgen.sentences(prompt)
+        ]
+        await asyncio.gather(*(utterance.done for utterance in utterances))
+
+    try:
+        asyncio.run(respond_aloud())
+    finally:
+        speaker.close()
+
+
+@app.command("textgen-server")
+def textgen_server(
+    model: Optional[str] = None, config_path: Optional[str] = None
+):
+    # Runs in the foreground; respond starts one in the background if none
+    # is running
+    from yuri.textgen_server import main as serve_textgen
+
+    config = get_config(config_path)
+    serve_textgen(
+        os.path.expanduser(config.textgen_socket),
+        model,
+        int8=config.textgen_int8,
+        max_context=config.textgen_max_context,
+        cache_mb=config.textgen_cache_mb,
+        threads=config.textgen_threads,
+    )
 
 
 @app.command()
 def servos(config_path: Optional[str] = None):
+    from yuri.servos import Servos
+
     config = get_config(config_path)
     servos = Servos(config)
     servos.rotate()
@@ -45,12 +86,60 @@ def servos(config_path: Optional[str] = None):
 def converse(
     max_seconds: Optional[int] = None, config_path: Optional[str] = None
 ):
+    from yuri.config_watch import ConfigWatcher, watch_eyes, watch_speaker
+    from yuri.converse import Conversation
+    from yuri.input import Input
+    from yuri.intents import IntentRouter
+    from yuri.lights import Lights
+    from yuri.listener import ListenerFactory
+    from yuri.servos import Servos
+    from yuri.speaker import SpeakerFactory
+    from yuri.textgen import TextGen
+
+    config_path = config_path or DEFAULT_CONFIG_LOCATION
     config = get_config(config_path)
-    logger.error("converse is not yet implemented")
+    listener = ListenerFactory.create(config)
+    speaker = SpeakerFactory.create(config)
+    servos = Servos(config)
+    lights = Lights(config)
+    # Commands for the eyes and lights are carried out directly
+    router = IntentRouter(
+        eyes=servos.eyes,
+        lights=lights,
+        speaker=speaker,
+        inputs=Input(config),
+        config=config,
+        config_path=config_path,
+    )
+    conversation = Conversation(listener, speaker, TextGen(config), router)
+    # Edits to the config are applied between (or during) turns
+    watcher = ConfigWatcher(config, config_path)
+    watch_eyes(watcher, servos.eyes)
+    watch_speaker(watcher, [conversation, router])
+    watcher.follow(router)
+
+    async def converse_with_motion():
+        # The eyes only move when told to, so calibration has them alone
+        control = asyncio.ensure_future(servos.control_loop())
+        watching = asyncio.ensure_future(watcher.run())
+        try:
+            await conversation.run(max_seconds)
+        finally:
+            control.cancel()
+            watching.cancel()
+
+    try:
+        asyncio.run(converse_with_motion())
+    finally:
+        conversation.speaker.close()
+        listener.close()
+        lights.close()
 
 
 @app.command()
 def inputs(seconds: int = 10, config_path: Optional[str] = None):
+    from yuri.input import Input
+
     config = get_config(config_path)
     inputs = Input(config)
     inputs.demo(seconds)
@@ -58,20 +147,42 @@ def inputs(seconds: int = 10, config_path: Optional[str] = None):
 
 @app.command()
 def colors(seconds: int = 3, config_path: Optional[str] = None):
+    from yuri.lights import Lights
+
     config = get_config(config_path)
     lights = Lights(config)
-    asyncio.run(lights.cycle_colors(seconds))
+    try:
+        asyncio.run(lights.cycle_colors(seconds))
+    finally:
+        lights.close()
 
 
 @app.command()
 def say(message: str, config_path: Optional[str] = None):
+    from yuri.speaker import SpeakerFactory
+
     config = get_config(config_path)
     speaker = SpeakerFactory.create(config)
-    asyncio.run(speaker.say(message))
+
+    async def say_timed():
+        utterance = speaker.submit(message)
+        await utterance.done
+        timing = utterance.timing
+        logger.info(
+            f"time to first audio: {timing.time_to_first_audio}s, "
+            f"wall time: {timing.wall_time}s over {timing.clauses} clauses"
+        )
+
+    try:
+        asyncio.run(say_timed())
+    finally:
+        speaker.close()
 
 
 @app.command()
 def transcribe(config_path: Optional[str] = None):
+    from yuri.listener import ListenerFactory
+
     config = get_config(config_path)
     listener = ListenerFactory.create(config)
     audio = listener.listen()
@@ -79,19 +190,43 @@ def transcribe(config_path: Optional[str] = None):
     logger.info(transcription)
 
 
+@app.command("transcribe-batch")
+def transcribe_batch(
+    source: str,
+    output: str = "transcripts.jsonl",
+    processes: Optional[int] = None,
+    config_path: Optional[str] = None,
+):
+    # `source` is a directory of WAVs or a JSONL manifest
+    from yuri.batch import find_jobs, run_batch
+
+    config = get_config(config_path)
+    jobs = find_jobs(source)
+    with open(output, "w") as output_file:
+        summary = run_batch(config, jobs, output_file, processes)
+    logger.info(f"batch transcription: {summary}")
+
+
 @app.command()
 def calibrate(config_path: Optional[str] = None):
+    from yuri.input import Input
+    from yuri.servos import Servos
+    from yuri.speaker import SpeakerFactory
+
     config = get_config(config_path)
     servos = Servos(config)
     speaker = SpeakerFactory.create(config)
     inputs = Input(config)
 
-    asyncio.run(servos.eyes.calibrate(inputs, speaker=speaker))
+    asyncio.run(servos.calibrate(inputs, speaker=speaker))
     config.save(config_path or DEFAULT_CONFIG_LOCATION)
 
 
 @app.command()
 def repeat(config_path: Optional[str] = None):
+    from yuri.listener import ListenerFactory
+    from yuri.speaker import SpeakerFactory
+
     config = get_config(config_path)
 
     listener = ListenerFactory.create(config)
@@ -101,13 +236,165 @@ def repeat(config_path: Optional[str] = None):
     logger.info(transcription)
 
     speaker = SpeakerFactory.create(config)
-    asyncio.run(speaker.say(transcription.text))
+    try:
+        asyncio.run(speaker.say(transcription.text))
+    finally:
+        speaker.close()
+
+
+@bench.command("lights-jitter")
+def bench_lights_jitter(seconds: int = 10, config_path: Optional[str] = None):
+    from yuri.bench import lights_jitter
+
+    config = get_config(config_path)
+    for mode, summary in lights_jitter(config, seconds).items():
+        logger.info(f"servo tick jitter ({mode}): {summary}")
+
+
+@bench.command("audio-latency")
+def bench_audio_latency(clips: int = 20):
+    from yuri.bench import mixer_latency
+
+    logger.info(f"first sample latency: {mixer_latency(clips)}")
+
+
+@bench.command("transcribe")
+def bench_transcribe(
+    wavs: List[str],
+    listener_types: str = "sphinx,pocketsphinx",
+    config_path: Optional[str] = None,
+):
+    from yuri.bench import transcribe_latency
+
+    config = get_config(config_path)
+    results = transcribe_latency(config, wavs, listener_types.split(","))
+    for name, summary in results.items():
+        logger.info(f"transcription latency ({name}): {summary}")
+
+
+@bench.command("keyword-cpu")
+def bench_keyword_cpu(
+    wavs: List[str],
+    listener_types: str = "pocketsphinx",
+    config_path: Optional[str] = None,
+):
+    from yuri.bench import keyword_cpu
+
+    config = get_config(config_path)
+    results = keyword_cpu(config, wavs, listener_types.split(","))
+    for name, usage in results.items():
+        logger.info(f"cpu usage ({name}): {usage}")
+
+
+@bench.command("audio-bus")
+def bench_audio_bus(wav: str, consumers: int = 4):
+    from yuri.bench import bus_fanout
+
+    for name, usage in bus_fanout(wav, consumers).items():
+        logger.info(f"audio bus ({name}): {usage}")
+
+
+@bench.command("runtime-jitter")
+def bench_runtime_jitter(
+    wavs: List[str], seconds: int = 20, config_path: Optional[str] = None
+):
+    from yuri.bench import runtime_jitter
+
+    config = get_config(config_path)
+    for mode, summary in runtime_jitter(config, wavs, seconds).items():
+        logger.info(f"servo tick jitter (transcribing on a {mode}): {summary}")
+
+
+@bench.command("textgen")
+def bench_textgen(threads: int = 4, max_tokens: int = 32):
+    from yuri.bench import textgen_speed
+
+    for name, summary in textgen_speed(threads, max_tokens).items():
+        logger.info(f"text generation ({name}): {summary}")
+
+
+@bench.command("converse")
+def bench_converse(
+    wavs: List[str],
+    gap_seconds: float = 8.0,
+    max_seconds: Optional[int] = None,
+    config_path: Optional[str] = None,
+):
+    from yuri.bench import converse_latency
+
+    config = get_config(config_path)
+    summary = converse_latency(config, wavs, gap_seconds, max_seconds)
+    logger.info(f"end of speech to first audio: {summary}")
+
+
+@bench.command("startup")
+def bench_startup(commands: Optional[List[str]] = None, top: int = 5):
+    # Commands are named as on the command line, e.g. "bench converse"
+    from yuri.bench import startup_imports
+
+    for name, report in startup_imports(__file__, commands, top).items():
+        logger.info(f"cold start imports ({name}): {report}")
+
+
+@app.command("train-keywords")
+def train_keywords(
+    data_dir: str = "data/mini_speech_commands",
+    model_path: str = "models/kws.tflite",
+    epochs: int = 20,
+    mfcc: Optional[int] = None,
+    background_dir: Optional[str] = None,
+    store_dir: str = "data/kws_features",
+):
+    # TensorFlow takes seconds to import, so only this command pays for it
+    from yuri.tensor_listen import train
+
+    train(
+        data_dir,
+        model_path,
+        epochs=epochs,
+        mfcc=mfcc,
+        background_dir=background_dir,
+        store_dir=store_dir,
+    )
+
+
+@bench.command("keyword-input")
+def bench_keyword_input(
+    data_dir: str = "data/mini_speech_commands",
+    store_dir: str = "data/kws_features",
+    examples: int = 500,
+):
+    # Run train-keywords first to build the feature store
+    from yuri.tensor_listen import wav_throughput
+
+    rates = wav_throughput(store_dir, data_dir, examples)
+    logger.info(f"training input throughput: {rates}")
 
 
 @app.callback(invoke_without_command=True)
-def run(config_path: Optional[str] = None):
+def run(
+    ctx: typer.Context,
+    config_path: Optional[str] = None,
+    processes: bool = False,
+    textgen: bool = False,
+):
+    # Only runs the robot when no command was given
+    if ctx.invoked_subcommand is not None:
+        return
     config = get_config(config_path)
-    yuri = Yuri(config)
+    if processes:
+        from yuri.runtime import Supervisor
+
+        # Motion, listening, speech and text generation each get a process
+        Supervisor.create(
+            config,
+            textgen=textgen,
+            config_path=config_path or DEFAULT_CONFIG_LOCATION,
+        ).run()
+        return
+    from yuri.yuri import Yuri
+
+    yuri = Yuri(config, config_path or DEFAULT_CONFIG_LOCATION)
     asyncio.run(yuri.run())
 
 
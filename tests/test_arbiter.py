@@ -0,0 +1,69 @@
+import asyncio
+
+from yuri.arbiter import MotionArbiter
+from yuri.trajectory import TrajectoryPlanner
+
+
+class FakeServo:
+    def __init__(self, angle=0.0):
+        self.angle = angle
+
+
+def hold(angle, ticks=3):
+    # A trajectory that sits at `angle` for `ticks` ticks
+    return TrajectoryPlanner(0.02).plan([angle], [angle], 0.02 * ticks)
+
+
+def test_higher_priority_preempts_until_it_finishes():
+    async def run():
+        arbiter = MotionArbiter()
+        servo = FakeServo()
+        look = arbiter.submit("look", [servo], hold(10.0, ticks=5))
+        blink = arbiter.submit("blink", [servo], hold(40.0, ticks=2), 10)
+
+        arbiter.step()
+        assert servo.angle == 40.0
+        arbiter.step()
+        assert blink.done() and blink.result()
+        # The look carries on once the blink releases the servo
+        arbiter.step()
+        assert servo.angle == 10.0
+        assert not look.done()
+        assert arbiter.stats.overridden == 2
+
+    asyncio.run(run())
+
+
+def test_equal_priorities_are_blended():
+    async def run():
+        arbiter = MotionArbiter()
+        servo = FakeServo()
+        arbiter.submit("look", [servo], hold(10.0))
+        arbiter.submit("attend", [servo], hold(30.0))
+
+        arbiter.step()
+        assert servo.angle == 20.0
+        assert arbiter.stats.merged == 1
+        arbiter.step()
+        assert arbiter.stats.writes_skipped == 1
+
+    asyncio.run(run())
+
+
+def test_new_request_from_a_source_releases_its_old_one():
+    async def run():
+        arbiter = MotionArbiter()
+        servo = FakeServo()
+        first = arbiter.submit("look", [servo], hold(10.0))
+        second = arbiter.submit("look", [servo], hold(30.0))
+        assert first.done() and not first.result()
+        assert arbiter.active == 1
+
+        arbiter.step()
+        assert servo.angle == 30.0
+        arbiter.cancel("look")
+        assert second.done() and not second.result()
+        assert arbiter.active == 0
+        assert arbiter.stats.cancelled == 2
+
+    asyncio.run(run())
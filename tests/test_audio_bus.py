@@ -0,0 +1,66 @@
+import numpy as np
+
+from yuri.audio_bus import AudioBus
+
+
+class CountingSource:
+    sample_rate = 100
+
+    def __init__(self, frames: int, frame_samples: int):
+        self.samples = np.arange(frames * frame_samples, dtype="<i2")
+        self.position = 0
+
+    def read_into(self, out: np.ndarray) -> bool:
+        if self.position >= len(self.samples):
+            return False
+        out[:] = self.samples[self.position : self.position + len(out)]
+        self.position += len(out)
+        return True
+
+    def close(self):
+        pass
+
+
+def run_bus(frames: int, slots: int = 4) -> AudioBus:
+    return AudioBus(
+        CountingSource(frames, 10), frame_samples=10, seconds=slots / 10
+    )
+
+
+def test_readers_share_the_ring_without_copying():
+    bus = run_bus(3)
+    first, second = bus.reader(), bus.reader()
+    bus.start()
+    bus.join()
+
+    index, frames = first.read(max_frames=3)
+    _, same = second.read(max_frames=3)
+    assert index == 0
+    assert np.shares_memory(frames, bus.frames)
+    assert np.shares_memory(same, bus.frames)
+    assert not frames.flags.writeable
+    assert frames.reshape(-1).tolist() == list(range(30))
+    assert first.read(timeout=0.1) is None
+
+
+def test_slow_reader_counts_overruns():
+    bus = run_bus(10)
+    reader = bus.reader()
+    bus.start()
+    bus.join()
+
+    index, frames = reader.read()
+    # Only the last slots - 1 frames are safe to read
+    assert index == 7
+    assert reader.stats.overruns == 7
+    assert frames[0, 0] == 70
+
+
+def test_samples_across_the_wrap():
+    bus = run_bus(6)
+    bus.start()
+    bus.join()
+
+    assert bus.samples(35, 55).tolist() == list(range(35, 55))
+    # Clipped to what's still held
+    assert bus.samples(0, 40).tolist() == list(range(30, 40))
@@ -0,0 +1,29 @@
+import json
+
+from yuri.batch import find_jobs, word_errors
+
+
+def test_word_errors():
+    assert word_errors("look to the left", "Look to the left!") == (0, 4)
+    assert word_errors("look to the left", "look the right") == (2, 4)
+    assert word_errors("hello", "") == (1, 1)
+    assert word_errors("", "hello") == (1, 0)
+
+
+def test_finds_wavs_with_references(tmp_path):
+    (tmp_path / "a.wav").write_bytes(b"")
+    (tmp_path / "a.txt").write_text("open your eyes\n")
+    (tmp_path / "nested").mkdir()
+    (tmp_path / "nested" / "b.WAV").write_bytes(b"")
+
+    jobs = find_jobs(str(tmp_path))
+    assert [job.reference for job in jobs] == ["open your eyes", None]
+
+
+def test_manifest_paths_are_relative_to_it(tmp_path):
+    manifest = tmp_path / "manifest.jsonl"
+    manifest.write_text(json.dumps({"path": "x.wav", "text": "hi"}) + "\n\n")
+
+    (job,) = find_jobs(str(manifest))
+    assert job.path == str(tmp_path / "x.wav")
+    assert job.reference == "hi"
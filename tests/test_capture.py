@@ -0,0 +1,101 @@
+import asyncio
+import wave
+
+import numpy as np
+
+from yuri.audio_bus import AudioBus
+from yuri.capture import (
+    BLOCK_FRAMES,
+    FRAME_SAMPLES,
+    SAMPLE_RATE,
+    AudioCapture,
+    VoiceActivityDetector,
+    WavFileSource,
+)
+
+# Half a second of silence, 0.6s of tone, then the source's own trailing
+# second of silence
+SPEECH_START = SAMPLE_RATE // 2
+SPEECH_END = SPEECH_START + int(SAMPLE_RATE * 0.6)
+
+
+def write_wav(path: str):
+    samples = np.zeros(SPEECH_END, dtype="<i2")
+    t = np.arange(SPEECH_END - SPEECH_START) / SAMPLE_RATE
+    samples[SPEECH_START:] = np.sin(2 * np.pi * 440 * t) * 8000
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(samples.tobytes())
+
+
+def wav_capture(tmp_path, realtime: bool = False) -> AudioCapture:
+    path = str(tmp_path / "tone.wav")
+    write_wav(path)
+    bus = AudioBus(
+        WavFileSource(path, realtime=realtime),
+        frame_samples=FRAME_SAMPLES * BLOCK_FRAMES,
+    )
+    return AudioCapture(bus, vad=VoiceActivityDetector(threshold=500.0))
+
+
+def test_tone_is_one_segment(tmp_path):
+    # In real time, so capture times follow the audio
+    capture = wav_capture(tmp_path, realtime=True)
+    capture.start()
+    capture.bus.start()
+
+    segment = capture.next_segment(timeout=5.0)
+    # The pre-roll reaches back before the tone; the end is the tone's
+    vad = capture.vad
+    pre_roll = (vad.pre_roll_frames + vad.speech_frames) * FRAME_SAMPLES
+    assert SPEECH_START - pre_roll <= segment.start < SPEECH_START
+    assert abs(segment.start + segment.clip.frames - SPEECH_END) <= (
+        FRAME_SAMPLES
+    )
+    duration = segment.clip.frames / SAMPLE_RATE
+    assert abs(segment.ended_at - segment.started_at - duration) < 0.15
+    # Nothing else was said, and capture ends with the file
+    assert capture.next_segment(timeout=5.0) is None
+    capture.close()
+    assert capture.finished.is_set()
+
+
+def test_segments_end_with_the_source(tmp_path):
+    capture = wav_capture(tmp_path)
+
+    async def collect():
+        segments = capture.segments()
+        first = asyncio.ensure_future(segments.__anext__())
+        # Subscribed before any audio flows
+        await asyncio.sleep(0.05)
+        capture.start()
+        capture.bus.start()
+        collected = [await first]
+        async for segment in segments:
+            collected.append(segment)
+        return collected
+
+    segments = asyncio.run(asyncio.wait_for(collect(), 10.0))
+    assert len(segments) == 1
+    capture.close()
+
+
+def test_stream_is_fed_as_the_utterance_is_captured(tmp_path):
+    capture = wav_capture(tmp_path)
+    chunks = capture.stream()
+    capture.start()
+    capture.bus.start()
+    segment = capture.next_segment(timeout=5.0)
+    capture.close()
+
+    streamed = []
+    while True:
+        start, samples = chunks.get(timeout=5.0)
+        if start is None:
+            break
+        if samples is not None:
+            assert start == segment.start
+            streamed.append(samples)
+    assert np.concatenate(streamed).tobytes() == segment.clip.data
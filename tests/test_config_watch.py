@@ -0,0 +1,122 @@
+import asyncio
+import os
+
+from yuri.config import Config, ConfigFactory
+from yuri.config_watch import ConfigWatcher, watch_eyes, watch_speaker
+from yuri.intents import IntentRouter
+from yuri.speaker import FakeSpeaker
+
+
+def test_save_replaces_the_file_whole(tmp_path):
+    location = str(tmp_path / "yuri.json")
+    Config().save(location)
+    os.chmod(location, 0o640)
+
+    config = Config(speaker_type="fake")
+    config.pins.button = "D4"
+    config.save(location)
+    assert Config.parse_file(location) == config
+    assert os.stat(location).st_mode & 0o777 == 0o640
+    assert os.listdir(str(tmp_path)) == ["yuri.json"]
+
+
+def test_only_changed_sections_are_pushed(tmp_path):
+    location = str(tmp_path / "yuri.json")
+    Config().save(location)
+    watcher = ConfigWatcher(ConfigFactory.create(location), location)
+    eyes, speakers = [], []
+    watcher.subscribe(("eyes",), eyes.append)
+    watcher.subscribe(("speaker_type",), speakers.append)
+
+    config = Config(listener_type="pocketsphinx")
+    config.eyes.left_eye.movement_smoothing = 0.5
+    config.save(location)
+    # Nothing takes a new listener type without a restart
+    assert asyncio.run(watcher.check()) == {"listener_type"}
+    assert [c.eyes.left_eye.movement_smoothing for c in eyes] == [0.5]
+    assert speakers == []
+    assert asyncio.run(watcher.check()) == set()
+
+
+def test_broken_edits_are_skipped_and_the_speaker_swapped(tmp_path):
+    location = str(tmp_path / "yuri.json")
+    Config(speaker_type="fake").save(location)
+
+    class Holder:
+        speaker = FakeSpeaker()
+
+    holders = [Holder(), Holder()]
+    old = holders[0].speaker
+    watcher = ConfigWatcher(Config.parse_file(location), location)
+    watch_speaker(watcher, holders)
+
+    async def edit():
+        with open(location, "w") as config_file:
+            config_file.write('{"speaker_type": "fake", "audio_sink": ')
+        await watcher.check()
+        assert watcher.config.audio_sink == "pyaudio"
+        assert holders[0].speaker is old
+
+        Config(speaker_type="fake", audio_sink="null").save(location)
+        await watcher.check()
+
+    asyncio.run(edit())
+    assert holders[0].speaker is holders[1].speaker is not old
+    assert isinstance(holders[0].speaker, FakeSpeaker)
+
+
+def test_calibration_saves_over_reloaded_edits(tmp_path):
+    location = str(tmp_path / "yuri.json")
+    config = Config(speaker_type="fake")
+    config.save(location)
+
+    class Eyes:
+        def __init__(self, config):
+            self.config = config
+
+        def configure(self, config):
+            self.config = config
+
+        async def look(self, *args, **kwargs):
+            pass
+
+        async def calibrate(self, inputs, speaker):
+            self.config.left_eye.neutral_x = 42.0
+
+    eyes = Eyes(config.eyes)
+    router = IntentRouter(
+        eyes=eyes,
+        speaker=FakeSpeaker(),
+        inputs=object(),
+        config=config,
+        config_path=location,
+    )
+    watcher = ConfigWatcher(config, location)
+    watch_eyes(watcher, eyes)
+    watcher.follow(router)
+
+    async def tune_then_calibrate():
+        edited = Config(speaker_type="fake", listener_type="pocketsphinx")
+        edited.eyes.upper_lids.movement_smoothing = 0.5
+        edited.save(location)
+        await watcher.check()
+        await router.run("calibrate")
+
+    asyncio.run(tune_then_calibrate())
+    saved = Config.parse_file(location)
+    assert saved.listener_type == "pocketsphinx"
+    assert saved.eyes.upper_lids.movement_smoothing == 0.5
+    assert saved.eyes.left_eye.neutral_x == 42.0
+
+
+def test_noise_profile_sits_beside_the_config(tmp_path):
+    location = str(tmp_path / "robot" / "yuri.json")
+    os.mkdir(os.path.dirname(location))
+    Config().save(location)
+
+    config = ConfigFactory.create(location)
+    expected = str(tmp_path / "robot" / "yuri.noise.json")
+    assert config.noise_profile_path == expected
+    # Saved back as it was written
+    config.save(location)
+    assert Config.parse_file(location).noise_profile_path == "yuri.noise.json"
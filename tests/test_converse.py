@@ -0,0 +1,101 @@
+import asyncio
+import time
+
+from yuri.audio import PCMClip
+from yuri.capture import Segment
+from yuri.converse import PROMPT, Conversation, Turn, take_clauses
+from yuri.listener import Transcription
+from yuri.speaker import FakeSpeaker
+
+
+class ScriptedCapture:
+    def __init__(self, listener):
+        self.listener = listener
+
+    async def segments(self):
+        # The decoder's partial settles well before the VAD ends the segment
+        started_at = time.monotonic()
+        self.listener.on_partial(0, "hello robot")
+        await asyncio.sleep(0.4)
+        yield Segment(
+            clip=PCMClip(data=b"", sample_rate=16000),
+            started_at=started_at,
+            ended_at=time.monotonic(),
+        )
+
+
+class ScriptedListener:
+    def __init__(self):
+        self.on_partial = None
+        self.capture = ScriptedCapture(self)
+
+    def to_audio(self, segment):
+        return segment
+
+    def transcribe(self, audio):
+        return Transcription(text="Hello robot")
+
+
+class ScriptedTextGen:
+    def __init__(self):
+        self.prompts = []
+        self.commits = []
+
+    def ensure_server(self):
+        pass
+
+    def stream(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        yield " Hi there, nice to meet you."
+        yield " I am Yuri."
+        yield "\nHuman: and"
+
+    def generate(self, prompt, **kwargs):
+        self.commits.append((prompt, kwargs["max_tokens"]))
+        return ""
+
+
+def test_take_clauses_keeps_what_is_unfinished():
+    clauses, rest = take_clauses(" Hi, I am Yuri, a robot. And I")
+    assert clauses == ["Hi, I am Yuri, a robot."]
+    assert rest == "And I"
+    assert take_clauses("Hi, there") == ([], "Hi, there")
+
+
+def test_turn_breakdown_charges_each_stage():
+    turn = Turn(
+        speech_ended_at=10.0,
+        transcribed_at=10.9,
+        first_clause_at=10.5,
+        first_audio_at=11.2,
+        speculative=True,
+    )
+    breakdown = turn.breakdown()
+    assert breakdown["transcribe_ms"] == 900.0
+    # Generated ahead of the final transcript, so it added nothing
+    assert breakdown["generate_ms"] == 0.0
+    assert breakdown["speak_ms"] == 700.0
+    assert breakdown["response_ms"] == 1200.0
+    assert breakdown["over_budget"] == ["transcribe"]
+
+
+def test_reply_is_generated_from_a_stable_partial():
+    listener = ScriptedListener()
+    speaker = FakeSpeaker()
+    textgen = ScriptedTextGen()
+    conversation = Conversation(listener, speaker, textgen)
+    try:
+        asyncio.run(conversation.run(max_seconds=10))
+    finally:
+        speaker.close()
+
+    (turn,) = conversation.turns
+    assert turn.speculative
+    assert turn.reply == "Hi there, nice to meet you. I am Yuri."
+    assert turn.response_ms is not None
+    # Generated once, from the partial, and only the turn as it was spoken
+    # is added to the conversation
+    assert textgen.prompts == [PROMPT.format("hello robot")]
+    assert textgen.commits == [
+        (PROMPT.format("Hello robot") + f" {turn.reply}\n", 0)
+    ]
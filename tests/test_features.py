@@ -0,0 +1,25 @@
+import numpy as np
+
+from yuri.features import LogMelFrontend, mel_filterbank
+
+
+def test_streaming_matches_whole_clip():
+    rng = np.random.default_rng(0)
+    samples = rng.standard_normal(16000) * 1000
+    frontend = LogMelFrontend()
+    whole = frontend(samples)
+
+    chunks = [frontend.process(chunk) for chunk in np.split(samples, 50)]
+    assert whole.shape == (49, 40)
+    np.testing.assert_allclose(np.concatenate(chunks), whole, atol=1e-4)
+
+
+def test_mfcc_shape():
+    features = LogMelFrontend(mfcc=13)(np.zeros(8000))
+    assert features.shape == (24, 13)
+
+
+def test_filterbank_covers_the_band():
+    filterbank = mel_filterbank()
+    assert filterbank.shape == (257, 40)
+    assert (filterbank.max(axis=0) > 0.5).all()
@@ -0,0 +1,120 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from yuri.generation import (  # noqa: E402
+    BatchGenerator,
+    ConversationCache,
+    Context,
+    quantize,
+)
+from yuri.textgen_server import Request  # noqa: E402
+
+
+class CharTokenizer:
+    # No end of text, so every reply runs to max_tokens
+    eos_token_id = None
+    bos_token_id = 0
+
+    def encode(self, text):
+        return [ord(c) for c in text]
+
+    def decode(self, ids):
+        return "".join(chr(i) for i in ids)
+
+
+def tiny_generator(**kwargs):
+    torch.manual_seed(0)
+    config = transformers.GPT2Config(
+        vocab_size=128, n_positions=128, n_embd=32, n_layer=2, n_head=2
+    )
+    model = transformers.GPT2LMHeadModel(config)
+    return BatchGenerator(model, CharTokenizer(), top_k=0, **kwargs)
+
+
+def generate(generator, *prompts, conversation=None):
+    # Near-zero temperature: the most likely token every time
+    replies = [[] for _ in prompts]
+    requests = [
+        Request(prompt, 8, 1e-6, reply.append, conversation)
+        for prompt, reply in zip(prompts, replies)
+    ]
+    generator.generate(requests)
+    return ["".join(reply) for reply in replies]
+
+
+def test_cached_turn_matches_the_whole_conversation():
+    generator = tiny_generator()
+    (first,) = generate(generator, "hello", conversation="a")
+    (second,) = generate(generator, " more", conversation="a")
+    assert generator.conversations.hits == 1
+
+    (uncached,) = generate(generator, "hello" + first + " more")
+    assert second == uncached
+
+
+def test_batched_prompts_match_single_ones():
+    generator = tiny_generator()
+    prompts = ["a", "a longer prompt", "mid"]
+    assert generate(generator, *prompts) == [
+        generate(generator, prompt)[0] for prompt in prompts
+    ]
+
+
+def test_context_is_capped():
+    generator = tiny_generator(max_context=20)
+    generate(generator, "x" * 30, conversation="a")
+    context = generator.conversations.take("a")
+    assert len(context.tokens) <= 20
+
+
+def test_evicted_conversation_keeps_its_tokens():
+    cache = ConversationCache(max_bytes=2 * 4 * 10)
+    layer = (torch.zeros(1, 1, 10, 1), torch.zeros(1, 1, 10, 1))
+    cache.put("a", Context(tokens=[1, 2, 3], past=(layer,), length=10))
+    cache.put("b", Context(tokens=[4], past=(layer,), length=10))
+    assert cache.evictions == 1
+
+    evicted = cache.take("a")
+    assert evicted.tokens == [1, 2, 3] and evicted.past is None
+    assert cache.take("b").past is not None
+
+
+def test_quantized_model_generates():
+    generator = tiny_generator()
+    quantize(generator.model)
+    assert not any(
+        type(module).__name__ == "Conv1D"
+        for module in generator.model.modules()
+    )
+    (reply,) = generate(generator, "hello")
+    assert len(reply) == 8
+
+
+def test_uncommitted_turn_leaves_the_conversation():
+    generator = tiny_generator()
+    (first,) = generate(generator, "hello", conversation="a")
+    before = list(generator.conversations.take("a", keep=True).tokens)
+
+    replies = []
+    request = Request(" maybe", 8, 1e-6, replies.append, "a", commit=False)
+    generator.generate([request])
+    assert generator.conversations.take("a", keep=True).tokens == before
+
+    # The turn as it was said is added without generating anything
+    request = Request(" more" + "".join(replies), 0, 1e-6, print, "a")
+    generator.generate([request])
+    context = generator.conversations.take("a")
+    assert context.tokens == before + [ord(c) for c in request.prompt]
+
+
+def test_commit_in_a_batch_generates_nothing():
+    generator = tiny_generator()
+    emitted = []
+    commit = Request("hello", 0, 1e-6, emitted.append, "a")
+    other = Request("longer", 8, 1e-6, lambda text: None, "b")
+    generator.generate([commit, other])
+    assert emitted == []
+    tokens = generator.conversations.take("a").tokens
+    assert tokens == [ord(c) for c in "hello"]
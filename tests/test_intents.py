@@ -0,0 +1,48 @@
+import asyncio
+
+from yuri.intents import INTENTS, IntentRouter, PhraseIndex
+
+
+def commands() -> PhraseIndex:
+    index = PhraseIndex()
+    for intent in INTENTS:
+        for phrase in intent.phrases:
+            index.add(phrase, intent.name)
+    return index
+
+
+def test_commands_match_around_filler_and_typos():
+    index = commands()
+    assert index.match("Yuri, please blink!").intent == "blink"
+    assert index.match("turn lights off").intent == "lights_off"
+
+    match = index.match("look rihgt")
+    assert (match.intent, match.edits) == ("look_right", 1)
+    assert index.match("lihgts bleu").intent == "lights_blue"
+
+
+def test_conversation_falls_through():
+    index = commands()
+    assert index.match("what is the weather like today") is None
+    assert index.match("look") is None
+    # Short words have to be heard right
+    assert index.match("look up") is not None
+    assert index.match("look op") is None
+
+
+class FakeLights:
+    def __init__(self):
+        self.effect = None
+
+    def override(self, effect):
+        self.effect = effect
+
+
+def test_router_only_offers_what_it_can_do():
+    lights = FakeLights()
+    router = IntentRouter(lights=lights)
+    assert router.match("blink") is None
+
+    match = asyncio.run(router.handle("lights red"))
+    assert match.intent == "lights_red"
+    assert lights.effect.frame(0)[0] == (255, 0, 0)
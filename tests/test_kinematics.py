@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from yuri.config import EyesConfig
+from yuri.kinematics import CLOSED, SERVOS, WIDE_OPEN, EyeKinematics, Pose
+
+CONFIG = EyesConfig.parse_obj(
+    {
+        "left_eye": {"neutral_x": 80.0, "neutral_y": 95.0},
+        "right_eye": {"neutral_x": 100.0, "neutral_y": 85.0},
+    }
+)
+
+
+def per_servo_angles(gaze_x, gaze_y):
+    # The per-servo math the eyes used before poses: vertical gaze moves
+    # the eyes in opposite directions (the right is mirrored) and the lids
+    # follow by 0.8 of the eyes' mean offset
+    left, right = CONFIG.left_eye, CONFIG.right_eye
+    left_y = left.neutral_y + gaze_y
+    right_y = right.neutral_y - gaze_y
+    lid_offset = (
+        ((left_y - left.neutral_y) - (right_y - right.neutral_y)) / 2.0 * 0.8
+    )
+    return {
+        "upper_lids": CONFIG.upper_lids.open_y + lid_offset,
+        "lower_lids": CONFIG.lower_lids.open_y - lid_offset,
+        "left_y": left_y,
+        "left_x": left.neutral_x + gaze_x,
+        "right_y": right_y,
+        "right_x": right.neutral_x + gaze_x,
+    }
+
+
+@pytest.mark.parametrize(
+    "gaze_x, gaze_y", [(0.0, 0.0), (15.0, 0.0), (-15.0, 10.0), (0.0, -12.5)]
+)
+def test_open_poses_match_per_servo_angles(gaze_x, gaze_y):
+    angles = EyeKinematics(CONFIG).solve(Pose(gaze_x, gaze_y))
+    assert angles == pytest.approx(per_servo_angles(gaze_x, gaze_y))
+
+
+def test_closed_and_wide_lids_ignore_gaze():
+    kinematics = EyeKinematics(CONFIG)
+    closed = kinematics.solve(Pose(0.0, 10.0, CLOSED))
+    wide = kinematics.solve(Pose(0.0, 10.0, WIDE_OPEN))
+    assert (closed["upper_lids"], closed["lower_lids"]) == (7.0, 10.0)
+    assert (wide["upper_lids"], wide["lower_lids"]) == (12.0, 15.0)
+    assert wide["left_y"] == 105.0
+
+
+def test_angles_stay_in_range():
+    angles = EyeKinematics(CONFIG).solve(Pose(150.0, 0.0))
+    assert angles["right_x"] == 180.0
+
+
+def test_batch_matches_single_poses():
+    kinematics = EyeKinematics(CONFIG)
+    poses = [
+        Pose(0.0, 0.0),
+        Pose(15.0, -10.0, 0.5),
+        Pose(-5.0, 8.0, WIDE_OPEN),
+        Pose(150.0, 0.0, 1.5),
+    ]
+    batch = kinematics.solve_many(np.stack([p.as_array() for p in poses]))
+    assert batch.shape == (len(poses), len(SERVOS))
+    for pose, angles in zip(poses, batch):
+        solved = kinematics.solve(pose)
+        assert angles.tolist() == pytest.approx([solved[s] for s in SERVOS])
@@ -0,0 +1,10 @@
+import pytest
+
+from yuri.config import Config
+from yuri.listener import ListenerFactory
+
+
+def test_keyword_listener_cannot_wake_itself():
+    config = Config(listener_type="keyword", wake_listener_type="keyword")
+    with pytest.raises(ValueError):
+        ListenerFactory.create(config)
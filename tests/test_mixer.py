@@ -0,0 +1,36 @@
+import pytest
+
+from yuri.audio import PCMClip
+from yuri.mixer import AudioMixer, NullSink, Sink
+
+CLIP = PCMClip(data=b"\x00\x01" * 2400, sample_rate=24000)
+
+
+class BrokenSink(Sink):
+    def open(self, sample_rate, block_frames):
+        raise OSError("no output device")
+
+    def write(self, block):
+        raise AssertionError("never opened")
+
+
+def test_clips_finish_playing():
+    mixer = AudioMixer(NullSink())
+    mixer.start()
+    try:
+        voice = mixer.play(CLIP)
+        assert voice.wait(3.0)
+        assert voice.first_sample_at is not None
+    finally:
+        mixer.close()
+
+
+def test_sink_that_fails_to_open_stops_the_mixer():
+    mixer = AudioMixer(BrokenSink())
+    mixer.start()
+    mixer.join(3.0)
+    assert isinstance(mixer.error, OSError)
+    # Nothing is left waiting on a mixer that will never play it
+    with pytest.raises(RuntimeError):
+        mixer.play(CLIP)
+    mixer.close()
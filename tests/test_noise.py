@@ -0,0 +1,73 @@
+import numpy as np
+
+from yuri.noise import NoiseFloor
+
+FRAME = 480
+
+
+def frames_of(signal: np.ndarray) -> np.ndarray:
+    return signal.reshape(-1, FRAME).astype(np.float32)
+
+
+def energies_of(frames: np.ndarray) -> np.ndarray:
+    return np.sqrt(np.mean(frames**2, axis=1))
+
+
+def noise(seconds: float, level: float) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    return rng.standard_normal(int(16000 * seconds)) * level
+
+
+def test_tracks_background_level():
+    floor = NoiseFloor(FRAME, min_threshold=0.0)
+    for _ in range(2):
+        frames = frames_of(noise(1.92, 50.0))
+        floor.update(frames, energies_of(frames))
+
+    assert floor.calibrated
+    assert abs(floor.energy - 50.0) < 5.0
+    assert abs(floor.threshold - 150.0) < 15.0
+
+
+def test_hum_does_not_hide_quiet_speech():
+    hum = np.sin(np.arange(FRAME * 40) * 2 * np.pi * 60 / 16000) * 2000
+    background = frames_of(hum + noise(1.2, 5.0))
+    floor = NoiseFloor(FRAME)
+    floor.update(background, energies_of(background))
+
+    # A voice: 200Hz and its harmonics
+    t = np.arange(FRAME * 4) / 16000
+    voice = sum(np.sin(2 * np.pi * 200 * k * t) for k in range(1, 16)) * 100
+    speech = frames_of(hum[: FRAME * 4] + voice)
+    energies = energies_of(speech)
+
+    assert (energies < floor.threshold).all()
+    assert floor.voiced(speech, energies).all()
+    assert not floor.voiced(background, energies_of(background)).any()
+
+
+def test_profile_survives_restart(tmp_path):
+    path = str(tmp_path / "yuri.noise.json")
+    frames = frames_of(noise(1.2, 40.0))
+    floor = NoiseFloor(FRAME)
+    floor.update(frames, energies_of(frames))
+    floor.save(path)
+
+    restored = NoiseFloor(FRAME)
+    assert restored.load(path)
+    assert restored.calibrated
+    assert restored.threshold == floor.threshold
+    assert not NoiseFloor(FRAME * 2).load(path)
+
+
+def test_unwritable_profile_is_only_logged(tmp_path):
+    # Somewhere no file can be made, even as root: under a regular file
+    blocker = tmp_path / "blocker"
+    blocker.write_text("")
+    frames = frames_of(noise(1.2, 40.0))
+    floor = NoiseFloor(FRAME)
+    floor.update(frames, energies_of(frames))
+
+    floor.save(str(blocker / "yuri.noise.json"))
+    floor.save(str(tmp_path / "missing" / "yuri.noise.json"))
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["blocker"]
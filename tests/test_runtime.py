@@ -0,0 +1,50 @@
+import time
+
+from yuri.runtime import HEADER, Channel, Kind, Message, Supervisor, Worker
+
+
+def echo_worker(config_json, connection):
+    channel = Channel(connection)
+    while True:
+        message = channel.recv()
+        if message.kind == Kind.STOP:
+            return
+        channel.send(Kind.SPOKEN, message.text)
+
+
+def crashing_worker(config_json, connection):
+    raise SystemExit(3)
+
+
+def test_message_round_trip():
+    message = Message(Kind.HEARD, "look léft", sent_at=12.5)
+    data = message.encode()
+    assert len(data) == HEADER.size + len("look léft".encode())
+    assert Message.decode(data) == message
+
+
+def test_crashed_worker_restarts_alone():
+    supervisor = Supervisor(
+        [Worker("speak", echo_worker), Worker("crash", crashing_worker)]
+    )
+    for worker in supervisor.workers.values():
+        supervisor.start(worker)
+    speak = supervisor.workers["speak"]
+
+    spoken = []
+    handle = supervisor.handle
+    supervisor.handle = lambda worker, message: spoken.append(message.text)
+    try:
+        deadline = time.monotonic() + 20.0
+        while supervisor.restarts < 2 and time.monotonic() < deadline:
+            supervisor.step(0.1)
+        supervisor.send("speak", Kind.SAY, "still here")
+        while not spoken and time.monotonic() < deadline:
+            supervisor.step(0.1)
+    finally:
+        supervisor.handle = handle
+        supervisor.stop()
+
+    assert supervisor.workers["crash"].crashes >= 2
+    assert speak.crashes == 0
+    assert speak.process is None and spoken == ["still here"]
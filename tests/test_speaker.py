@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from yuri.audio import PCMClip
+from yuri.config import Config
+from yuri.speaker import Speaker
+
+CONFIG = Config(audio_sink="null", tts_cache_dir=None)
+PHRASE = "Calibrate your left eye, then press the button."
+
+
+class ScriptedSpeaker(Speaker):
+    def __init__(self, config, sample_width=2):
+        super().__init__(config)
+        self.sample_width = sample_width
+        self.encoded = []
+
+    @property
+    def voice(self):
+        return ("scripted",)
+
+    def encode(self, message):
+        self.encoded.append(message)
+        return b"\x00\x01" * 240
+
+    def decode(self, data):
+        return PCMClip(data, 24000, sample_width=self.sample_width)
+
+
+def test_prewarmed_clauses_are_spoken_from_the_cache():
+    speaker = ScriptedSpeaker(CONFIG)
+
+    async def prewarm_then_say():
+        await speaker.prewarm([PHRASE])
+        encoded = len(speaker.encoded)
+        assert encoded > 1
+        assert await speaker.say(PHRASE)
+        return encoded
+
+    try:
+        encoded = asyncio.run(prewarm_then_say())
+    finally:
+        speaker.close()
+    assert len(speaker.encoded) == encoded
+
+
+def test_playback_failure_fails_the_utterance():
+    # Audio the mixer can't take fails each clause rather than leaving the
+    # speech worker stuck behind a dead decoder
+    speaker = ScriptedSpeaker(CONFIG, sample_width=3)
+    message = " ".join([PHRASE] * 4)
+    try:
+        with pytest.raises(ValueError):
+            asyncio.run(asyncio.wait_for(speaker.say(message), 5.0))
+    finally:
+        speaker.close()
+
+
+def test_prewarm_failures_are_not_the_callers():
+    class OfflineSpeaker(ScriptedSpeaker):
+        def encode(self, message):
+            raise ConnectionError("offline")
+
+    speaker = OfflineSpeaker(CONFIG)
+    try:
+        asyncio.run(asyncio.wait_for(speaker.prewarm(["hmm", "hello"]), 5.0))
+    finally:
+        speaker.close()
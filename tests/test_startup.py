@@ -0,0 +1,47 @@
+import os
+import subprocess
+import sys
+
+from yuri.bench import HEAVY_MODULES, command_imports, parse_importtime
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(__file__)), "main.py")
+
+IMPORTTIME = """\
+import time: self [us] | cumulative | imported package
+import time:       387 |        387 |   _io
+import time:       120 |        120 |     yuri.timing
+import time:       250 |        370 |   yuri.lights
+import time:        90 |        460 | main
+import time:         5 |          5 |   yuri.timing
+"""
+
+
+def test_importtime_is_read_by_module():
+    timings = parse_importtime(IMPORTTIME)
+    assert timings["main"].cumulative_us == 460
+    assert timings["main"].depth == 0
+    assert timings["yuri.lights"].depth == 1
+    # A second import is only a lookup
+    assert timings["yuri.timing"].self_us == 120
+
+
+def test_commands_import_only_what_they_use():
+    commands = command_imports(MAIN)
+    assert commands["colors"] == ["yuri.lights"]
+    assert commands["bench converse"] == ["yuri.bench"]
+    assert "yuri.tensor_listen" in commands["train-keywords"]
+
+
+def test_main_loads_no_hardware_or_backends():
+    loaded = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, main; print(' '.join(sys.modules))",
+        ],
+        cwd=os.path.dirname(MAIN),
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    ).stdout.split()
+    assert not set(HEAVY_MODULES) & set(loaded)
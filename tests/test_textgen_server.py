@@ -0,0 +1,44 @@
+import asyncio
+
+from yuri.textgen_server import TextGenClient, TextGenServer
+
+
+class WordGenerator:
+    def __init__(self):
+        self.batches = []
+
+    def generate(self, requests):
+        self.batches.append(sorted(r.prompt for r in requests))
+        for i in range(max(r.max_tokens for r in requests)):
+            for request in requests:
+                if i < request.max_tokens:
+                    request.emit(f" {request.prompt}{i}")
+
+
+def test_concurrent_prompts_share_a_batch_and_stream(tmp_path):
+    socket_path = str(tmp_path / "textgen.sock")
+    generator = WordGenerator()
+    server = TextGenServer(generator, socket_path, batch_window=0.2)
+    client = TextGenClient(socket_path)
+
+    async def scenario():
+        serving = asyncio.ensure_future(server.serve())
+        while not client.available:
+            await asyncio.sleep(0.01)
+
+        loop = asyncio.get_event_loop()
+        results = await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    None, lambda p=p, n=n: list(client.stream(p, n))
+                )
+                for p, n in (("a", 2), ("b", 3), ("c", 1))
+            )
+        )
+        serving.cancel()
+        return results
+
+    results = asyncio.run(scenario())
+    assert results == [[" a0", " a1"], [" b0", " b1", " b2"], [" c0"]]
+    assert generator.batches == [["a", "b", "c"]]
+    assert not client.available
@@ -0,0 +1,24 @@
+import numpy as np
+
+from yuri.trajectory import TrajectoryPlanner, settle_seconds
+
+
+def test_plan_reaches_targets():
+    planner = TrajectoryPlanner(0.02)
+    trajectory = planner.plan([10.0, 20.0], [30.0, 0.0], 0.1)
+
+    assert trajectory.ticks == 5
+    assert np.allclose(trajectory.targets, [30.0, 0.0])
+
+
+def test_plan_is_cached():
+    planner = TrajectoryPlanner(0.02)
+    first = planner.plan([10.0], [30.0], 0.1)
+    second = planner.plan([10.0], [30.0], 0.1)
+
+    assert first is second
+    assert (planner.hits, planner.misses) == (1, 1)
+
+
+def test_settle_seconds():
+    assert settle_seconds(0.8, 0.02) == 0.06
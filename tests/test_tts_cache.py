@@ -0,0 +1,28 @@
+from yuri.audio import PCMClip
+from yuri.tts_cache import TTSCache
+
+CLIP = PCMClip(data=b"\x00\x01" * 800, sample_rate=16000)
+
+
+def test_memory_lru_eviction():
+    cache = TTSCache(max_memory_bytes=len(CLIP.data) * 2)
+    keys = [cache.key(text, ("fake",)) for text in ("a", "b", "c")]
+    for key in keys:
+        cache.put(key, CLIP)
+
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[2]) == CLIP
+    assert cache.stats.evictions == 1
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    key = TTSCache.key("hello", ("fake", "en"))
+    TTSCache(str(tmp_path)).put(key, CLIP)
+
+    cache = TTSCache(str(tmp_path))
+    assert cache.get(key) == CLIP
+    assert cache.stats.disk_hits == 1
+
+
+def test_key_depends_on_voice():
+    assert TTSCache.key("hi", ("a", 160)) != TTSCache.key("hi", ("a", 170))
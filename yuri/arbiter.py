@@ -0,0 +1,135 @@
+import asyncio
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Sequence, Tuple
+
+from yuri.trajectory import Trajectory
+
+if TYPE_CHECKING:
+    from yuri.servos import CachedServo
+
+
+@dataclass(eq=False)
+class Motion:
+    source: str
+    servos: Sequence["CachedServo"]
+    trajectory: Trajectory
+    priority: int
+    done: asyncio.Future
+    tick: int = 0
+
+    @property
+    def finished(self) -> bool:
+        return self.tick >= self.trajectory.ticks
+
+    def angles(self) -> List[float]:
+        return self.trajectory.points[self.tick].tolist()
+
+
+@dataclass
+class ArbiterStats:
+    requests: int = 0
+    # Servo-ticks where equal priority motions were blended together
+    merged: int = 0
+    # Servo-ticks where a higher priority motion masked a lower one
+    overridden: int = 0
+    # Motions superseded by a newer request from the same source
+    cancelled: int = 0
+    writes: int = 0
+    writes_skipped: int = 0
+
+    def reset(self):
+        self.requests = 0
+        self.merged = 0
+        self.overridden = 0
+        self.cancelled = 0
+        self.writes = 0
+        self.writes_skipped = 0
+
+
+# Single owner of the eye servos. Gestures submit trajectories instead of
+# writing angles themselves, and once per tick `step` resolves every request
+# into at most one write per servo:
+#  - a new motion from a source cancels that source's in-flight motions on
+#    the same servos
+#  - between sources the highest priority wins, and motions sharing the top
+#    priority are blended
+class MotionArbiter:
+    def __init__(self):
+        self.stats = ArbiterStats()
+        self._motions: List[Motion] = []
+
+    @property
+    def active(self) -> int:
+        return len(self._motions)
+
+    def submit(
+        self,
+        source: str,
+        servos: Sequence["CachedServo"],
+        trajectory: Trajectory,
+        priority: int = 0,
+    ) -> asyncio.Future:
+        self.stats.requests += 1
+        for motion in list(self._motions):
+            if motion.source == source and any(
+                servo in motion.servos for servo in servos
+            ):
+                self._cancel(motion)
+
+        done = asyncio.get_event_loop().create_future()
+        motion = Motion(
+            source=source,
+            servos=servos,
+            trajectory=trajectory,
+            priority=priority,
+            done=done,
+        )
+        # If the caller goes away (e.g. its task is cancelled) so does its
+        # motion
+        done.add_done_callback(lambda _: self._discard(motion))
+        self._motions.append(motion)
+        return done
+
+    def cancel(self, source: str):
+        for motion in list(self._motions):
+            if motion.source == source:
+                self._cancel(motion)
+
+    def step(self):
+        requests: Dict["CachedServo", List[Tuple[int, float]]] = {}
+        for motion in self._motions:
+            for servo, angle in zip(motion.servos, motion.angles()):
+                requests.setdefault(servo, []).append((motion.priority, angle))
+
+        for servo, candidates in requests.items():
+            top = max(priority for priority, _ in candidates)
+            winners = [
+                angle for priority, angle in candidates if priority == top
+            ]
+            self.stats.overridden += len(candidates) - len(winners)
+            self.stats.merged += len(winners) - 1
+
+            angle = sum(winners) / len(winners)
+            if servo.angle == angle:
+                self.stats.writes_skipped += 1
+                continue
+            servo.angle = angle
+            self.stats.writes += 1
+
+        for motion in list(self._motions):
+            motion.tick += 1
+            if motion.finished:
+                self._motions.remove(motion)
+                if not motion.done.done():
+                    motion.done.set_result(True)
+
+    def _cancel(self, motion: Motion):
+        self.stats.cancelled += 1
+        self._discard(motion)
+        if not motion.done.done():
+            motion.done.set_result(False)
+
+    def _discard(self, motion: Motion):
+        if motion in self._motions:
+            self._motions.remove(motion)
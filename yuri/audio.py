@@ -0,0 +1,59 @@
+import wave
+
+from dataclasses import dataclass
+from io import BytesIO
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class PCMClip:
+    # Interleaved little-endian PCM
+    data: bytes
+    sample_rate: int
+    channels: int = 1
+    sample_width: int = 2
+
+    @property
+    def frames(self) -> int:
+        return len(self.data) // (self.channels * self.sample_width)
+
+    @property
+    def duration(self) -> float:
+        return self.frames / self.sample_rate
+
+    def to_wav(self) -> bytes:
+        wav_fp = BytesIO()
+        with wave.open(wav_fp, "wb") as wav:
+            wav.setnchannels(self.channels)
+            wav.setsampwidth(self.sample_width)
+            wav.setframerate(self.sample_rate)
+            wav.writeframes(self.data)
+        return wav_fp.getvalue()
+
+    @classmethod
+    def from_wav(cls, wav_file) -> "PCMClip":
+        # Accepts a path or a file object
+        with wave.open(wav_file, "rb") as wav:
+            return cls(
+                data=wav.readframes(wav.getnframes()),
+                sample_rate=wav.getframerate(),
+                channels=wav.getnchannels(),
+                sample_width=wav.getsampwidth(),
+            )
+
+
+def to_samples(clip: PCMClip, sample_rate: int) -> np.ndarray:
+    # Mono float32 at `sample_rate`, still in int16 scale
+    if clip.sample_width != 2:
+        raise ValueError("only 16 bit audio is supported")
+
+    samples = np.frombuffer(clip.data, dtype="<i2").astype(np.float32)
+    if clip.channels > 1:
+        samples = samples.reshape(-1, clip.channels).mean(axis=1)
+
+    if clip.sample_rate != sample_rate and len(samples):
+        count = int(round(len(samples) * sample_rate / clip.sample_rate))
+        positions = np.arange(count) * (clip.sample_rate / sample_rate)
+        samples = np.interp(positions, np.arange(len(samples)), samples)
+    return samples.astype(np.float32)
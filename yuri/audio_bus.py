@@ -0,0 +1,161 @@
+import threading
+import time
+
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+
+from loguru import logger
+
+SAMPLE_RATE = 16000
+FRAME_SAMPLES = 1920  # 120ms
+RING_SECONDS = 30.0
+
+
+@dataclass
+class ReaderStats:
+    frames: int = 0
+    # Frames the producer overwrote before this reader got to them
+    overruns: int = 0
+
+
+# The single reader of an audio source. Every frame is read straight into
+# the next slot of a preallocated ring (the only copy the audio ever gets)
+# and published to any number of BusReaders, which each see it through a
+# read-only view of that slot.
+class AudioBus(threading.Thread):
+    def __init__(
+        self,
+        source,
+        frame_samples: int = FRAME_SAMPLES,
+        seconds: float = RING_SECONDS,
+    ):
+        # `source` is anything with a sample_rate, read_into(out) -> bool
+        # and close(), such as the AudioSources in yuri.capture
+        super().__init__(name="audio-bus", daemon=True)
+        self.source = source
+        self.sample_rate = source.sample_rate
+        self.frame_samples = frame_samples
+        self.slots = max(
+            2, int(np.ceil(seconds * self.sample_rate / frame_samples))
+        )
+
+        self.frames = np.zeros((self.slots, frame_samples), dtype="<i2")
+        self.views = self.frames.view()
+        self.views.flags.writeable = False
+        # Monotonic time each slot's frame finished arriving
+        self.times = np.zeros(self.slots)
+        # Total frames ever published; frame indexes are absolute
+        self.published = 0
+        self.finished = threading.Event()
+
+        self._closed = threading.Event()
+        self._condition = threading.Condition()
+
+    @property
+    def written(self) -> int:
+        # Total samples published
+        return self.published * self.frame_samples
+
+    @property
+    def oldest(self) -> int:
+        # Oldest frame that's safe to read. The slot after it may be being
+        # overwritten by the producer right now.
+        return max(0, self.published - self.slots + 1)
+
+    def run(self):
+        try:
+            while not self._closed.is_set():
+                slot = self.published % self.slots
+                if not self.source.read_into(self.frames[slot]):
+                    break
+                with self._condition:
+                    self.times[slot] = time.monotonic()
+                    self.published += 1
+                    self._condition.notify_all()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("audio_bus.failed")
+        finally:
+            self.source.close()
+            with self._condition:
+                self.finished.set()
+                self._condition.notify_all()
+
+    def close(self):
+        self._closed.set()
+        if self.is_alive():
+            self.join()
+
+    def reader(self) -> "BusReader":
+        # Starts at the live edge
+        return BusReader(self, self.published)
+
+    def wait(self, index: int, timeout: Optional[float] = None) -> bool:
+        # Blocks until frame `index` is published; False if the source ended
+        # or the timeout passed first
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self.published > index or self.finished.is_set(),
+                timeout=timeout,
+            )
+            return self.published > index
+
+    def samples(self, start: int, end: int) -> np.ndarray:
+        # A copy of an absolute sample range, clipped to what's still held
+        start = max(start, self.oldest * self.frame_samples)
+        end = min(end, self.written)
+        if end <= start:
+            return np.zeros(0, dtype="<i2")
+        flat = self.views.reshape(-1)
+        capacity = len(flat)
+        first, last = start % capacity, (end - 1) % capacity + 1
+        if first < last:
+            return flat[first:last].copy()
+        return np.concatenate([flat[first:], flat[:last]])
+
+    def time_of(self, position: int) -> float:
+        # When the sample at absolute `position` was captured
+        frame = min(position // self.frame_samples, self.published - 1)
+        frame_end = (frame + 1) * self.frame_samples
+        return (
+            self.times[frame % self.slots]
+            - (frame_end - position) / self.sample_rate
+        )
+
+
+# One consumer's position on the bus. Readers never block the producer or
+# each other: one that falls more than the ring behind skips ahead to the
+# oldest frame still held and counts what it missed as overruns.
+class BusReader:
+    def __init__(self, bus: AudioBus, position: int):
+        self.bus = bus
+        # Absolute index of the next frame to read
+        self.position = position
+        self.stats = ReaderStats()
+
+    @property
+    def available(self) -> int:
+        return self.bus.published - self.position
+
+    def read(
+        self, max_frames: int = 1, timeout: Optional[float] = None
+    ) -> Optional[Tuple[int, np.ndarray]]:
+        # (index of the first frame, read-only (frames, frame_samples) view)
+        # without copying; up to max_frames that are contiguous in the ring.
+        # The view stays valid until the producer laps it, a ring's length
+        # later. None on timeout or once the source has ended.
+        if not self.bus.wait(self.position, timeout):
+            return None
+
+        oldest = self.bus.oldest
+        if self.position < oldest:
+            self.stats.overruns += oldest - self.position
+            self.position = oldest
+
+        slot = self.position % self.bus.slots
+        count = min(max_frames, self.available, self.bus.slots - slot)
+        index = self.position
+        self.position += count
+        self.stats.frames += count
+        return index, self.bus.views[slot : slot + count]
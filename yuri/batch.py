@@ -0,0 +1,181 @@
+import json
+import multiprocessing
+import os
+import time
+
+from dataclasses import dataclass
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    TextIO,
+    Tuple,
+)
+
+from loguru import logger
+
+from yuri.audio import PCMClip
+
+if TYPE_CHECKING:
+    from yuri.config import Config
+
+# Files handed to a worker at a time
+CHUNK_SIZE = 4
+
+# Set once per worker process by _init_worker
+_listener = None
+
+
+@dataclass
+class Job:
+    path: str
+    # Expected transcript, if known
+    reference: Optional[str] = None
+
+
+def find_jobs(source: str) -> List[Job]:
+    # A directory of WAVs, each with an optional reference transcript in a
+    # .txt beside it, or a JSONL manifest of {"path": ..., "text": ...}
+    if os.path.isdir(source):
+        jobs = []
+        for root, _, files in os.walk(source):
+            for name in files:
+                if name.lower().endswith(".wav"):
+                    path = os.path.join(root, name)
+                    jobs.append(Job(path, read_reference(path)))
+        return sorted(jobs, key=lambda job: job.path)
+
+    base = os.path.dirname(os.path.abspath(source))
+    jobs = []
+    with open(source) as manifest:
+        for line in manifest:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            path = os.path.join(base, entry["path"])
+            jobs.append(Job(path, entry.get("text")))
+    return jobs
+
+
+def read_reference(wav_path: str) -> Optional[str]:
+    text_path = os.path.splitext(wav_path)[0] + ".txt"
+    if not os.path.exists(text_path):
+        return None
+    with open(text_path) as text_file:
+        return text_file.read().strip()
+
+
+def words_of(text: str) -> List[str]:
+    cleaned = "".join(c if c.isalnum() or c == "'" else " " for c in text)
+    return cleaned.lower().split()
+
+
+def word_errors(reference: str, hypothesis: str) -> Tuple[int, int]:
+    # (substitutions + deletions + insertions, reference words)
+    expected = words_of(reference)
+    heard = words_of(hypothesis)
+    previous = list(range(len(heard) + 1))
+    for i, word in enumerate(expected, 1):
+        current = [i]
+        for j, other in enumerate(heard, 1):
+            current.append(
+                min(
+                    previous[j] + 1,
+                    current[j - 1] + 1,
+                    previous[j - 1] + (word != other),
+                )
+            )
+        previous = current
+    return previous[-1], len(expected)
+
+
+def percentile(ordered: Sequence[float], percent: float) -> float:
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(len(ordered) * percent / 100.0))
+    return ordered[index]
+
+
+def _init_worker(config_json: str):
+    # The listener is imported and built here, once per worker, so model
+    # loading is paid per process rather than per file and the parent never
+    # loads the hardware and recognizer modules at all
+    from yuri.config import Config
+    from yuri.listener import ListenerFactory
+
+    global _listener  # pylint: disable=global-statement
+    _listener = ListenerFactory.create(Config.parse_raw(config_json))
+
+
+def _transcribe(job: Job) -> dict:
+    result: Dict[str, object] = {"path": job.path}
+    try:
+        clip = PCMClip.from_wav(job.path)
+        started_at = time.monotonic()
+        text = _listener.transcribe_clip(clip).text
+        result["seconds"] = time.monotonic() - started_at
+        result["duration"] = clip.duration
+        result["text"] = text
+    except Exception as error:  # pylint: disable=broad-except
+        result["error"] = repr(error)
+        return result
+
+    if job.reference is not None:
+        errors, words = word_errors(job.reference, text)
+        result["reference"] = job.reference
+        result["errors"] = errors
+        result["words"] = words
+    return result
+
+
+def transcribe_all(
+    config: "Config", jobs: Sequence[Job], processes: Optional[int] = None
+) -> Iterator[dict]:
+    # Results arrive in completion order, not job order
+    config_json = config.json(exclude={"pins"})
+    with multiprocessing.Pool(
+        processes, initializer=_init_worker, initargs=(config_json,)
+    ) as pool:
+        yield from pool.imap_unordered(_transcribe, jobs, CHUNK_SIZE)
+
+
+def run_batch(
+    config: "Config",
+    jobs: Sequence[Job],
+    output: TextIO,
+    processes: Optional[int] = None,
+) -> dict:
+    started_at = time.monotonic()
+    latencies = []
+    audio_seconds = 0.0
+    errors = words = failures = 0
+
+    for result in transcribe_all(config, jobs, processes):
+        output.write(json.dumps(result) + "\n")
+        output.flush()
+        if "error" in result:
+            failures += 1
+            logger.warning("batch.failed", **result)
+            continue
+        latencies.append(result["seconds"])
+        audio_seconds += result["duration"]
+        errors += result.get("errors", 0)
+        words += result.get("words", 0)
+
+    wall_time = time.monotonic() - started_at
+    latencies.sort()
+    return {
+        "files": len(jobs),
+        "failed": failures,
+        "processes": processes or os.cpu_count(),
+        "wall_seconds": round(wall_time, 2),
+        "files_per_second": round(len(latencies) / wall_time, 2),
+        "realtime_factor": round(audio_seconds / wall_time, 2),
+        "wer": round(errors / words, 4) if words else None,
+        "p50_ms": round(1000.0 * percentile(latencies, 50), 1),
+        "p90_ms": round(1000.0 * percentile(latencies, 90), 1),
+        "p99_ms": round(1000.0 * percentile(latencies, 99), 1),
+    }
@@ -0,0 +1,526 @@
+import ast
+import asyncio
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from yuri.audio import PCMClip, to_samples
+from yuri.audio_bus import AudioBus, BusReader
+from yuri.capture import WavFileSource
+from yuri.features import SAMPLE_RATE
+from yuri.kws import KeywordModel, KeywordSpotter
+from yuri.config import Config
+from yuri.converse import Conversation
+from yuri.lights import Lights
+from yuri.listener import ListenerFactory
+from yuri.mixer import AudioMixer, NullSink
+from yuri.runtime import WORKER_NICENESS
+from yuri.speaker import SpeakerFactory
+from yuri.textgen import TextGen
+from yuri.timing import JitterStats, Ticker
+
+# Same period as the servo control loop
+TICK_SECONDS = 0.02
+
+
+async def tick_jitter(seconds: float) -> JitterStats:
+    ticker = Ticker(TICK_SECONDS)
+    stop_at = time.monotonic() + seconds
+    while time.monotonic() < stop_at:
+        await ticker.wait()
+    return ticker.jitter
+
+
+async def lights_tick_jitter(lights: Lights, seconds: float) -> JitterStats:
+    jitter, _ = await asyncio.gather(
+        tick_jitter(seconds), lights.cycle_colors(seconds)
+    )
+    return jitter
+
+
+def lights_jitter(config: Config, seconds: float) -> Dict[str, dict]:
+    # Servo tick lateness while the lights animate, with DotStar output on
+    # the event loop and on its writer thread
+    results = {"idle": asyncio.run(tick_jitter(seconds)).summary()}
+    for mode, threaded in (("inline", False), ("threaded", True)):
+        lights = Lights(config, threaded=threaded)
+        try:
+            jitter = asyncio.run(lights_tick_jitter(lights, seconds))
+        finally:
+            lights.close()
+        results[mode] = jitter.summary()
+    return results
+
+
+def mixer_latency(clips: int = 20) -> dict:
+    # Time from queueing a clip to its first sample reaching the sink, with
+    # the output stream already open
+    clip = PCMClip(
+        data=(np.ones(8000, dtype="<i2") * 1000).tobytes(), sample_rate=16000
+    )
+    mixer = AudioMixer(NullSink())
+    mixer.start()
+    latencies = []
+    try:
+        for _ in range(clips):
+            time.sleep(random.random() * 0.05)
+            voice = mixer.play(clip)
+            voice.wait()
+            latencies.append(voice.latency)
+    finally:
+        mixer.close()
+
+    latencies.sort()
+    return {
+        "clips": clips,
+        "block_ms": round(1000.0 * mixer.block_frames / mixer.sample_rate, 2),
+        "mean_ms": round(1000.0 * sum(latencies) / clips, 2),
+        "max_ms": round(1000.0 * latencies[-1], 2),
+    }
+
+
+def transcribe_latency(
+    config: Config,
+    paths: Sequence[str],
+    listener_types: Sequence[str] = ("sphinx", "pocketsphinx"),
+) -> Dict[str, dict]:
+    # Per-utterance transcription time over a fixed set of recordings. The
+    # pocketsphinx listener is also run restricted to listener_phrases, if
+    # there are any.
+    clips = [PCMClip.from_wav(path) for path in paths]
+    setups = []
+    for listener_type in listener_types:
+        update = {
+            "listener_type": listener_type,
+            "listener_search": "language_model",
+        }
+        setups.append((listener_type, config.copy(update=update)))
+    if "pocketsphinx" in listener_types and config.listener_phrases:
+        for search in ("grammar", "keywords"):
+            update = {
+                "listener_type": "pocketsphinx",
+                "listener_search": search,
+            }
+            setups.append(
+                (f"pocketsphinx-{search}", config.copy(update=update))
+            )
+
+    results = {}
+    for name, listener_config in setups:
+        listener = ListenerFactory.create(listener_config)
+        latencies: List[float] = []
+        texts = []
+        try:
+            for clip in clips:
+                started_at = time.monotonic()
+                texts.append(listener.transcribe_clip(clip).text)
+                latencies.append(time.monotonic() - started_at)
+        finally:
+            listener.close()
+
+        latencies.sort()
+        results[name] = {
+            "utterances": len(latencies),
+            "mean_ms": round(1000.0 * sum(latencies) / len(latencies), 1),
+            "p50_ms": round(1000.0 * latencies[len(latencies) // 2], 1),
+            "max_ms": round(1000.0 * latencies[-1], 1),
+            "texts": texts,
+        }
+    return results
+
+
+def keyword_cpu(
+    config: Config,
+    paths: Sequence[str],
+    listener_types: Sequence[str] = ("pocketsphinx",),
+) -> Dict[str, dict]:
+    # CPU time per second of audio for the always-on keyword spotter, fed
+    # in capture-sized blocks, against full recognizers on the same audio
+    audio = np.concatenate(
+        [
+            to_samples(PCMClip.from_wav(path), SAMPLE_RATE).astype("<i2")
+            for path in paths
+        ]
+    )
+    audio_seconds = len(audio) / SAMPLE_RATE
+
+    def usage(cpu_seconds: float) -> dict:
+        return {
+            "audio_seconds": round(audio_seconds, 1),
+            "cpu_seconds": round(cpu_seconds, 3),
+            "core_percent": round(100.0 * cpu_seconds / audio_seconds, 2),
+        }
+
+    spotter = KeywordSpotter(KeywordModel(config.keyword_model_path))
+    block = 1920
+    started_at = time.process_time()
+    for start in range(0, len(audio), block):
+        spotter.process(audio[start : start + block])
+    results = {"keyword": usage(time.process_time() - started_at)}
+
+    clip = PCMClip(data=audio.tobytes(), sample_rate=SAMPLE_RATE)
+    for listener_type in listener_types:
+        listener = ListenerFactory.create(
+            config.copy(update={"listener_type": listener_type})
+        )
+        try:
+            started_at = time.process_time()
+            listener.transcribe_clip(clip)
+            results[listener_type] = usage(time.process_time() - started_at)
+        finally:
+            listener.close()
+    return results
+
+
+def bus_fanout(path: str, consumers: int = 4) -> Dict[str, dict]:
+    # CPU cost of feeding one recording, paced in real time, to one and to
+    # `consumers` readers of the same bus. Each reader computes frame levels
+    # straight from the ring's views.
+    def consume(reader: BusReader, levels: List[float]):
+        while True:
+            read = reader.read(max_frames=8)
+            if read is None:
+                return
+            _, frames = read
+            levels.append(float(np.abs(frames).mean()))
+
+    results = {}
+    for count in sorted({1, consumers}):
+        bus = AudioBus(WavFileSource(path, realtime=True))
+        readers = [bus.reader() for _ in range(count)]
+        threads = [
+            threading.Thread(target=consume, args=(reader, []))
+            for reader in readers
+        ]
+        started_at = time.process_time()
+        bus.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        bus.join()
+        results[f"{count} consumers"] = {
+            "cpu_ms": round(1000.0 * (time.process_time() - started_at), 1),
+            "frames": sum(reader.stats.frames for reader in readers),
+            "overruns": sum(reader.stats.overruns for reader in readers),
+        }
+    return results
+
+
+def _transcribe_for(
+    config_json: str, paths: Sequence[str], seconds: float, niceness: int
+):
+    if niceness:
+        os.nice(niceness)
+    listener = ListenerFactory.create(Config.parse_raw(config_json))
+    clips = [PCMClip.from_wav(path) for path in paths]
+    stop_at = time.monotonic() + seconds
+    try:
+        while time.monotonic() < stop_at:
+            for clip in clips:
+                listener.transcribe_clip(clip)
+    finally:
+        listener.close()
+
+
+def runtime_jitter(
+    config: Config, paths: Sequence[str], seconds: float
+) -> Dict[str, dict]:
+    # Servo tick lateness while recordings are transcribed nonstop, on a
+    # thread of the same process (as Yuri.run does) and in a niced worker
+    # process (as the Supervisor does)
+    args = (config.json(exclude={"pins"}), paths, seconds)
+    results = {"idle": asyncio.run(tick_jitter(seconds)).summary()}
+
+    thread = threading.Thread(target=_transcribe_for, args=args + (0,))
+    thread.start()
+    results["thread"] = asyncio.run(tick_jitter(seconds)).summary()
+    thread.join()
+
+    context = multiprocessing.get_context("spawn")
+    process = context.Process(
+        target=_transcribe_for, args=args + (WORKER_NICENESS,)
+    )
+    process.start()
+    results["process"] = asyncio.run(tick_jitter(seconds)).summary()
+    process.join()
+    return results
+
+
+# Turns of a conversation, each only what's new since the last reply
+CONVERSATION = [
+    "Yuri is a robot with big eyes.\nHuman: Hello, who are you?\nYuri:",
+    "\nHuman: What can you see?\nYuri:",
+    "\nHuman: Do you like the lights?\nYuri:",
+    "\nHuman: What should we do today?\nYuri:",
+    "\nHuman: Goodbye!\nYuri:",
+]
+
+
+def resident_mb() -> float:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024.0
+    return 0.0
+
+
+def _textgen_speed(int8: bool, threads: int, max_tokens: int, results):
+    import torch
+
+    from yuri.generation import BatchGenerator
+    from yuri.textgen_server import TEMPERATURE, Request
+
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, range(min(threads, os.cpu_count())))
+    torch.set_num_threads(threads)
+    torch.manual_seed(0)
+
+    started_at = time.monotonic()
+    generator = BatchGenerator.load(int8=int8)
+    load_seconds = time.monotonic() - started_at
+    loaded_mb = resident_mb()
+
+    def turn(prompt: str, conversation=None):
+        pieces: List[str] = []
+        request = Request(
+            prompt, max_tokens, TEMPERATURE, pieces.append, conversation
+        )
+        started_at = time.monotonic()
+        generator.generate([request])
+        return "".join(pieces), len(pieces), time.monotonic() - started_at
+
+    # Every turn sends the whole conversation so far, as callers had to
+    # before the cache, then just the new turn to a cached conversation
+    runs = {}
+    for mode in ("full", "cached"):
+        transcript = ""
+        tokens = 0
+        seconds = []
+        for prompt in CONVERSATION:
+            if mode == "full":
+                transcript += prompt
+                reply, count, elapsed = turn(transcript)
+                transcript += reply
+            else:
+                _, count, elapsed = turn(prompt, conversation="bench")
+            tokens += count
+            seconds.append(elapsed)
+        runs[mode] = {
+            "tokens_per_second": round(tokens / sum(seconds), 1),
+            "last_turn_ms": round(1000.0 * seconds[-1], 1),
+        }
+
+    results.put(
+        {
+            "load_seconds": round(load_seconds, 2),
+            "resident_mb": round(loaded_mb, 1),
+            "peak_resident_mb": round(resident_mb(), 1),
+            "cache_mb": round(generator.conversations.nbytes / 2**20, 1),
+            **{
+                f"{mode}_{k}": v
+                for mode, run in runs.items()
+                for k, v in run.items()
+            },
+        }
+    )
+
+
+def textgen_speed(threads: int = 4, max_tokens: int = 32) -> Dict[str, dict]:
+    # GPT-2 with full precision and int8 weights, each in a fresh process
+    # limited to `threads` cores so resident memory is its own
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for name, int8 in (("fp32", False), ("int8", True)):
+        queue = context.Queue()
+        process = context.Process(
+            target=_textgen_speed, args=(int8, threads, max_tokens, queue)
+        )
+        process.start()
+        results[name] = queue.get()
+        process.join()
+    return results
+
+
+def converse_latency(
+    config: Config,
+    paths: Sequence[str],
+    gap_seconds: float = 8.0,
+    max_seconds: Optional[float] = None,
+) -> dict:
+    # End of each recorded utterance to the robot's first audio, through
+    # the whole converse pipeline. The recordings are played in real time
+    # with `gap_seconds` of silence after each for the reply, which goes to
+    # the null sink.
+    config = config.copy(update={"audio_sink": "null"})
+    textgen = TextGen(config)
+    textgen.ensure_server()
+    source = WavFileSource(paths, realtime=True, trailing_silence=gap_seconds)
+    listener = ListenerFactory.create(config, source=source)
+    speaker = SpeakerFactory.create(config)
+    conversation = Conversation(listener, speaker, textgen)
+    try:
+        asyncio.run(conversation.run(max_seconds))
+    finally:
+        speaker.close()
+        listener.close()
+
+    return {
+        **conversation.summary(),
+        "response_ms": [turn.response_ms for turn in conversation.turns],
+    }
+
+
+# Third-party modules no command should load unless it uses what they're for
+HEAVY_MODULES = (
+    "adafruit_dotstar",
+    "adafruit_motor",
+    "adafruit_pca9685",
+    "board",
+    "busio",
+    "digitalio",
+    "gtts",
+    "pocketsphinx",
+    "pyaudio",
+    "pydub",
+    "pyttsx3",
+    "speech_recognition",
+    "tensorflow",
+    "tflite_runtime",
+    "torch",
+    "transformers",
+)
+# What the callback runs when main.py is given no command
+NO_COMMAND = "(no command)"
+
+
+@dataclass
+class ImportTime:
+    self_us: int
+    cumulative_us: int
+    # 0 for what the command line imported, 1 for what those imported...
+    depth: int
+
+
+def parse_importtime(stderr: str) -> Dict[str, ImportTime]:
+    # Timings by module from `python -X importtime`. A module imported
+    # twice keeps its first (real) timing.
+    modules: Dict[str, ImportTime] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        self_us, cumulative_us, module = fields
+        # Nested imports are indented two more spaces than their importer
+        depth = (len(module) - len(module.lstrip()) - 1) // 2
+        modules.setdefault(
+            module.strip(), ImportTime(int(self_us), int(cumulative_us), depth)
+        )
+    return modules
+
+
+def command_imports(main_path: str) -> Dict[str, List[str]]:
+    # The yuri modules each command in main.py imports when it runs, by
+    # its name on the command line
+    with open(main_path) as main_file:
+        tree = ast.parse(main_file.read())
+    commands = {}
+    for node in tree.body:
+        if not isinstance(node, ast.FunctionDef):
+            continue
+        for decorator in node.decorator_list:
+            if not (
+                isinstance(decorator, ast.Call)
+                and isinstance(decorator.func, ast.Attribute)
+                and isinstance(decorator.func.value, ast.Name)
+            ):
+                continue
+            if decorator.func.attr == "callback":
+                name = NO_COMMAND
+            elif decorator.func.attr == "command":
+                if decorator.args:
+                    name = ast.literal_eval(decorator.args[0])
+                else:
+                    name = node.name.replace("_", "-")
+                if decorator.func.value.id != "app":
+                    name = f"{decorator.func.value.id} {name}"
+            else:
+                continue
+            commands[name] = sorted(
+                {
+                    child.module
+                    for child in ast.walk(node)
+                    if isinstance(child, ast.ImportFrom)
+                    and child.module
+                    and child.module.split(".")[0] == "yuri"
+                }
+            )
+    return commands
+
+
+def command_startup(main_path: str, modules: Sequence[str]) -> dict:
+    # Imports main.py and then the command's own modules in a fresh
+    # interpreter, as running the command would
+    statements = ["import main"] + [f"import {name}" for name in modules]
+    started_at = time.monotonic()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "; ".join(statements)],
+        cwd=os.path.dirname(os.path.abspath(main_path)),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    wall_ms = 1000 * (time.monotonic() - started_at)
+    if result.returncode != 0:
+        return {"error": result.stderr.strip().splitlines()[-1]}
+    timings = parse_importtime(result.stderr)
+    return {"wall_ms": round(wall_ms, 1), "imports": timings}
+
+
+def startup_imports(
+    main_path: str, commands: Optional[Sequence[str]] = None, top: int = 5
+) -> Dict[str, dict]:
+    # Cold start import time of each command: the total, the `top`
+    # packages costing the most (cumulatively, with everything they
+    # import) and any heavy modules loaded along the way
+    known = command_imports(main_path)
+    results = {}
+    for name in commands or known:
+        if name not in known:
+            raise ValueError(f"no command {name!r} in {main_path}")
+        startup = command_startup(main_path, known[name])
+        if "error" in startup:
+            results[name] = startup
+            continue
+        timings = startup.pop("imports")
+        # main.py's own imports and the command's, with everything each of
+        # them pulls in
+        direct = {
+            module: timing.cumulative_us
+            for module, timing in timings.items()
+            if timing.depth <= 1 and module != "main"
+        }
+        heaviest = sorted(direct, key=direct.get, reverse=True)[:top]
+        results[name] = {
+            **startup,
+            "import_ms": round(
+                sum(timing.self_us for timing in timings.values()) / 1000, 1
+            ),
+            "modules": len(timings),
+            "heaviest_ms": {
+                module: round(direct[module] / 1000, 1) for module in heaviest
+            },
+            "heavy": [module for module in HEAVY_MODULES if module in timings],
+        }
+    return results
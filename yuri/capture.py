@@ -0,0 +1,389 @@
+import asyncio
+import queue
+import threading
+import time
+
+from abc import abstractmethod, ABCMeta
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from loguru import logger
+
+from yuri.audio import PCMClip, to_samples
+from yuri.audio_bus import AudioBus
+from yuri.noise import NoiseFloor
+
+SAMPLE_RATE = 16000
+FRAME_SAMPLES = 480  # 30ms, the VAD's resolution
+BLOCK_FRAMES = 4  # VAD frames per AudioBus frame
+# Utterances kept for next_segment(); older ones are dropped if nobody reads
+SEGMENT_BACKLOG = 16
+# Bus frames processed at once when the VAD has fallen behind
+READ_FRAMES = 8
+READ_TIMEOUT = 0.1
+NOISE_SAVE_INTERVAL = 60.0
+
+
+class AudioSource(metaclass=ABCMeta):
+    sample_rate: int = SAMPLE_RATE
+
+    @abstractmethod
+    def read(self, samples: int) -> Optional[np.ndarray]:
+        # Blocks for the next `samples` of mono int16 audio. None once the
+        # source is exhausted.
+        raise NotImplementedError()
+
+    def read_into(self, out: np.ndarray) -> bool:
+        # Fills `out` in place, for the AudioBus; False once exhausted
+        samples = self.read(len(out))
+        if samples is None:
+            return False
+        out[:] = samples
+        return True
+
+    def close(self):
+        pass
+
+
+class MicrophoneSource(AudioSource):
+    def __init__(self, sample_rate: int = SAMPLE_RATE):
+        import pyaudio
+
+        self.sample_rate = sample_rate
+        self.audio = pyaudio.PyAudio()
+        self.stream = self.audio.open(
+            format=pyaudio.paInt16,
+            channels=1,
+            rate=sample_rate,
+            input=True,
+            frames_per_buffer=FRAME_SAMPLES * BLOCK_FRAMES,
+        )
+
+    def read(self, samples: int) -> Optional[np.ndarray]:
+        data = self.stream.read(samples, exception_on_overflow=False)
+        return np.frombuffer(data, dtype="<i2")
+
+    def close(self):
+        self.stream.stop_stream()
+        self.stream.close()
+        self.audio.terminate()
+
+
+# Plays a recording, or several one after another, in place of the
+# microphone, for tests and benchmarks. With `realtime` the reads are paced
+# like a live device from the first read on.
+class WavFileSource(AudioSource):
+    def __init__(
+        self,
+        path: Union[str, Sequence[str]],
+        sample_rate: int = SAMPLE_RATE,
+        realtime: bool = False,
+        trailing_silence: float = 1.0,
+    ):
+        self.sample_rate = sample_rate
+        self.realtime = realtime
+        # Lets the VAD see the end of a phrase that runs to the end of file
+        silence = np.zeros(int(trailing_silence * sample_rate), dtype="<i2")
+        pieces = []
+        for wav in [path] if isinstance(path, str) else path:
+            clip = PCMClip.from_wav(wav)
+            pieces += [to_samples(clip, sample_rate).astype("<i2"), silence]
+        self.samples = np.concatenate(pieces)
+        self.position = 0
+        self.deadline: Optional[float] = None
+
+    def read(self, samples: int) -> Optional[np.ndarray]:
+        if self.position >= len(self.samples):
+            return None
+
+        chunk = self.samples[self.position : self.position + samples]
+        self.position += samples
+        if len(chunk) < samples:
+            chunk = np.pad(chunk, (0, samples - len(chunk)))
+
+        if self.realtime:
+            if self.deadline is None:
+                self.deadline = time.monotonic()
+            self.deadline += samples / self.sample_rate
+            delay = self.deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        return chunk
+
+
+# Energy VAD over fixed frames. Frame energies for a whole block are computed
+# in one go; the per-frame state machine only compares booleans. Frames
+# outside utterances keep the noise floor, and so the threshold, current.
+class VoiceActivityDetector:
+    def __init__(
+        self,
+        frame_samples: int = FRAME_SAMPLES,
+        threshold: Optional[float] = None,
+        speech_frames: int = 3,
+        silence_frames: int = 27,
+        pre_roll_frames: int = 10,
+        max_frames: int = 500,
+        noise: Optional[NoiseFloor] = None,
+    ):
+        # A fixed `threshold` turns off the adaptive noise floor
+        self.frame_samples = frame_samples
+        self.fixed_threshold = threshold
+        self.speech_frames = speech_frames
+        self.silence_frames = silence_frames
+        self.pre_roll_frames = pre_roll_frames
+        self.max_frames = max_frames
+        self.noise = noise or NoiseFloor(frame_samples)
+
+        self._voiced_run = 0
+        self._silent_run = 0
+        self._start: Optional[int] = None
+
+    @property
+    def in_speech(self) -> bool:
+        return self._start is not None
+
+    @property
+    def start(self) -> Optional[int]:
+        # Where the current utterance began, pre-roll included
+        return self._start
+
+    @property
+    def threshold(self) -> Optional[float]:
+        if self.fixed_threshold is not None:
+            return self.fixed_threshold
+        return self.noise.threshold
+
+    def frames(self, samples: np.ndarray) -> np.ndarray:
+        return samples.reshape(-1, self.frame_samples).astype(np.float32)
+
+    def energies(self, samples: np.ndarray) -> np.ndarray:
+        return np.sqrt(np.mean(self.frames(samples) ** 2, axis=1))
+
+    def process(
+        self, samples: np.ndarray, offset: int
+    ) -> List[Tuple[int, int]]:
+        # `offset` is the absolute index of samples[0]. Returns the sample
+        # ranges of any utterances that ended in this block.
+        frames = self.frames(samples)
+        energies = np.sqrt(np.mean(frames**2, axis=1))
+        if self.fixed_threshold is not None:
+            voiced = energies > self.fixed_threshold
+        else:
+            voiced = self.noise.voiced(frames, energies)
+        # Frames outside any utterance that teach the noise floor
+        background = np.zeros(len(frames), dtype=bool)
+
+        segments = []
+        for index, is_voiced in enumerate(voiced.tolist()):
+            frame_start = offset + index * self.frame_samples
+            frame_end = frame_start + self.frame_samples
+
+            if self._start is None:
+                self._voiced_run = self._voiced_run + 1 if is_voiced else 0
+                if self._voiced_run >= self.speech_frames:
+                    frames_back = self._voiced_run + self.pre_roll_frames
+                    self._start = max(
+                        0, frame_end - frames_back * self.frame_samples
+                    )
+                    self._silent_run = 0
+                background[index] = self._voiced_run == 0
+                continue
+
+            self._silent_run = 0 if is_voiced else self._silent_run + 1
+            too_long = (
+                frame_end - self._start >= self.max_frames * self.frame_samples
+            )
+            if self._silent_run >= self.silence_frames or too_long:
+                end = frame_end - self._silent_run * self.frame_samples
+                segments.append((self._start, end))
+                self._start = None
+                self._voiced_run = 0
+
+        if self.fixed_threshold is None:
+            self.noise.update(frames[background], energies[background])
+        return segments
+
+    def flush(self, end: int) -> List[Tuple[int, int]]:
+        if self._start is None:
+            return []
+        segment = (self._start, end)
+        self._start = None
+        return [segment]
+
+
+@dataclass
+class Segment:
+    clip: PCMClip
+    # Monotonic times the first and last samples were captured
+    started_at: float
+    ended_at: float
+    # Absolute sample index of the first sample, identifying the utterance
+    # across next_segment() and stream()
+    start: int = 0
+
+
+# Runs the VAD over an AudioBus on its own thread. The bus keeps capturing
+# while earlier utterances are transcribed, and utterances found by the VAD
+# are handed to consumers as Segments.
+class AudioCapture(threading.Thread):
+    def __init__(
+        self,
+        bus: AudioBus,
+        vad: Optional[VoiceActivityDetector] = None,
+        noise_profile_path: Optional[str] = None,
+    ):
+        super().__init__(name="audio-capture", daemon=True)
+        self.bus = bus
+        self.sample_rate = bus.sample_rate
+        self.vad = vad or VoiceActivityDetector()
+        self.noise_profile_path = noise_profile_path
+        self.reader = bus.reader()
+        self.finished = threading.Event()
+        # Absolute index of the next sample the VAD will see
+        self.position = self.reader.position * bus.frame_samples
+
+        self._closed = threading.Event()
+        self._segments: "queue.Queue[Optional[Segment]]" = queue.Queue(
+            maxsize=SEGMENT_BACKLOG
+        )
+        # (loop, queue) for each async consumer
+        self._subscribers: List[Tuple] = []
+        self._streams: List["queue.Queue"] = []
+        # How far into the current utterance the streams have been fed
+        self._streamed: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def run(self):
+        saved_at = time.monotonic()
+        try:
+            while not self._closed.is_set():
+                read = self.reader.read(READ_FRAMES, timeout=READ_TIMEOUT)
+                if read is None:
+                    if self.bus.finished.is_set():
+                        break
+                    continue
+                index, frames = read
+                if time.monotonic() - saved_at > NOISE_SAVE_INTERVAL:
+                    self.save_noise_profile()
+                    saved_at = time.monotonic()
+
+                # A view of the bus's ring, not a copy
+                samples = frames.reshape(-1)
+                offset = index * self.bus.frame_samples
+                self.position = offset + len(samples)
+                for start, end in self.vad.process(samples, offset):
+                    self._stream(start, end, final=True)
+                    self._deliver(self._segment(start, end))
+                if self.vad.in_speech:
+                    self._stream(self.vad.start, self.position)
+
+            for start, end in self.vad.flush(self.position):
+                self._stream(start, end, final=True)
+                self._deliver(self._segment(start, end))
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("capture.failed")
+        finally:
+            self.save_noise_profile()
+            logger.debug(
+                "capture.done",
+                frames=self.reader.stats.frames,
+                overruns=self.reader.stats.overruns,
+            )
+            self.finished.set()
+            self._deliver(None)
+            with self._lock:
+                streams = list(self._streams)
+            for stream in streams:
+                stream.put((None, None))
+
+    def save_noise_profile(self):
+        # Also runs as capture ends, where raising would leave consumers
+        # waiting on segments and streams that never end
+        if self.noise_profile_path is None:
+            return
+        try:
+            self.vad.noise.save(self.noise_profile_path)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("noise.save_failed", path=self.noise_profile_path)
+
+    def close(self):
+        self._closed.set()
+        if self.is_alive():
+            self.join()
+
+    def next_segment(
+        self, timeout: Optional[float] = None
+    ) -> Optional[Segment]:
+        # Blocks until the next utterance; None once capture has stopped
+        try:
+            return self._segments.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def stream(self) -> "queue.Queue":
+        # For recognizers that decode while the speaker is still talking.
+        # Gets (start, samples) chunks as each utterance is captured, then
+        # (start, None) once it ends; `start` matches Segment.start.
+        # (None, None) means capture has stopped.
+        chunks: "queue.Queue" = queue.Queue()
+        with self._lock:
+            self._streams.append(chunks)
+        return chunks
+
+    async def segments(self):
+        loop = asyncio.get_event_loop()
+        segments: asyncio.Queue = asyncio.Queue()
+        with self._lock:
+            self._subscribers.append((loop, segments))
+        try:
+            while True:
+                segment = await segments.get()
+                if segment is None:
+                    return
+                yield segment
+        finally:
+            with self._lock:
+                self._subscribers.remove((loop, segments))
+
+    def _segment(self, start: int, end: int) -> Segment:
+        samples = self.bus.samples(start, end)
+        return Segment(
+            clip=PCMClip(data=samples.tobytes(), sample_rate=self.sample_rate),
+            started_at=self.bus.time_of(start),
+            ended_at=self.bus.time_of(end),
+            start=start,
+        )
+
+    def _stream(self, start: int, end: int, final: bool = False):
+        with self._lock:
+            streams = list(self._streams)
+        position = start if self._streamed is None else self._streamed
+        self._streamed = None if final else max(position, end)
+        if not streams:
+            return
+
+        chunks = []
+        if end > position:
+            chunks.append((start, self.bus.samples(position, end)))
+        if final:
+            chunks.append((start, None))
+        for stream in streams:
+            for chunk in chunks:
+                stream.put(chunk)
+
+    def _deliver(self, segment: Optional[Segment]):
+        while True:
+            try:
+                self._segments.put_nowait(segment)
+                break
+            except queue.Full:
+                try:
+                    self._segments.get_nowait()
+                except queue.Empty:
+                    pass
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for loop, segments in subscribers:
+            loop.call_soon_threadsafe(segments.put_nowait, segment)
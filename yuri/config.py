@@ -1,31 +1,38 @@
 from pydantic import BaseModel
 
-import board
 import json
-from typing import Optional
+import os
+import tempfile
+from typing import List, Optional
 from loguru import logger
 
-Pin = board.pin.Pin
+# Paths in the config file that are relative to the file itself
+RELATIVE_PATHS = ("noise_profile_path",)
 
 
+# Pins by their name on `board`, which is only imported (and the hardware
+# probed) when a pin is actually used
 class PinsConfig(BaseModel):
-    dotstar_clock: Pin = board.D6
-    dotstar_data: Pin = board.D5
-    button: Pin = board.D17
-    joydown: Pin = board.D27
-    joyleft: Pin = board.D22
-    joyup: Pin = board.D23
-    joyright: Pin = board.D24
-    joyselect: Pin = board.D16
+    dotstar_clock: str = "D6"
+    dotstar_data: str = "D5"
+    button: str = "D17"
+    joydown: str = "D27"
+    joyleft: str = "D22"
+    joyup: str = "D23"
+    joyright: str = "D24"
+    joyselect: str = "D16"
 
-    class Config:
-        arbitrary_types_allowed = True
+    def pin(self, name: str):
+        import board
+
+        return getattr(board, getattr(self, name))
 
 
 class EyeConfig(BaseModel):
     neutral_x: Optional[float] = None
     neutral_y: Optional[float] = None
     movement_smoothing: float = 0.80
+    movement_seconds: Optional[float] = None
 
 
 class LidsConfig(BaseModel):
@@ -33,6 +40,7 @@ class LidsConfig(BaseModel):
     open_y: float
     wide_open_y: float
     movement_smoothing: float = 0.80
+    movement_seconds: Optional[float] = None
 
 
 class EyesConfig(BaseModel):
@@ -52,27 +60,85 @@ class EyesConfig(BaseModel):
 
 class Config(BaseModel):
     listener_type: str = "sphinx"
+    # pocketsphinx only: "language_model", or "grammar"/"keywords" to only
+    # recognize listener_phrases
+    listener_search: str = "language_model"
+    listener_phrases: List[str] = []
+    # "keyword" listener: the int8 model from yuri/tensor_listen.py, and the
+    # keywords that wake wake_listener_type to recognize what follows. Any
+    # other keyword is taken as a command by itself.
+    keyword_model_path: str = "models/kws.tflite"
+    keyword_threshold: float = 0.8
+    wake_words: List[str] = []
+    wake_listener_type: str = "pocketsphinx"
     speaker_type: str = "google"
+    tts_cache_dir: Optional[str] = "~/.cache/yuri/tts"
+    tts_cache_memory_mb: int = 32
+    audio_sink: str = "pyaudio"
+    audio_sink_path: Optional[str] = None
+    # Where the text generation server listens
+    textgen_socket: str = "~/.cache/yuri/textgen.sock"
+    # Settings the server starts with: int8 weights to save memory, and
+    # caps on the tokens of context and attention cache per conversation
+    textgen_int8: bool = False
+    textgen_max_context: int = 512
+    textgen_cache_mb: int = 128
+    textgen_threads: Optional[int] = None
+    # Learned background noise, so the VAD starts out calibrated; next to
+    # the config file unless given as an absolute path
+    noise_profile_path: Optional[str] = "yuri.noise.json"
     pins: PinsConfig = PinsConfig()
     eyes: EyesConfig = EyesConfig()
 
     def save(self, location: str):
-        with open(location, "w") as config_file:
-            config_file.write(
-                json.dumps(self.dict(exclude={"pins"}), indent=2)
-            )
+        # Written beside the old file and renamed over it, so anything
+        # reading or watching it only ever sees a whole config
+        directory = os.path.dirname(os.path.abspath(location))
+        obj = self.dict()
+        for name in RELATIVE_PATHS:
+            if obj[name] is not None and os.path.isabs(obj[name]):
+                relative = os.path.relpath(obj[name], directory)
+                if not relative.startswith(os.pardir):
+                    obj[name] = relative
+        fd, temp_path = tempfile.mkstemp(
+            dir=directory, prefix=".yuri.", suffix=".json"
+        )
+        try:
+            # mkstemp makes it private; keep the permissions it replaces
+            try:
+                os.chmod(temp_path, os.stat(location).st_mode & 0o777)
+            except FileNotFoundError:
+                os.chmod(temp_path, 0o644)
+            with os.fdopen(fd, "w") as config_file:
+                config_file.write(json.dumps(obj, indent=2))
+                config_file.flush()
+                os.fsync(config_file.fileno())
+            os.replace(temp_path, location)
+        except BaseException:
+            os.remove(temp_path)
+            raise
 
 
 class ConfigFactory:
     @classmethod
-    def create(cls, location: str) -> Config:
+    def create(cls, location: str, strict: bool = False) -> Config:
+        # Strict raises on a config that doesn't parse rather than falling
+        # back to the defaults
         with open(location) as config_file:
             obj = {}
             try:
                 obj = json.loads(config_file.read())
             except json.JSONDecodeError:
+                if strict:
+                    raise
                 logger.warning("error parsing config")
 
             config = Config.parse_obj(obj)
 
+        directory = os.path.dirname(os.path.abspath(location))
+        for name in RELATIVE_PATHS:
+            path = getattr(config, name)
+            if path is not None:
+                path = os.path.expanduser(path)
+                setattr(config, name, os.path.join(directory, path))
         return config
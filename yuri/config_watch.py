@@ -0,0 +1,191 @@
+import asyncio
+import inspect
+import os
+import time
+
+from dataclasses import dataclass
+from typing import (
+    TYPE_CHECKING,
+    Awaitable,
+    Callable,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+from loguru import logger
+
+from yuri.config import Config, ConfigFactory
+
+if TYPE_CHECKING:
+    from yuri.servos import Eyes
+
+# How often the config file is checked for changes
+POLL_SECONDS = 0.25
+# Everything a speaker is built from; any of them changing means a new one
+SPEAKER_SECTIONS = (
+    "speaker_type",
+    "tts_cache_dir",
+    "tts_cache_memory_mb",
+    "audio_sink",
+    "audio_sink_path",
+)
+
+Apply = Callable[[Config], Optional[Awaitable]]
+
+
+def changed_sections(old: Config, new: Config) -> Set[str]:
+    # Top-level fields of the config that differ, "eyes" for any change to
+    # the eyes and so on
+    old_fields = old.dict()
+    return {
+        name
+        for name, value in new.dict().items()
+        if old_fields.get(name) != value
+    }
+
+
+# The config file on disk, noticed changing by its mtime, size and inode
+# (Config.save renames a new file over it). Polled rather than watched with
+# inotify, which would need another dependency and doesn't survive an
+# editor replacing the file.
+class ConfigFile:
+    def __init__(self, location: str):
+        self.location = location
+        self.stamp = self.read_stamp()
+
+    def read_stamp(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(self.location)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def changed(self) -> Optional[Config]:
+        # The new config once the file has changed and parses; half-written
+        # or invalid files are skipped until they're fixed
+        stamp = self.read_stamp()
+        if stamp == self.stamp or stamp is None:
+            return None
+        self.stamp = stamp
+        try:
+            return ConfigFactory.create(self.location, strict=True)
+        except (OSError, ValueError) as error:
+            logger.warning(
+                "config.invalid", location=self.location, error=str(error)
+            )
+            return None
+
+
+@dataclass
+class Subscriber:
+    sections: Set[str]
+    apply: Apply
+
+
+# Pushes config changes into the running subsystems. Each subscriber names
+# the sections it can take live and is only handed a new config when one
+# of them changed; changes nobody takes are logged as needing a restart.
+class ConfigWatcher:
+    def __init__(
+        self,
+        config: Config,
+        location: Optional[str] = None,
+        interval: float = POLL_SECONDS,
+    ):
+        # Without a location, new configs only arrive through update()
+        self.config = config
+        self.file = None if location is None else ConfigFile(location)
+        self.interval = interval
+        self.subscribers: List[Subscriber] = []
+        self.followers: List[object] = []
+
+    def follow(self, holder: object):
+        # Keeps `holder.config` the latest config, for whatever reads or
+        # saves it later
+        self.followers.append(holder)
+
+    def subscribe(self, sections: Iterable[str], apply: Apply):
+        # `apply` may be a coroutine function
+        self.subscribers.append(Subscriber(set(sections), apply))
+
+    async def update(self, config: Config) -> Set[str]:
+        # Hands `config` to the subscribers of whatever changed, returning
+        # the changed sections none of them took
+        started_at = time.perf_counter()
+        changed = changed_sections(self.config, config)
+        self.config = config
+        for holder in self.followers:
+            holder.config = config
+        if not changed:
+            return changed
+
+        applied: Set[str] = set()
+        for subscriber in self.subscribers:
+            if not subscriber.sections & changed:
+                continue
+            try:
+                result = subscriber.apply(config)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("config.apply_failed")
+                continue
+            applied |= subscriber.sections & changed
+
+        logger.info(
+            "config.reloaded",
+            applied=sorted(applied),
+            ms=round(1000 * (time.perf_counter() - started_at), 1),
+        )
+        return changed - applied
+
+    async def check(self) -> Set[str]:
+        if self.file is None:
+            return set()
+        config = self.file.changed()
+        if config is None:
+            return set()
+        unapplied = await self.update(config)
+        if unapplied:
+            logger.warning("config.needs_restart", sections=sorted(unapplied))
+        return unapplied
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.check()
+
+
+def watch_eyes(watcher: ConfigWatcher, eyes: "Eyes"):
+    # Smoothing and movement times are read on every gesture; new neutral
+    # angles are moved to straight away, without waiting for the move
+    from yuri.servos import EYE_CHANNELS
+
+    def apply(config: Config):
+        eyes.configure(config.eyes)
+        asyncio.ensure_future(
+            eyes.look(eyes.pose, tuple(EYE_CHANNELS), source="config")
+        )
+
+    watcher.subscribe(("eyes",), apply)
+
+
+def watch_speaker(watcher: ConfigWatcher, holders: Sequence[object]):
+    # Builds a speaker from the new config before handing it to every
+    # holder's `speaker` at once; the old one is closed off the event loop,
+    # as closing waits out whatever it was saying
+    from yuri.speaker import SpeakerFactory
+
+    async def apply(config: Config):
+        speaker = SpeakerFactory.create(config)
+        old = holders[0].speaker
+        for holder in holders:
+            holder.speaker = speaker
+        logger.info("config.speaker_swapped", speaker_type=config.speaker_type)
+        await asyncio.get_event_loop().run_in_executor(None, old.close)
+
+    watcher.subscribe(SPEAKER_SECTIONS, apply)
@@ -0,0 +1,451 @@
+import asyncio
+import statistics
+import threading
+import time
+import uuid
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from yuri.capture import AudioCapture, Segment
+from yuri.intents import IntentRouter
+from yuri.listener import CaptureListener, normalize_phrase
+from yuri.speaker import CLAUSE_BREAK, MIN_CLAUSE_CHARS, Speaker, Utterance
+from yuri.textgen import TextGen
+
+# Milliseconds each stage may add between the end of the user's speech and
+# the robot's first audio: the final transcript, the first clause of the
+# reply after that, and that clause's first audio after that
+STAGE_BUDGETS_MS = {"transcribe": 700.0, "generate": 1500.0, "speak": 800.0}
+RESPONSE_BUDGET_MS = sum(STAGE_BUDGETS_MS.values())
+# A partial transcript unchanged for this long is taken to be what was said,
+# and generation starts on it before the VAD has called the utterance over
+PARTIAL_STABLE_SECONDS = 0.25
+SPECULATE_POLL_SECONDS = 0.05
+MAX_TOKENS = 40
+# How turns are written to the model. Replies end at the first line break.
+PROMPT = "\nHuman: {}\nYuri:"
+
+
+def take_clauses(
+    pending: str, min_chars: int = MIN_CLAUSE_CHARS
+) -> Tuple[List[str], str]:
+    # The clauses of `pending` that are complete and long enough to speak
+    # (as split_clauses joins them), and the text still to come
+    *complete, rest = CLAUSE_BREAK.split(pending.lstrip())
+    clauses = []
+    joined = ""
+    for piece in complete:
+        joined = f"{joined} {piece}".strip()
+        if len(joined) >= min_chars:
+            clauses.append(joined)
+            joined = ""
+    if joined:
+        rest = f"{joined} {rest}"
+    return clauses, rest
+
+
+@dataclass
+class Turn:
+    # When the user stopped speaking, from the VAD
+    speech_ended_at: float
+    # Sample index the utterance started at, identifying its partials
+    start: int = 0
+    text: str = ""
+    reply: str = ""
+    # Whether the reply was generated from a partial transcript
+    speculative: bool = False
+    # The command it was, if it was one
+    intent: Optional[str] = None
+    transcribed_at: Optional[float] = None
+    first_token_at: Optional[float] = None
+    first_clause_at: Optional[float] = None
+    first_audio_at: Optional[float] = None
+
+    def stages(self) -> Dict[str, Optional[float]]:
+        # Milliseconds each stage added to the response. Generation that
+        # got ahead of the final transcript added nothing.
+        def ms(start: Optional[float], end: Optional[float]):
+            if start is None or end is None:
+                return None
+            return round(1000.0 * max(0.0, end - start), 1)
+
+        return {
+            "transcribe": ms(self.speech_ended_at, self.transcribed_at),
+            "generate": ms(self.transcribed_at, self.first_clause_at),
+            "speak": ms(self.first_clause_at, self.first_audio_at),
+        }
+
+    @property
+    def response_ms(self) -> Optional[float]:
+        # End of the user's speech to the robot's first audio
+        if self.first_audio_at is None:
+            return None
+        return round(1000.0 * (self.first_audio_at - self.speech_ended_at), 1)
+
+    def over_budget(self) -> List[str]:
+        return [
+            stage
+            for stage, spent in self.stages().items()
+            if spent is not None and spent > STAGE_BUDGETS_MS[stage]
+        ]
+
+    def breakdown(self) -> dict:
+        return {
+            "text": self.text,
+            "reply": self.reply,
+            "speculative": self.speculative,
+            "intent": self.intent,
+            **{f"{stage}_ms": ms for stage, ms in self.stages().items()},
+            "response_ms": self.response_ms,
+            "over_budget": self.over_budget(),
+        }
+
+
+@dataclass
+class Partial:
+    start: int
+    text: str
+    heard_at: float = field(default_factory=time.monotonic)
+
+
+# One reply streaming from the text generation server. The blocking client
+# runs on its own thread and hands tokens to the event loop; cancelling
+# closes the connection, which stops the server sampling for it.
+class Generation:
+    def __init__(
+        self,
+        textgen: TextGen,
+        conversation: str,
+        text: str,
+        start: int = 0,
+        max_tokens: int = MAX_TOKENS,
+    ):
+        self.text = text
+        self.start = start
+        self.first_token_at: Optional[float] = None
+        self.tokens: asyncio.Queue = asyncio.Queue()
+        self._loop = asyncio.get_event_loop()
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(textgen, conversation, max_tokens),
+            name="converse-generation",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def matches(self, text: str) -> bool:
+        return normalize_phrase(self.text) == normalize_phrase(text)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _put(self, token: Optional[str]):
+        try:
+            self._loop.call_soon_threadsafe(self.tokens.put_nowait, token)
+        except RuntimeError:
+            # The loop is gone
+            pass
+
+    def _run(self, textgen: TextGen, conversation: str, max_tokens: int):
+        # Uncommitted: the turn is only added once it's known to be the one
+        # that was said and the reply is cut where it was
+        stream = textgen.stream(
+            PROMPT.format(self.text),
+            max_tokens=max_tokens,
+            conversation=conversation,
+            commit=False,
+        )
+        try:
+            for token in stream:
+                if self._cancelled.is_set():
+                    break
+                if self.first_token_at is None:
+                    self.first_token_at = time.monotonic()
+                self._put(token)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("converse.generation_failed")
+        finally:
+            stream.close()
+            self._put(None)
+
+
+# Listening, transcription, generation and speech as stages joined by
+# queues, so each works on its own turn at once: capture keeps finding
+# utterances while earlier ones are transcribed, generation starts on a
+# stable partial transcript before the final one is in, and each clause of
+# the reply is spoken as soon as it's generated. Known commands skip
+# generation. Speech that starts while the robot is talking is taken to be
+# the robot itself and ignored.
+class Conversation:
+    def __init__(
+        self,
+        listener: CaptureListener,
+        speaker: Speaker,
+        textgen: TextGen,
+        router: Optional[IntentRouter] = None,
+    ):
+        # Transcripts the router knows as commands are never generated for
+        self.listener = listener
+        self.speaker = speaker
+        self.textgen = textgen
+        self.router = router
+        self.conversation = f"converse-{uuid.uuid4().hex}"
+        self.turns: List[Turn] = []
+
+        self._heard: Optional[asyncio.Queue] = None
+        self._transcribed: Optional[asyncio.Queue] = None
+        self._partial: Optional[Partial] = None
+        self._speculation: Optional[Generation] = None
+        self._responding = False
+        self._speaking = 0
+        # When the robot last started and stopped talking
+        self._spoke_from = float("inf")
+        self._quiet_since = 0.0
+
+    @property
+    def speaking(self) -> bool:
+        return self._speaking > 0
+
+    async def run(self, max_seconds: Optional[float] = None):
+        # Until the audio runs out or max_seconds have passed, counted from
+        # when the text generation server is ready
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.textgen.ensure_server)
+        self._heard = asyncio.Queue()
+        self._transcribed = asyncio.Queue()
+        self.listener.on_partial = lambda start, text: (
+            loop.call_soon_threadsafe(self.heard_partial, start, text)
+        )
+        # Starts capture, and with it the decoder's partial transcripts
+        capture = self.listener.capture
+
+        responding = asyncio.ensure_future(self.respond_stage())
+        pending = {
+            asyncio.ensure_future(self.capture_stage(capture)),
+            asyncio.ensure_future(self.transcribe_stage()),
+            asyncio.ensure_future(self.speculate_stage()),
+            responding,
+        }
+        stop_at = None if max_seconds is None else loop.time() + max_seconds
+        try:
+            # A stage that fails ends the conversation
+            while not responding.done():
+                timeout = None if stop_at is None else stop_at - loop.time()
+                if timeout is not None and timeout <= 0:
+                    logger.info("converse.time_up", seconds=max_seconds)
+                    break
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=timeout,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    task.result()
+        finally:
+            self.listener.on_partial = None
+            for task in pending:
+                task.cancel()
+            if self._speculation is not None:
+                self._speculation.cancel()
+            self.speaker.interrupt()
+        logger.info("converse.summary", **self.summary())
+
+    async def capture_stage(self, capture: AudioCapture):
+        async for segment in capture.segments():
+            if self.overlaps_speech(segment):
+                logger.debug("converse.ignored", seconds=segment.clip.duration)
+                continue
+            audio = self.listener.to_audio(segment)
+            if audio is not None:
+                turn = Turn(
+                    speech_ended_at=segment.ended_at, start=segment.start
+                )
+                self._heard.put_nowait((turn, audio))
+        self._heard.put_nowait(None)
+
+    def overlaps_speech(self, segment: Segment) -> bool:
+        # Whether the robot was talking at any point of the segment
+        if segment.ended_at < self._spoke_from:
+            return False
+        return self.speaking or segment.started_at < self._quiet_since
+
+    async def transcribe_stage(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            heard = await self._heard.get()
+            if heard is None:
+                self._transcribed.put_nowait(None)
+                return
+            turn, audio = heard
+            transcription = await loop.run_in_executor(
+                None, self.listener.transcribe, audio
+            )
+            turn.transcribed_at = time.monotonic()
+            turn.text = transcription.text.strip()
+            if turn.text:
+                self._transcribed.put_nowait(turn)
+
+    def heard_partial(self, start: int, text: str):
+        self._partial = Partial(start, text)
+
+    async def speculate_stage(self):
+        while True:
+            await asyncio.sleep(SPECULATE_POLL_SECONDS)
+            partial = self._partial
+            if partial is None or not partial.text or self._responding:
+                continue
+            if self.router is not None and self.router.match(partial.text):
+                continue
+            if time.monotonic() - partial.heard_at < PARTIAL_STABLE_SECONDS:
+                continue
+            speculation = self._speculation
+            if speculation is not None:
+                if speculation.start == partial.start and speculation.matches(
+                    partial.text
+                ):
+                    continue
+                speculation.cancel()
+            logger.debug("converse.speculating", text=partial.text)
+            self._speculation = Generation(
+                self.textgen, self.conversation, partial.text, partial.start
+            )
+
+    async def respond_stage(self):
+        while True:
+            turn = await self._transcribed.get()
+            if turn is None:
+                return
+            self._responding = True
+            try:
+                await self.respond(turn)
+            finally:
+                self._responding = False
+            self.turns.append(turn)
+            logger.info("converse.turn", **turn.breakdown())
+            for stage in turn.over_budget():
+                logger.warning(
+                    "converse.over_budget",
+                    stage=stage,
+                    ms=turn.stages()[stage],
+                    budget_ms=STAGE_BUDGETS_MS[stage],
+                )
+
+    def speculation(self, turn: Turn) -> Optional[Generation]:
+        # The speculative reply if it was to what turned out to be said
+        speculation, self._speculation = self._speculation, None
+        if self._partial is not None and self._partial.start == turn.start:
+            self._partial = None
+        if speculation is None:
+            return None
+        if speculation.start == turn.start and speculation.matches(turn.text):
+            return speculation
+        speculation.cancel()
+        return None
+
+    async def respond(self, turn: Turn):
+        loop = asyncio.get_event_loop()
+        speculation = self.speculation(turn)
+        match = None if self.router is None else self.router.match(turn.text)
+        if match is not None:
+            # Commands are carried out without generating anything
+            if speculation is not None:
+                speculation.cancel()
+            turn.intent = match.intent
+            await self.router.run(match.intent)
+            return
+
+        turn.speculative = speculation is not None
+        generation = speculation or Generation(
+            self.textgen, self.conversation, turn.text
+        )
+        utterances: List[Utterance] = []
+        pending = ""
+        try:
+            while True:
+                token = await generation.tokens.get()
+                if token is None:
+                    break
+                pending += token
+                if not utterances and not turn.reply and not pending.strip():
+                    # Nothing said yet, so a line break isn't the end
+                    pending = ""
+                    continue
+                finished = "\n" in pending
+                if finished:
+                    pending = pending[: pending.index("\n")]
+                    generation.cancel()
+                clauses, pending = take_clauses(pending)
+                for clause in clauses:
+                    utterances.append(self.say(turn, clause))
+                if finished:
+                    break
+            if pending.strip():
+                utterances.append(self.say(turn, pending.strip()))
+        finally:
+            generation.cancel()
+        turn.first_token_at = generation.first_token_at
+        if not utterances:
+            return
+
+        # Added to the conversation while the reply is spoken
+        committing = loop.run_in_executor(
+            None,
+            lambda: self.textgen.generate(
+                PROMPT.format(turn.text) + f" {turn.reply}\n",
+                max_tokens=0,
+                conversation=self.conversation,
+            ),
+        )
+        await asyncio.gather(
+            committing,
+            *(utterance.done for utterance in utterances),
+            return_exceptions=True,
+        )
+        timing = utterances[0].timing
+        if timing is not None:
+            # Speakers that play nothing only say when they started
+            turn.first_audio_at = timing.first_audio_at or timing.started_at
+
+    def say(self, turn: Turn, clause: str) -> Utterance:
+        if turn.first_clause_at is None:
+            turn.first_clause_at = time.monotonic()
+        turn.reply = f"{turn.reply} {clause}".strip()
+        utterance = self.speaker.submit(clause)
+        if not self._speaking:
+            self._spoke_from = time.monotonic()
+        self._speaking += 1
+        utterance.done.add_done_callback(self._spoken)
+        return utterance
+
+    def _spoken(self, _):
+        self._speaking -= 1
+        if not self._speaking:
+            self._quiet_since = time.monotonic()
+
+    def summary(self) -> dict:
+        responses = sorted(
+            turn.response_ms
+            for turn in self.turns
+            if turn.response_ms is not None
+        )
+        summary = {
+            "turns": len(self.turns),
+            "intents": sum(turn.intent is not None for turn in self.turns),
+            "speculative": sum(turn.speculative for turn in self.turns),
+        }
+        if responses:
+            summary["response_p50_ms"] = statistics.median(responses)
+            summary["response_max_ms"] = responses[-1]
+        for stage in STAGE_BUDGETS_MS:
+            spent = [
+                turn.stages()[stage]
+                for turn in self.turns
+                if turn.stages()[stage] is not None
+            ]
+            if spent:
+                summary[f"{stage}_mean_ms"] = round(statistics.mean(spent), 1)
+        return summary
@@ -0,0 +1,111 @@
+from typing import Optional
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+WINDOW_SAMPLES = 480  # 30ms
+HOP_SAMPLES = 320  # 20ms
+FFT_SIZE = 512
+MEL_BANDS = 40
+LOW_HZ = 20.0
+HIGH_HZ = 7600.0
+
+
+def hz_to_mel(hz):
+    return 2595.0 * np.log10(1.0 + np.asarray(hz) / 700.0)
+
+
+def mel_to_hz(mel):
+    return 700.0 * (10.0 ** (np.asarray(mel) / 2595.0) - 1.0)
+
+
+def mel_filterbank(
+    sample_rate: int = SAMPLE_RATE,
+    fft_size: int = FFT_SIZE,
+    bands: int = MEL_BANDS,
+    low_hz: float = LOW_HZ,
+    high_hz: float = HIGH_HZ,
+) -> np.ndarray:
+    # (fft_size // 2 + 1, bands) of triangular filters
+    bins = np.fft.rfftfreq(fft_size, 1.0 / sample_rate)
+    edges = mel_to_hz(
+        np.linspace(hz_to_mel(low_hz), hz_to_mel(high_hz), bands + 2)
+    )
+    lower, center, upper = edges[:-2], edges[1:-1], edges[2:]
+    rising = (bins[:, np.newaxis] - lower) / (center - lower)
+    falling = (upper - bins[:, np.newaxis]) / (upper - center)
+    return np.maximum(0.0, np.minimum(rising, falling)).astype(np.float32)
+
+
+def dct_matrix(bands: int, coefficients: int) -> np.ndarray:
+    # Orthonormal DCT-II, (bands, coefficients)
+    n = np.arange(bands)[:, np.newaxis]
+    k = np.arange(coefficients)[np.newaxis, :]
+    basis = np.cos(np.pi / bands * (n + 0.5) * k) * np.sqrt(2.0 / bands)
+    basis[:, 0] /= np.sqrt(2.0)
+    return basis.astype(np.float32)
+
+
+# Log-mel (or MFCC) features computed over a stream of audio. Samples can
+# arrive in chunks of any size: whatever doesn't fill a whole hop is kept
+# for the next call, so streaming a clip in pieces gives exactly the same
+# frames as processing it in one go. Training and the on-device spotter both
+# use this, so the model always sees the features it was trained on.
+class LogMelFrontend:
+    def __init__(
+        self,
+        sample_rate: int = SAMPLE_RATE,
+        window_samples: int = WINDOW_SAMPLES,
+        hop_samples: int = HOP_SAMPLES,
+        fft_size: int = FFT_SIZE,
+        bands: int = MEL_BANDS,
+        mfcc: Optional[int] = None,
+    ):
+        self.sample_rate = sample_rate
+        self.window_samples = window_samples
+        self.hop_samples = hop_samples
+        self.fft_size = fft_size
+        self.bands = bands
+        self.mfcc = mfcc
+
+        self.window = np.hanning(window_samples).astype(np.float32)
+        self.filterbank = mel_filterbank(sample_rate, fft_size, bands)
+        self.dct = None if mfcc is None else dct_matrix(bands, mfcc)
+        self._pending = np.zeros(0, dtype=np.float32)
+
+    @property
+    def features(self) -> int:
+        return self.bands if self.mfcc is None else self.mfcc
+
+    def frames_for(self, samples: int) -> int:
+        if samples < self.window_samples:
+            return 0
+        return 1 + (samples - self.window_samples) // self.hop_samples
+
+    def reset(self):
+        self._pending = np.zeros(0, dtype=np.float32)
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        # int16-scale samples in, (frames, features) out
+        audio = np.concatenate(
+            [self._pending, np.asarray(samples, dtype=np.float32) / 32768.0]
+        )
+        count = self.frames_for(len(audio))
+        self._pending = audio[count * self.hop_samples :]
+        if not count:
+            return np.zeros((0, self.features), dtype=np.float32)
+
+        starts = np.arange(count)[:, np.newaxis] * self.hop_samples
+        frames = audio[starts + np.arange(self.window_samples)] * self.window
+        power = np.abs(np.fft.rfft(frames, n=self.fft_size, axis=1)) ** 2
+        features = np.log(power @ self.filterbank + 1e-6)
+        if self.dct is not None:
+            features = features @ self.dct
+        return features.astype(np.float32)
+
+    def __call__(self, samples: np.ndarray) -> np.ndarray:
+        # Features of a whole clip
+        self.reset()
+        features = self.process(samples)
+        self.reset()
+        return features
@@ -0,0 +1,165 @@
+import struct
+import time
+
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from adafruit_pca9685 import PCA9685
+
+# PCA9685 register layout: each channel owns 4 consecutive registers
+# (ON_L, ON_H, OFF_L, OFF_H) starting at LED0_ON_L. With MODE1's
+# auto-increment bit set (adafruit_pca9685 sets it along with the frequency)
+# a single write can cover any run of consecutive channels.
+LED0_ON_L = 0x06
+CHANNEL_REGISTER_SIZE = 4
+FULL_ON = 0x1000
+MAX_DUTY_CYCLE = 0xFFFF
+
+
+def duty_to_registers(duty_cycle: int) -> Tuple[int, int]:
+    # Same conversion as adafruit_pca9685.PWMChannel.duty_cycle
+    if duty_cycle == MAX_DUTY_CYCLE:
+        return (FULL_ON, 0)
+    return (0, (duty_cycle + 1) >> 4)
+
+
+def registers_to_duty(on: int, off: int) -> int:
+    if on == FULL_ON:
+        return MAX_DUTY_CYCLE
+    return off << 4
+
+
+@dataclass
+class BusStats:
+    transactions: int = 0
+    bytes_written: int = 0
+    bytes_read: int = 0
+    frames: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def elapsed(self) -> float:
+        return max(time.monotonic() - self.started_at, 1e-9)
+
+    @property
+    def transactions_per_second(self) -> float:
+        return self.transactions / self.elapsed
+
+    @property
+    def bytes_per_second(self) -> float:
+        return (self.bytes_written + self.bytes_read) / self.elapsed
+
+    def reset(self):
+        self.transactions = 0
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.frames = 0
+        self.started_at = time.monotonic()
+
+
+# Collects the duty cycles for a group of channels during a control tick and
+# writes them out as a single auto-increment I2C transaction.
+class FrameWriter:
+    def __init__(
+        self, pca: "PCA9685", channels: Iterable[int], frequency: int
+    ):
+        channels = sorted(set(channels))
+        self.pca = pca
+        self.frequency = frequency
+        self.first_channel = channels[0]
+        self.last_channel = channels[-1]
+        self.stats = BusStats()
+
+        self._pending: Dict[int, int] = {}
+        # Mirror of the whole register span, so channels inside the span that
+        # we don't drive get their current value written back untouched.
+        self._registers = self._read_registers(
+            self.first_channel, self.last_channel
+        )
+
+    def channel(self, index: int) -> "FrameChannel":
+        if not self.first_channel <= index <= self.last_channel:
+            raise ValueError(f"channel {index} is outside of this frame")
+        return FrameChannel(self, index)
+
+    def stage(self, index: int, duty_cycle: int):
+        if not 0 <= duty_cycle <= MAX_DUTY_CYCLE:
+            raise ValueError("Out of range")
+        self._pending[index] = duty_cycle
+
+    def pending(self, index: int) -> Optional[int]:
+        return self._pending.get(index)
+
+    def read_duty_cycle(self, index: int) -> int:
+        ((on, off),) = self._read_registers(index, index)
+        return registers_to_duty(on, off)
+
+    def flush(self) -> int:
+        if not self._pending:
+            return 0
+
+        first = min(self._pending)
+        last = max(self._pending)
+        for index, duty_cycle in self._pending.items():
+            self._registers[index - self.first_channel] = duty_to_registers(
+                duty_cycle
+            )
+        span = self._registers[
+            first - self.first_channel : last - self.first_channel + 1
+        ]
+
+        buffer = bytearray(1 + CHANNEL_REGISTER_SIZE * len(span))
+        buffer[0] = LED0_ON_L + CHANNEL_REGISTER_SIZE * first
+        struct.pack_into(
+            "<" + "HH" * len(span),
+            buffer,
+            1,
+            *(value for registers in span for value in registers),
+        )
+        with self.pca.i2c_device as i2c:
+            i2c.write(buffer)
+
+        written = len(self._pending)
+        self._pending.clear()
+        self.stats.transactions += 1
+        self.stats.bytes_written += len(buffer)
+        self.stats.frames += 1
+        return written
+
+    def _read_registers(self, first: int, last: int) -> List[Tuple[int, int]]:
+        count = last - first + 1
+        buffer = bytearray(CHANNEL_REGISTER_SIZE * count)
+        with self.pca.i2c_device as i2c:
+            i2c.write_then_readinto(
+                bytes([LED0_ON_L + CHANNEL_REGISTER_SIZE * first]), buffer
+            )
+        self.stats.transactions += 1
+        self.stats.bytes_written += 1
+        self.stats.bytes_read += len(buffer)
+
+        values = struct.unpack("<" + "HH" * count, buffer)
+        return [(values[i], values[i + 1]) for i in range(0, len(values), 2)]
+
+
+# Stands in for a PCA9685 PWMChannel so adafruit_motor's Servo can drive it.
+# Writes are staged on the frame until the next flush.
+class FrameChannel:
+    def __init__(self, frame: FrameWriter, index: int):
+        self.frame = frame
+        self.index = index
+
+    @property
+    def frequency(self) -> int:
+        return self.frame.frequency
+
+    @property
+    def duty_cycle(self) -> int:
+        pending = self.frame.pending(self.index)
+        if pending is not None:
+            return pending
+        return self.frame.read_duty_cycle(self.index)
+
+    @duty_cycle.setter
+    def duty_cycle(self, value: int):
+        self.frame.stage(self.index, value)
@@ -0,0 +1,304 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+import torch
+
+from loguru import logger
+from torch import nn
+
+from yuri.textgen_server import CACHE_MB, MAX_CONTEXT, Request
+
+try:
+    from transformers import DynamicCache
+except ImportError:
+    # Older transformers take tuples as they are
+    DynamicCache = None
+
+TOP_K = 50
+# Conversations whose tokens are remembered, whether or not their keys and
+# values still fit in the cache
+MAX_CONVERSATIONS = 64
+
+# Per layer, (keys, values) each shaped (batch, heads, tokens, head size)
+Past = Tuple[Tuple[torch.Tensor, torch.Tensor], ...]
+
+
+def quantize(model: nn.Module) -> nn.Module:
+    # Dynamic int8 quantization only covers nn.Linear, and GPT-2's
+    # projections are Conv1D: the same operation with a transposed weight.
+    # They're swapped for Linears first, then quantized in place to keep
+    # peak memory down.
+    try:
+        from transformers.pytorch_utils import Conv1D
+    except ImportError:
+        from transformers.modeling_utils import Conv1D
+
+    for parent in list(model.modules()):
+        for name, child in list(parent.named_children()):
+            if isinstance(child, Conv1D):
+                in_features, out_features = child.weight.shape
+                linear = nn.Linear(in_features, out_features)
+                linear.weight = nn.Parameter(child.weight.t().contiguous())
+                linear.bias = child.bias
+                setattr(parent, name, linear)
+    return torch.quantization.quantize_dynamic(
+        model, {nn.Linear}, dtype=torch.qint8, inplace=True
+    )
+
+
+def as_cache(past: Optional[Past]):
+    # Newer transformers want keys and values wrapped in a Cache
+    if past is None or DynamicCache is None:
+        return past
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(past)
+    return DynamicCache(past)
+
+
+def as_past(cache) -> Past:
+    return tuple((layer[0], layer[1]) for layer in cache)
+
+
+def past_bytes(past: Optional[Past]) -> int:
+    if past is None:
+        return 0
+    return sum(k.nelement() * k.element_size() * 2 for k, _ in past)
+
+
+def left_pad(tensor: torch.Tensor, length: int) -> torch.Tensor:
+    # Zero keys or values in front, up to `length` tokens
+    return nn.functional.pad(tensor, (0, 0, length - tensor.shape[2], 0))
+
+
+@dataclass
+class Context:
+    # Every token of the conversation so far
+    tokens: List[int]
+    # Keys and values for tokens[:length]; the rest still need feeding
+    past: Optional[Past] = None
+    length: int = 0
+
+
+# Conversations by id. Their keys and values are kept within max_bytes,
+# least recently used evicted first. An evicted conversation keeps its
+# tokens and is encoded again on its next turn.
+class ConversationCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._contexts: "OrderedDict[str, Context]" = OrderedDict()
+
+    def take(self, conversation: str, keep: bool = False) -> Optional[Context]:
+        # With `keep` the context stays cached, for turns that won't be
+        # put back
+        if keep:
+            context = self._contexts.get(conversation)
+            if context is not None:
+                self._contexts.move_to_end(conversation)
+        else:
+            context = self._contexts.pop(conversation, None)
+        if context is None or context.past is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            if not keep:
+                self.nbytes -= past_bytes(context.past)
+        return context
+
+    def put(self, conversation: str, context: Context):
+        if past_bytes(context.past) > self.max_bytes:
+            context.past, context.length = None, 0
+        self._contexts[conversation] = context
+        self.nbytes += past_bytes(context.past)
+        while len(self._contexts) > MAX_CONVERSATIONS:
+            _, oldest = self._contexts.popitem(last=False)
+            self.nbytes -= past_bytes(oldest.past)
+
+        for older in self._contexts.values():
+            if self.nbytes <= self.max_bytes:
+                break
+            if older.past is not None:
+                self.nbytes -= past_bytes(older.past)
+                older.past, older.length = None, 0
+                self.evictions += 1
+
+
+# Samples continuations for a batch of prompts in lockstep. Each request
+# is first run through the model on its own, for just the tokens whose
+# keys and values aren't cached from its conversation's earlier turns.
+# Those are left-padded to a common length, and every step after runs the
+# model once for the whole batch on only the newest tokens. Each request
+# gets its text as soon as its token is sampled and finishes independently;
+# the batch runs until the last one does.
+class BatchGenerator:
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        top_k: int = TOP_K,
+        max_context: int = MAX_CONTEXT,
+        cache_mb: int = CACHE_MB,
+    ):
+        self.model = model.eval()
+        self.tokenizer = tokenizer
+        self.eos = self.tokenizer.eos_token_id
+        self.top_k = top_k
+        self.max_context = min(max_context, model.config.n_positions)
+        self.conversations = ConversationCache(cache_mb * 2**20)
+
+    @classmethod
+    def load(
+        cls, model: Optional[str] = None, int8: bool = False, **kwargs
+    ) -> "BatchGenerator":
+        # aitextgen downloads and caches GPT-2 small by default
+        from aitextgen import aitextgen
+
+        ai = aitextgen(model=model)
+        network = quantize(ai.model) if int8 else ai.model
+        return cls(network, ai.tokenizer, **kwargs)
+
+    def sample(self, logits: torch.Tensor) -> torch.Tensor:
+        if self.top_k:
+            values, _ = torch.topk(logits, self.top_k)
+            logits = logits.masked_fill(logits < values[:, -1:], float("-inf"))
+        probabilities = torch.softmax(logits, dim=-1)
+        return torch.multinomial(probabilities, 1).squeeze(-1)
+
+    def context(self, request: Request) -> Context:
+        new = self.tokenizer.encode(request.prompt) if request.prompt else []
+        cached = None
+        if request.conversation is not None:
+            cached = self.conversations.take(
+                request.conversation, keep=not request.commit
+            )
+        if cached is None:
+            context = Context(tokens=new or [self.tokenizer.bos_token_id])
+        else:
+            # A copy, so an uncommitted turn leaves the cached one as it was
+            context = Context(cached.tokens + new, cached.past, cached.length)
+
+        # Over the cap the oldest tokens are dropped. Positions are baked
+        # into GPT-2's keys, so what's left is encoded again from scratch.
+        keep = max(1, self.max_context - request.max_tokens)
+        if len(context.tokens) > keep:
+            logger.debug(
+                "textgen.context_trimmed",
+                conversation=request.conversation,
+                tokens=len(context.tokens),
+                kept=keep,
+            )
+            context = Context(tokens=context.tokens[-keep:])
+        return context
+
+    def prefill(self, context: Context) -> torch.Tensor:
+        # Feeds the tokens that aren't cached; the next token's logits
+        ids = torch.tensor([context.tokens[context.length :]])
+        positions = torch.arange(context.length, len(context.tokens))
+        output = self.model(
+            input_ids=ids,
+            past_key_values=as_cache(context.past),
+            position_ids=positions.unsqueeze(0),
+            use_cache=True,
+        )
+        context.past = as_past(output.past_key_values)
+        context.length = len(context.tokens)
+        return output.logits[0, -1]
+
+    @torch.no_grad()
+    def generate(self, requests: Sequence[Request]):
+        contexts = [self.context(request) for request in requests]
+        logits = torch.stack([self.prefill(c) for c in contexts])
+
+        lengths = [context.length for context in contexts]
+        longest = max(lengths)
+        past = tuple(
+            tuple(
+                torch.cat(
+                    [left_pad(c.past[layer][kv], longest) for c in contexts]
+                )
+                for kv in (0, 1)
+            )
+            for layer in range(len(contexts[0].past))
+        )
+        cache = as_cache(past)
+        mask = torch.tensor(
+            [[0] * (longest - length) + [1] * length for length in lengths]
+        )
+        positions = torch.tensor(lengths).unsqueeze(-1)
+        temperatures = torch.tensor(
+            [[max(r.temperature, 1e-5)] for r in requests]
+        )
+
+        tokens: List[List[int]] = [[] for _ in requests]
+        texts = [""] * len(requests)
+        done = [request.max_tokens <= 0 for request in requests]
+        # Generated tokens fed while their request was still going; after
+        # that, whatever its row is fed is filler
+        fed = [0] * len(requests)
+        for _ in range(max(r.max_tokens for r in requests)):
+            next_ids = self.sample(logits / temperatures)
+            for i, request in enumerate(requests):
+                if done[i]:
+                    continue
+                token = int(next_ids[i])
+                if request.cancelled or token == self.eos:
+                    done[i] = True
+                    continue
+                tokens[i].append(token)
+                text = self.tokenizer.decode(tokens[i])
+                # Held back while a multi-byte character is incomplete
+                if not text.endswith("\ufffd"):
+                    request.emit(text[len(texts[i]) :])
+                    texts[i] = text
+                done[i] = len(tokens[i]) >= request.max_tokens
+            if all(done):
+                break
+
+            for i in range(len(requests)):
+                fed[i] += not done[i]
+            mask = torch.cat([mask, mask.new_ones((len(requests), 1))], -1)
+            output = self.model(
+                input_ids=next_ids.unsqueeze(-1),
+                attention_mask=mask,
+                position_ids=positions,
+                past_key_values=cache,
+                use_cache=True,
+            )
+            cache = output.past_key_values
+            logits = output.logits[:, -1, :]
+            positions = positions + 1
+
+        past = as_past(cache)
+        for i, request in enumerate(requests):
+            if request.conversation is not None and request.commit:
+                padding = longest - lengths[i]
+                self.remember(
+                    request.conversation,
+                    contexts[i].tokens + tokens[i],
+                    tuple(
+                        (k[i : i + 1, :, padding:], v[i : i + 1, :, padding:])
+                        for k, v in past
+                    ),
+                    lengths[i] + fed[i],
+                )
+
+    def remember(
+        self, conversation: str, tokens: List[int], past: Past, length: int
+    ):
+        # Copies the request's keys and values out of the batch's so the
+        # cache doesn't keep the whole batch alive. At least the last token
+        # is left unfed so the next turn has logits to start from.
+        length = min(length, len(tokens) - 1)
+        context = Context(
+            tokens=tokens,
+            past=tuple(
+                (k[:, :, :length].clone(), v[:, :, :length].clone())
+                for k, v in past
+            ),
+            length=length,
+        )
+        self.conversations.put(conversation, context)
@@ -1,6 +1,5 @@
 import time
 from datetime import datetime, timedelta
-from digitalio import DigitalInOut, Direction, Pull
 from yuri.config import Config
 
 from loguru import logger
@@ -8,15 +7,20 @@ from loguru import logger
 
 class Input:
     def __init__(self, config: Config):
+        from digitalio import DigitalInOut, Direction, Pull
+
         self.config = config
 
         buttons = [
-            self.config.pins.button,
-            self.config.pins.joyup,
-            self.config.pins.joydown,
-            self.config.pins.joyleft,
-            self.config.pins.joyright,
-            self.config.pins.joyselect,
+            self.config.pins.pin(name)
+            for name in (
+                "button",
+                "joyup",
+                "joydown",
+                "joyleft",
+                "joyright",
+                "joyselect",
+            )
         ]
 
         for i, pin in enumerate(buttons):
@@ -0,0 +1,352 @@
+import re
+import time
+
+from dataclasses import dataclass, replace
+from typing import (
+    TYPE_CHECKING,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+from loguru import logger
+
+from yuri.kinematics import CLOSED, OPEN, WIDE_OPEN
+
+if TYPE_CHECKING:
+    from yuri.config import Config
+    from yuri.input import Input
+    from yuri.lights import Lights
+    from yuri.servos import Eyes
+    from yuri.speaker import Speaker
+
+# Said around commands without changing them, and often misheard
+FILLER_WORDS = frozenset(
+    {"please", "yuri", "hey", "now", "can", "you", "your", "the", "a"}
+)
+# Words this long may be misheard by one letter (added, dropped, changed or
+# swapped with its neighbour); a phrase by one letter per CHARS_PER_EDIT,
+# up to MAX_EDITS in all
+MIN_FUZZY_CHARS = 4
+CHARS_PER_EDIT = 5
+MAX_EDITS = 2
+# Commands take the eyes over from the look and blink loops
+COMMAND_PRIORITY = 20
+LOOK_DEGREES = 15.0
+EYE_SERVOS = {
+    "x": ("upper_lids", "lower_lids", "left_x", "right_x"),
+    "y": ("upper_lids", "lower_lids", "left_y", "right_y"),
+    "both": (
+        "upper_lids",
+        "lower_lids",
+        "left_y",
+        "left_x",
+        "right_y",
+        "right_x",
+    ),
+}
+COLORS = {"red": (255, 0, 0), "green": (0, 255, 0), "blue": (0, 0, 255)}
+# Trie nodes map words to children; this key marks a phrase's end
+END = ""
+
+
+def phrase_words(text: str) -> List[str]:
+    words = re.sub(r"[^a-z' ]", " ", text.lower()).split()
+    return [word for word in words if word not in FILLER_WORDS]
+
+
+def allowed_edits(phrase: str) -> int:
+    return min(MAX_EDITS, len(phrase) // CHARS_PER_EDIT)
+
+
+def deletions(word: str) -> List[str]:
+    return [word[:i] + word[i + 1 :] for i in range(len(word))]
+
+
+def one_edit(heard: str, word: str) -> bool:
+    # Whether one letter added, dropped, changed or swapped turns `heard`
+    # into `word`
+    if heard == word or abs(len(heard) - len(word)) > 1:
+        return False
+    if len(heard) == len(word):
+        diffs = [i for i, (a, b) in enumerate(zip(heard, word)) if a != b]
+        if len(diffs) == 1:
+            return True
+        first, *rest = diffs
+        return rest == [first + 1] and (
+            heard[first] == word[first + 1] and heard[first + 1] == word[first]
+        )
+    shorter, longer = sorted((heard, word), key=len)
+    return shorter in deletions(longer)
+
+
+@dataclass
+class Match:
+    intent: str
+    phrase: str
+    edits: int = 0
+
+
+# Every registered phrase in a trie of words. Each heard word is looked up
+# as it is, or else in a table of every known word with a letter dropped,
+# which finds the words one edit away from it with a handful of dict
+# lookups. Text with a word that's nothing like any command word (most
+# conversation) is turned away at that word.
+class PhraseIndex:
+    def __init__(self):
+        self.root: dict = {}
+        self.phrases: Dict[str, str] = {}
+        self.words: Set[str] = set()
+        # Known words by each way of dropping one of their letters
+        self.near: Dict[str, Set[str]] = {}
+
+    def add(self, phrase: str, intent: str):
+        words = phrase_words(phrase)
+        if not words:
+            raise ValueError(f"{phrase!r} is only filler words")
+        node = self.root
+        for word in words:
+            node = node.setdefault(word, {})
+            if word not in self.words and len(word) >= MIN_FUZZY_CHARS:
+                self.near.setdefault(word, set()).add(word)
+                for deleted in deletions(word):
+                    self.near.setdefault(deleted, set()).add(word)
+            self.words.add(word)
+        key = " ".join(words)
+        node[END] = key
+        self.phrases[key] = intent
+
+    def heard_as(self, heard: str) -> List[Tuple[str, int]]:
+        # The known words `heard` could be, with the edits each takes
+        if heard in self.words:
+            return [(heard, 0)]
+        if len(heard) < MIN_FUZZY_CHARS - 1:
+            return []
+        candidates = set(self.near.get(heard, ()))
+        for deleted in deletions(heard):
+            candidates.update(self.near.get(deleted, ()))
+        return [(word, 1) for word in candidates if one_edit(heard, word)]
+
+    def match(self, text: str) -> Optional[Match]:
+        words = phrase_words(text)
+        key = " ".join(words)
+        if key in self.phrases:
+            return Match(self.phrases[key], key)
+
+        # Every (trie node, edits so far) the words so far could lead to
+        reached = [(self.root, 0)]
+        for heard in words:
+            reached = [
+                (node[word], edits + cost)
+                for node, edits in reached
+                for word, cost in self.heard_as(heard)
+                if word in node and edits + cost <= MAX_EDITS
+            ]
+            if not reached:
+                return None
+
+        matches = [
+            Match(self.phrases[node[END]], node[END], edits)
+            for node, edits in reached
+            if END in node and edits <= allowed_edits(node[END])
+        ]
+        fewest = min((match.edits for match in matches), default=None)
+        best = {m.intent: m for m in matches if m.edits == fewest}
+        # Equally close to two commands is neither
+        if len(best) != 1:
+            return None
+        (match,) = best.values()
+        return match
+
+
+Action = Callable[["IntentRouter"], Awaitable]
+
+
+@dataclass
+class Intent:
+    name: str
+    phrases: Sequence[str]
+    act: Action
+    # Parts of the robot act() uses. Without them the intent isn't offered
+    # and its phrases are left to text generation.
+    needs: Tuple[str, ...] = ()
+
+
+async def blink(router: "IntentRouter"):
+    await router.eyes.close(**router.motion)
+    await router.eyes.open(**router.motion)
+
+
+def gaze(x: Optional[float] = None, y: Optional[float] = None) -> Action:
+    async def look(router: "IntentRouter"):
+        eyes = router.eyes
+        pose = replace(
+            eyes.pose,
+            gaze_x=eyes.pose.gaze_x if x is None else x,
+            gaze_y=eyes.pose.gaze_y if y is None else y,
+            openness=OPEN,
+        )
+        if x is None:
+            axis = "y"
+        elif y is None:
+            axis = "x"
+        else:
+            axis = "both"
+        await eyes.look(pose, EYE_SERVOS[axis], **router.motion)
+
+    return look
+
+
+def lids(openness: float) -> Action:
+    async def move(router: "IntentRouter"):
+        eyes = router.eyes
+        await eyes.look(
+            replace(eyes.pose, openness=openness),
+            ("upper_lids", "lower_lids"),
+            **router.motion,
+        )
+
+    return move
+
+
+def light(color: Optional[Tuple[int, int, int]]) -> Action:
+    async def show(router: "IntentRouter"):
+        from yuri.lights import Solid
+
+        # None goes back to whatever the lights were playing
+        router.lights.override(None if color is None else Solid(color))
+
+    return show
+
+
+async def calibrate(router: "IntentRouter"):
+    await router.eyes.calibrate(router.inputs, speaker=router.speaker)
+    if router.config_path is not None:
+        # The eyes hold the angles just measured, which a reload may have
+        # left in a different object from router.config's
+        config = router.config.copy(update={"eyes": router.eyes.config})
+        config.save(router.config_path)
+
+
+async def hush(router: "IntentRouter"):
+    router.speaker.interrupt()
+
+
+INTENTS = [
+    Intent("blink", ["blink", "blink your eyes"], blink, ("eyes",)),
+    Intent("look_left", ["look left"], gaze(x=-LOOK_DEGREES), ("eyes",)),
+    Intent("look_right", ["look right"], gaze(x=LOOK_DEGREES), ("eyes",)),
+    Intent("look_up", ["look up"], gaze(y=LOOK_DEGREES), ("eyes",)),
+    Intent("look_down", ["look down"], gaze(y=-LOOK_DEGREES), ("eyes",)),
+    Intent(
+        "look_ahead",
+        ["look ahead", "look forward", "look at me"],
+        gaze(x=0.0, y=0.0),
+        ("eyes",),
+    ),
+    Intent("open_eyes", ["open your eyes", "wake up"], lids(OPEN), ("eyes",)),
+    Intent("widen_eyes", ["eyes wide"], lids(WIDE_OPEN), ("eyes",)),
+    Intent(
+        "close_eyes",
+        ["close your eyes", "go to sleep"],
+        lids(CLOSED),
+        ("eyes",),
+    ),
+    Intent(
+        "lights_off",
+        ["lights off", "turn off the lights", "turn the lights off"],
+        light((0, 0, 0)),
+        ("lights",),
+    ),
+    Intent(
+        "lights_on",
+        ["lights on", "turn on the lights", "turn the lights on"],
+        light(None),
+        ("lights",),
+    ),
+    *(
+        Intent(
+            f"lights_{name}",
+            [f"lights {name}", f"turn the lights {name}"],
+            light(color),
+            ("lights",),
+        )
+        for name, color in COLORS.items()
+    ),
+    Intent(
+        "calibrate",
+        ["calibrate", "calibrate your eyes"],
+        calibrate,
+        ("eyes", "inputs", "speaker"),
+    ),
+    Intent("hush", ["stop talking", "be quiet", "hush"], hush, ("speaker",)),
+]
+
+
+# Answers known commands straight from a transcript, before anything is
+# sent to text generation. Only the intents the robot has the parts for are
+# indexed; everything else comes back unmatched.
+class IntentRouter:
+    def __init__(
+        self,
+        eyes: Optional["Eyes"] = None,
+        lights: Optional["Lights"] = None,
+        speaker: Optional["Speaker"] = None,
+        inputs: Optional["Input"] = None,
+        config: Optional["Config"] = None,
+        config_path: Optional[str] = None,
+        intents: Iterable[Intent] = INTENTS,
+    ):
+        # With config_path, calibration is saved there
+        self.eyes = eyes
+        self.lights = lights
+        self.speaker = speaker
+        self.inputs = inputs
+        self.config = config
+        self.config_path = config_path
+        self.motion = dict(source="command", priority=COMMAND_PRIORITY)
+
+        self.intents: Dict[str, Intent] = {}
+        self.index = PhraseIndex()
+        for intent in intents:
+            if all(getattr(self, part) is not None for part in intent.needs):
+                self.intents[intent.name] = intent
+                for phrase in intent.phrases:
+                    self.index.add(phrase, intent.name)
+
+    @property
+    def phrases(self) -> List[str]:
+        # For restricting a recognizer to the commands
+        return [
+            phrase
+            for intent in self.intents.values()
+            for phrase in intent.phrases
+        ]
+
+    def match(self, text: str) -> Optional[Match]:
+        started_at = time.perf_counter()
+        match = self.index.match(text)
+        logger.debug(
+            "intent.matched" if match else "intent.unmatched",
+            text=text,
+            intent=match and match.intent,
+            us=round(1e6 * (time.perf_counter() - started_at), 1),
+        )
+        return match
+
+    async def run(self, name: str):
+        await self.intents[name].act(self)
+
+    async def handle(self, text: str) -> Optional[Match]:
+        # None if the text isn't a command and should be answered otherwise
+        match = self.match(text)
+        if match is not None:
+            logger.info("intent.run", intent=match.intent, edits=match.edits)
+            await self.run(match.intent)
+        return match
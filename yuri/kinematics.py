@@ -0,0 +1,94 @@
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import numpy as np
+
+from yuri.config import EyesConfig
+
+# Column order of every solved pose; matches Eyes.servos
+SERVOS = ("upper_lids", "lower_lids", "left_y", "left_x", "right_y", "right_x")
+
+# How much the lids follow the eyes' vertical gaze
+LID_FOLLOW = 0.8
+
+CLOSED = 0.0
+OPEN = 1.0
+WIDE_OPEN = 2.0
+
+
+@dataclass(frozen=True)
+class Pose:
+    # Gaze offsets in degrees from the calibrated neutral position
+    gaze_x: float = 0.0
+    gaze_y: float = 0.0
+    # 0 = closed, 1 = open, 2 = wide open
+    openness: float = OPEN
+
+    def as_array(self) -> np.ndarray:
+        return np.array([self.gaze_x, self.gaze_y, self.openness])
+
+
+# Maps poses to servo angles for all six servos at once. Everything that
+# depends on the calibration is folded into a few arrays up front, so solving
+# a pose (or a whole batch of them) is a handful of vectorised operations.
+class EyeKinematics:
+    def __init__(self, config: EyesConfig, actuation_range: float = 180.0):
+        self.actuation_range = actuation_range
+
+        def neutral(value: Optional[float]) -> float:
+            return actuation_range * 0.5 if value is None else value
+
+        # Servo angles with the gaze centred and the lids open
+        self.base = np.array(
+            [
+                config.upper_lids.open_y,
+                config.lower_lids.open_y,
+                neutral(config.left_eye.neutral_y),
+                neutral(config.left_eye.neutral_x),
+                neutral(config.right_eye.neutral_y),
+                neutral(config.right_eye.neutral_x),
+            ]
+        )
+        # Degrees of servo travel per degree of (gaze_x, gaze_y). The right
+        # eye's vertical servo is mounted mirrored.
+        self.gaze = np.array(
+            [
+                [0.0, LID_FOLLOW],
+                [0.0, -LID_FOLLOW],
+                [0.0, 1.0],
+                [1.0, 0.0],
+                [0.0, -1.0],
+                [1.0, 0.0],
+            ]
+        )
+        # Lid angles at closed, open and wide open, one row per lid
+        lids = (config.upper_lids, config.lower_lids)
+        self.lid_closed = np.array([lid.closed_y for lid in lids])
+        self.lid_open = np.array([lid.open_y for lid in lids])
+        self.lid_wide_open = np.array([lid.wide_open_y for lid in lids])
+
+    def solve(self, pose: Pose) -> Dict[str, float]:
+        angles = self.solve_many(pose.as_array()[np.newaxis])[0]
+        return dict(zip(SERVOS, angles.tolist()))
+
+    def solve_many(self, poses: np.ndarray) -> np.ndarray:
+        # poses: (n, 3) of gaze_x, gaze_y, openness -> (n, 6) servo angles,
+        # columns in SERVOS order; for whole trajectories of poses at once
+        gaze = poses[:, :2]
+        openness = np.clip(poses[:, 2:3], CLOSED, WIDE_OPEN)
+
+        angles = self.base + gaze @ self.gaze.T
+
+        # Lids interpolate piecewise between closed/open/wide open and only
+        # follow the gaze fully when they're at their normal open position.
+        closing = np.minimum(openness, OPEN)
+        widening = np.maximum(openness - OPEN, 0.0)
+        lids = (
+            self.lid_closed
+            + closing * (self.lid_open - self.lid_closed)
+            + widening * (self.lid_wide_open - self.lid_open)
+        )
+        follow = np.clip(1.0 - np.abs(openness - OPEN), 0.0, 1.0)
+        angles[:, :2] = lids + follow * (gaze @ self.gaze[:2].T)
+
+        return np.clip(angles, 0.0, self.actuation_range)
@@ -0,0 +1,174 @@
+import json
+import os
+
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, List, Optional, Sequence
+
+import numpy as np
+
+from yuri.features import LogMelFrontend
+
+# Label for anything that isn't a keyword: silence, noise, other speech
+BACKGROUND = "_background_"
+CLIP_SECONDS = 1.0
+# Run the model every 5 feature frames (100ms)
+STRIDE_FRAMES = 5
+# Posteriors averaged before thresholding
+SMOOTHING = 3
+THRESHOLD = 0.8
+# A keyword can't fire again this soon after it was detected
+REFRACTORY_SECONDS = 1.0
+
+
+def metadata_path(model_path: str) -> str:
+    return os.path.splitext(model_path)[0] + ".json"
+
+
+@dataclass
+class Detection:
+    keyword: str
+    score: float
+    # Seconds into the stream where the detecting window ended
+    at: float
+
+
+# An int8 TFLite keyword model plus the metadata written alongside it by the
+# training script: labels, feature normalisation and frontend settings
+class KeywordModel:
+    def __init__(self, model_path: str, threads: int = 1):
+        with open(metadata_path(model_path)) as metadata_file:
+            metadata = json.load(metadata_file)
+        self.labels: List[str] = metadata["labels"]
+        self.mean = float(metadata["mean"])
+        self.std = float(metadata["std"])
+        self.mfcc: Optional[int] = metadata.get("mfcc")
+
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            # The full TensorFlow package ships the same interpreter, but
+            # takes seconds to import
+            import tensorflow as tf
+
+            Interpreter = tf.lite.Interpreter
+        self.interpreter = Interpreter(
+            model_path=model_path, num_threads=threads
+        )
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        # (frames, features) the model was trained on
+        self.frames, self.features = self._input["shape"][1:3]
+
+    def frontend(self) -> LogMelFrontend:
+        return LogMelFrontend(mfcc=self.mfcc)
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        # (frames, features) -> one probability per label
+        normalized = (features - self.mean) / self.std
+        scale, zero_point = self._input["quantization"]
+        if scale:
+            normalized = np.round(normalized / scale + zero_point)
+            normalized = np.clip(normalized, -128, 127)
+        batch = normalized.astype(self._input["dtype"])
+        batch = batch.reshape(self._input["shape"])
+
+        self.interpreter.set_tensor(self._input["index"], batch)
+        self.interpreter.invoke()
+        output = self.interpreter.get_tensor(self._output["index"])[0]
+
+        scale, zero_point = self._output["quantization"]
+        if scale:
+            return (output.astype(np.float32) - zero_point) * scale
+        return output.astype(np.float32)
+
+
+# Streaming keyword spotter. Audio goes through the frontend incrementally,
+# the model runs on a sliding one second window of feature frames every
+# STRIDE_FRAMES, and a keyword is reported when its smoothed score crosses
+# the threshold.
+class KeywordSpotter:
+    def __init__(
+        self,
+        model: KeywordModel,
+        keywords: Optional[Sequence[str]] = None,
+        threshold: float = THRESHOLD,
+        stride_frames: int = STRIDE_FRAMES,
+    ):
+        self.model = model
+        self.frontend = model.frontend()
+        self.threshold = threshold
+        self.stride_frames = stride_frames
+        # Only these labels are reported; by default every keyword
+        self.keywords = set(keywords or model.labels) - {BACKGROUND}
+
+        # The window starts out full of silence, as clips shorter than the
+        # window were padded with silence in training
+        silence = np.zeros(self.frontend.window_samples, dtype=np.float32)
+        self._silence = self.frontend(silence)[0]
+        self._window = np.zeros(
+            (model.frames, model.features), dtype=np.float32
+        )
+        self._scores: Deque[np.ndarray] = deque(maxlen=SMOOTHING)
+        self.reset()
+
+    def reset(self):
+        self.frontend.reset()
+        self._window[:] = self._silence
+        self._scores.clear()
+        self._frames = 0
+        self._since_inference = 0
+        self._last_detection: Optional[float] = None
+
+    @property
+    def seconds(self) -> float:
+        return (
+            self._frames
+            * self.frontend.hop_samples
+            / self.frontend.sample_rate
+        )
+
+    def process(self, samples: np.ndarray) -> List[Detection]:
+        detections = []
+        for frame in self.frontend.process(samples):
+            self._window[:-1] = self._window[1:]
+            self._window[-1] = frame
+            self._frames += 1
+            self._since_inference += 1
+            if self._since_inference < self.stride_frames:
+                continue
+            self._since_inference = 0
+
+            self._scores.append(self.model.predict(self._window))
+            detection = self._detect()
+            if detection is not None:
+                detections.append(detection)
+        return detections
+
+    def spot(self, samples: np.ndarray) -> Optional[Detection]:
+        # Best detection in a whole clip, padded so even a short clip fills
+        # the model's window
+        self.reset()
+        window_samples = int(CLIP_SECONDS * self.frontend.sample_rate)
+        padding = np.zeros(window_samples // 2, dtype=np.float32)
+        detections = self.process(np.concatenate([samples, padding]))
+        self.reset()
+        return max(detections, key=lambda d: d.score, default=None)
+
+    def _detect(self) -> Optional[Detection]:
+        now = self.seconds
+        if (
+            self._last_detection is not None
+            and now - self._last_detection < REFRACTORY_SECONDS
+        ):
+            return None
+
+        scores = np.mean(self._scores, axis=0)
+        best = int(np.argmax(scores))
+        keyword = self.model.labels[best]
+        if keyword not in self.keywords or scores[best] < self.threshold:
+            return None
+
+        self._last_detection = now
+        return Detection(keyword=keyword, score=float(scores[best]), at=now)
@@ -1,55 +1,242 @@
-import asyncio
+import math
+import threading
+import time
 
-from typing import Optional
+from abc import abstractmethod, ABCMeta
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Sequence, Tuple
 
-import adafruit_dotstar
-from datetime import datetime, timedelta
 from loguru import logger
 
 from yuri.config import Config
+from yuri.timing import Ticker
+
+Color = Tuple[int, int, int]
+Frame = Tuple[Color, ...]
+
+PIXELS = 3
+FRAME_RATE = 100
+BLACK: Color = (0, 0, 0)
+
+
+def wheel(pos: int) -> Color:
+    # Input a value 0 to 255 to get a color value.
+    # The colours are a transition r - g - b - back to r.
+    if pos < 0 or pos > 255:
+        return (0, 0, 0)
+    if pos < 85:
+        return (255 - pos * 3, pos * 3, 0)
+    if pos < 170:
+        pos -= 85
+        return (0, 255 - pos * 3, pos * 3)
+    pos -= 170
+    return (pos * 3, 0, 255 - pos * 3)
+
+
+WHEEL: Tuple[Color, ...] = tuple(wheel(pos) for pos in range(256))
+
+
+# Effects precompute every frame they can produce, so rendering a frame is a
+# table lookup.
+class Effect(metaclass=ABCMeta):
+    @property
+    @abstractmethod
+    def frames(self) -> Sequence[Frame]:
+        raise NotImplementedError()
+
+    def frame(self, index: int) -> Frame:
+        frames = self.frames
+        return frames[index % len(frames)]
+
+
+class RainbowCycle(Effect):
+    def __init__(self, pixels: int = PIXELS, step: int = 5):
+        self._frames = [
+            tuple(
+                WHEEL[((i * 256 // pixels) + j * step) & 255]
+                for i in range(pixels)
+            )
+            for j in range(255)
+        ]
+
+    @property
+    def frames(self) -> Sequence[Frame]:
+        return self._frames
+
+
+class Solid(Effect):
+    def __init__(self, color: Color, pixels: int = PIXELS):
+        self._frames = [(color,) * pixels]
+
+    @property
+    def frames(self) -> Sequence[Frame]:
+        return self._frames
+
+
+class Breathe(Effect):
+    def __init__(
+        self,
+        color: Color,
+        period: float = 3.0,
+        frame_rate: int = FRAME_RATE,
+        pixels: int = PIXELS,
+    ):
+        steps = max(1, int(period * frame_rate))
+        self._frames = []
+        for step in range(steps):
+            level = 0.5 - 0.5 * math.cos(2.0 * math.pi * step / steps)
+            scaled = tuple(int(channel * level) for channel in color)
+            self._frames.append((scaled,) * pixels)
+
+    @property
+    def frames(self) -> Sequence[Frame]:
+        return self._frames
+
+
+@dataclass
+class LightStats:
+    frames: int = 0
+    frames_dropped: int = 0
+    pixels_written: int = 0
+    shows: int = 0
+
+    def reset(self):
+        self.frames = 0
+        self.frames_dropped = 0
+        self.pixels_written = 0
+        self.shows = 0
+
+
+# Pushes frames out to the strip from its own thread, so the SPI transfer in
+# DotStar.show() never runs on the event loop. Frames are rendered into the
+# back buffer and swapped to the front for the writer; if the writer hasn't
+# picked up the previous frame yet it's stale and gets dropped, never queued.
+class DotStarWriter(threading.Thread):
+    def __init__(self, write: Callable[[Frame], bool], stats: LightStats):
+        super().__init__(name="dotstar-writer", daemon=True)
+        self._write = write
+        self._stats = stats
+        self._back: List[Color] = [BLACK] * PIXELS
+        self._front: List[Color] = [BLACK] * PIXELS
+        self._fresh = False
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def submit(self, frame: Frame):
+        back = self._back
+        back[:] = frame
+
+        with self._condition:
+            if self._fresh:
+                self._stats.frames_dropped += 1
+            self._back, self._front = self._front, back
+            self._fresh = True
+            self._condition.notify()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while not self._fresh and not self._closed:
+                    self._condition.wait()
+                if not self._fresh:
+                    return
+                frame = tuple(self._front)
+                self._fresh = False
+
+            self._write(frame)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self.join()
 
 
 class Lights:
-    def __init__(self, config: Config):
+    def __init__(
+        self,
+        config: Config,
+        frame_rate: int = FRAME_RATE,
+        threaded: bool = True,
+    ):
         self.config = config
+        self.frame_rate = frame_rate
+        self.stats = LightStats()
+        import adafruit_dotstar
+
+        # Pixels are only pushed out by `write`, once per frame
         self.dots = adafruit_dotstar.DotStar(
-            config.pins.dotstar_clock,
-            config.pins.dotstar_data,
-            3,
+            config.pins.pin("dotstar_clock"),
+            config.pins.pin("dotstar_data"),
+            PIXELS,
             brightness=0.2,
+            auto_write=False,
         )
+        self._shown: List[Optional[Color]] = [None] * PIXELS
+        # Played instead of whatever play() was given, until cleared
+        self.effect: Optional[Effect] = None
+
+        self.writer: Optional[DotStarWriter] = None
+        if threaded:
+            self.writer = DotStarWriter(self.write, self.stats)
+            self.writer.start()
 
-    @staticmethod
-    def wheel(pos):
-        # Input a value 0 to 255 to get a color value.
-        # The colours are a transition r - g - b - back to r.
-        if pos < 0 or pos > 255:
-            return (0, 0, 0)
-        if pos < 85:
-            return (255 - pos * 3, pos * 3, 0)
-        if pos < 170:
-            pos -= 85
-            return (0, 255 - pos * 3, pos * 3)
-        pos -= 170
-        return (pos * 3, 0, 255 - pos * 3)
+    def render(self, frame: Frame):
+        self.stats.frames += 1
+        if self.writer is None:
+            self.write(frame)
+        else:
+            self.writer.submit(frame)
+
+    def write(self, frame: Frame) -> bool:
+        changed = False
+        for i, color in enumerate(frame):
+            if self._shown[i] != color:
+                self.dots[i] = color
+                self._shown[i] = color
+                self.stats.pixels_written += 1
+                changed = True
+
+        if changed:
+            self.dots.show()
+            self.stats.shows += 1
+        return changed
+
+    def override(self, effect: Optional[Effect]):
+        self.effect = effect
+        if effect is not None:
+            self.render(effect.frame(0))
 
     def off(self):
-        for i in range(3):
-            self.dots[i] = 0
+        self.render((BLACK,) * PIXELS)
 
-    async def cycle_colors(self, seconds: Optional[int] = None):
-        stop_at = datetime.utcnow() + timedelta(
-            seconds=seconds if seconds else 999999
-        )
-        logger.info("cycle_colors.start")
+    def close(self):
+        # Waits for the last frame to reach the strip
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    async def play(self, effect: Effect, seconds: Optional[float] = None):
+        stop_at = None if seconds is None else time.monotonic() + seconds
+        ticker = Ticker(1.0 / self.frame_rate)
 
-        while datetime.utcnow() < stop_at:
-            for j in range(255):
-                for i in range(3):
-                    rc_index = (i * 256 // 3) + j * 5
-                    self.dots[i] = self.wheel(rc_index & 255)
-                self.dots.show()
-                await asyncio.sleep(0.01)
+        index = 0
+        while stop_at is None or time.monotonic() < stop_at:
+            self.render((self.effect or effect).frame(index))
+            index += 1
+            await ticker.wait()
 
-        self.off()
-        logger.info("cycle_colors.done")
+    async def cycle_colors(self, seconds: Optional[int] = None):
+        logger.info("cycle_colors.start")
+        try:
+            await self.play(RainbowCycle(PIXELS), seconds=seconds or None)
+        finally:
+            self.off()
+            logger.info(
+                "cycle_colors.done",
+                frames=self.stats.frames,
+                frames_dropped=self.stats.frames_dropped,
+                pixels_written=self.stats.pixels_written,
+                shows=self.stats.shows,
+            )
+            self.stats.reset()
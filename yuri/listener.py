@@ -1,11 +1,52 @@
+import os
+import queue
+import re
+import tempfile
+import threading
+import time
+
 from abc import abstractmethod, ABCMeta
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import Callable
+from typing import TYPE_CHECKING, Callable, Iterable, Optional, Tuple
 
 from loguru import logger
-import speech_recognition as sr
+import numpy as np
 
+from yuri.audio import PCMClip, to_samples
+from yuri.audio_bus import AudioBus
+from yuri.capture import (
+    BLOCK_FRAMES,
+    FRAME_SAMPLES,
+    SAMPLE_RATE,
+    SEGMENT_BACKLOG,
+    AudioCapture,
+    AudioSource,
+    MicrophoneSource,
+    Segment,
+    VoiceActivityDetector,
+)
 from yuri.config import Config
+from yuri.kws import CLIP_SECONDS, KeywordModel, KeywordSpotter
+from yuri.noise import NoiseFloor
+
+if TYPE_CHECKING:
+    import speech_recognition as sr
+
+# How long transcribe() waits on the streaming decoder before decoding the
+# segment itself
+STREAM_TIMEOUT = 5.0
+# pocketsphinx names the search built from -lm "_default"
+SEARCHES = {
+    "language_model": "_default",
+    "grammar": "grammar",
+    "keywords": "keywords",
+}
+# How long after a bare wake word the command can start
+FOLLOW_UP_SECONDS = 4.0
+# Speech this long past the keyword window is taken to be a command said in
+# the same breath as the wake word
+SAME_BREATH_SECONDS = 0.5
 
 
 @dataclass
@@ -25,17 +66,128 @@ class Listener(metaclass=ABCMeta):
     def transcribe(self, audio) -> Transcription:
         raise NotImplementedError()
 
+    def to_audio(self, segment: Segment):
+        # Whatever transcribe() takes
+        return segment
+
+    def transcribe_clip(self, clip: PCMClip) -> Transcription:
+        # For recordings rather than live capture
+        segment = Segment(clip=clip, started_at=0.0, ended_at=clip.duration)
+        return self.transcribe(self.to_audio(segment))
+
+    def close(self):
+        pass
+
+
+# Listeners fed by a continuously running AudioCapture
+class CaptureListener(Listener):
+    def __init__(
+        self,
+        config: Config,
+        source: Optional[AudioSource] = None,
+        bus: Optional[AudioBus] = None,
+    ):
+        # Pass the bus to share one microphone with other audio consumers;
+        # otherwise the listener opens `source` (or the microphone) itself
+        super().__init__(config)
+        self.source = source
+        self.bus = bus
+        self._owns_bus = bus is None
+        self._capture: Optional[AudioCapture] = None
+        # Called from a decoding thread with (segment start, text so far)
+        # by listeners that transcribe while the utterance is still going
+        self.on_partial: Optional[Callable[[int, str], None]] = None
+
+    @property
+    def capture(self) -> AudioCapture:
+        # The microphone is read continuously from the first listen on, so
+        # nothing said while we're busy transcribing gets lost
+        if self._capture is None:
+            if self.bus is None:
+                self.bus = AudioBus(
+                    self.source or MicrophoneSource(),
+                    frame_samples=FRAME_SAMPLES * BLOCK_FRAMES,
+                )
+            vad = VoiceActivityDetector()
+            profile_path = self.config.noise_profile_path
+            if profile_path is not None:
+                vad.noise.load(profile_path)
+            self._capture = AudioCapture(
+                self.bus, vad=vad, noise_profile_path=profile_path
+            )
+            self.attach(self._capture)
+            self._capture.start()
+            if not self.bus.is_alive() and self._owns_bus:
+                self.bus.start()
+        return self._capture
+
+    @property
+    def noise(self) -> NoiseFloor:
+        return self.capture.vad.noise
+
+    def attach(self, capture: AudioCapture):
+        # Called before capture starts, for listeners that consume its audio
+        # as it arrives
+        pass
+
+    def listen(self):
+        logger.info("listen.start")
+        segment = self.capture.next_segment()
+        logger.info("listen.done")
+
+        if segment is None:
+            return None
+        return self.to_audio(segment)
+
+    async def utterances(self):
+        async for segment in self.capture.segments():
+            yield self.to_audio(segment)
+
+    def close(self):
+        if self._capture is not None:
+            if self._owns_bus:
+                self.bus.close()
+            self._capture.close()
+            self._capture = None
+
 
 # TODO speech_recognition isn't maintained. The transcription is too slow.
 # Find something faster.
-class SpeechRecognitionListener(Listener):
-    def __init__(self, config: Config):
-        super().__init__(config)
-        self.mic = sr.Microphone()
+class SpeechRecognitionListener(CaptureListener):
+    def __init__(
+        self,
+        config: Config,
+        source: Optional[AudioSource] = None,
+        bus: Optional[AudioBus] = None,
+    ):
+        import speech_recognition as sr
+
+        super().__init__(config, source, bus)
         self.recognizer = sr.Recognizer()
+        # The noise floor is tracked by the capture thread, never by the
+        # recognizer, so listening doesn't start with a second of calibration
+        self.recognizer.dynamic_energy_threshold = False
+
+    @staticmethod
+    def to_audio_data(segment: Segment) -> "sr.AudioData":
+        import speech_recognition as sr
+
+        clip = segment.clip
+        return sr.AudioData(clip.data, clip.sample_rate, clip.sample_width)
+
+    def to_audio(self, segment: Segment) -> "sr.AudioData":
+        self.sync_threshold()
+        return self.to_audio_data(segment)
+
+    def sync_threshold(self):
+        if self._capture is None:
+            return
+        threshold = self.noise.threshold
+        if threshold is not None:
+            self.recognizer.energy_threshold = threshold
 
     @property
-    def recognize(self) -> Callable[[sr.AudioData], str]:
+    def recognize(self) -> Callable[["sr.AudioData"], str]:
         listener_type = self.config.listener_type
         transcribe_name = f"recognize_{listener_type}"
         if not hasattr(self.recognizer, transcribe_name):
@@ -43,29 +195,286 @@ class SpeechRecognitionListener(Listener):
 
         return getattr(self.recognizer, transcribe_name)
 
-    def listen(self) -> sr.AudioData:
-        logger.info("listen.start")
+    def transcribe(self, audio: "sr.AudioData") -> Transcription:
+        logger.info("transcribe.start")
+
+        transcription = self.recognize(audio)
 
-        with self.mic as source:
-            logger.debug("adjusting")
-            self.recognizer.adjust_for_ambient_noise(source)
+        logger.info("transcribe.done")
+        return Transcription(text=transcription)
 
-            logger.debug("listening")
-            audio = self.recognizer.listen(source)
 
-        logger.info("listen.done")
-        return audio
+def normalize_phrase(phrase: str) -> str:
+    return " ".join(re.sub(r"[^a-z' ]", " ", phrase.lower()).split())
 
-    def transcribe(self, audio: sr.AudioData) -> Transcription:
+
+def jsgf_grammar(phrases: Iterable[str]) -> str:
+    alternatives = " | ".join(sorted({normalize_phrase(p) for p in phrases}))
+    return (
+        "#JSGF V1.0;\n"
+        "grammar yuri;\n"
+        f"public <command> = {alternatives};\n"
+    )
+
+
+# Talks to pocketsphinx directly instead of through speech_recognition,
+# which builds a new decoder, reloading every model, for each call. One
+# decoder stays loaded for the life of the listener and is fed each
+# utterance while it's still being spoken, so only the final search is left
+# once the speaker stops. It can also be restricted to a grammar or keyword
+# list of known commands rather than the full English language model.
+class PocketsphinxListener(CaptureListener):
+    def __init__(
+        self,
+        config: Config,
+        source: Optional[AudioSource] = None,
+        bus: Optional[AudioBus] = None,
+    ):
+        from pocketsphinx import Decoder, get_model_path
+
+        super().__init__(config, source, bus)
+        model_path = get_model_path()
+        decoder_config = Decoder.default_config()
+        decoder_config.set_string("-hmm", os.path.join(model_path, "en-us"))
+        decoder_config.set_string(
+            "-lm", os.path.join(model_path, "en-us.lm.bin")
+        )
+        decoder_config.set_string(
+            "-dict", os.path.join(model_path, "cmudict-en-us.dict")
+        )
+        decoder_config.set_string("-logfn", os.devnull)
+        self.decoder = Decoder(decoder_config)
+
+        # Held for a whole utterance, from start_utt to end_utt
+        self._decoder_lock = threading.Lock()
+        self._pending_search: Optional[Tuple[str, Tuple[str, ...]]] = None
+        self._results: "OrderedDict[int, Transcription]" = OrderedDict()
+        self._results_ready = threading.Condition()
+        self._streamer: Optional[threading.Thread] = None
+
+        self.use_search(config.listener_search, config.listener_phrases)
+
+    def use_search(self, search: str, phrases: Iterable[str] = ()):
+        # Takes effect from the next utterance
+        if search not in SEARCHES:
+            raise ValueError(f"{search} is not a valid search")
+        phrases = tuple(phrases)
+        if search != "language_model" and not phrases:
+            raise ValueError(f"the {search} search needs phrases")
+        self._pending_search = (search, phrases)
+
+    def attach(self, capture: AudioCapture):
+        self._streamer = threading.Thread(
+            target=self._decode_stream,
+            args=(capture.stream(),),
+            name="sphinx-decoder",
+            daemon=True,
+        )
+        self._streamer.start()
+
+    def transcribe(self, audio: Segment) -> Transcription:
         logger.info("transcribe.start")
 
-        transcription = self.recognize(audio)
+        transcription = None
+        if self._streamer is not None:
+            transcription = self._streamed(audio.start)
+        if transcription is None:
+            transcription = self.decode(audio.clip)
 
-        logger.info("transcribe.done")
-        return Transcription(text=transcription)
+        logger.info("transcribe.done", text=transcription.text)
+        return transcription
+
+    def decode(self, clip: PCMClip) -> Transcription:
+        samples = to_samples(clip, SAMPLE_RATE).astype("<i2")
+        with self._decoder_lock:
+            self._start_utterance()
+            self.decoder.process_raw(samples.tobytes(), False, True)
+            return self._end_utterance()
+
+    def close(self):
+        super().close()
+        if self._streamer is not None:
+            self._streamer.join()
+            self._streamer = None
+
+    def _start_utterance(self):
+        if self._pending_search is not None:
+            search, phrases = self._pending_search
+            self._pending_search = None
+            if search == "grammar":
+                self.decoder.set_jsgf_string(search, jsgf_grammar(phrases))
+            elif search == "keywords":
+                self._set_keywords(phrases)
+            self.decoder.set_search(SEARCHES[search])
+            logger.debug(f"sphinx search = {search}")
+        self.decoder.start_utt()
+
+    def _set_keywords(self, phrases: Tuple[str, ...]):
+        # pocketsphinx only reads keyword lists from a file
+        fd, path = tempfile.mkstemp(suffix=".kws")
+        try:
+            with os.fdopen(fd, "w") as keyword_file:
+                for phrase in sorted({normalize_phrase(p) for p in phrases}):
+                    keyword_file.write(f"{phrase} /1e-20/\n")
+            self.decoder.set_kws("keywords", path)
+        finally:
+            os.remove(path)
+
+    def _end_utterance(self) -> Transcription:
+        self.decoder.end_utt()
+        hypothesis = self.decoder.hyp()
+        return Transcription(
+            text="" if hypothesis is None else hypothesis.hypstr
+        )
+
+    def _decode_stream(self, chunks: "queue.Queue"):
+        # Decodes each utterance chunk by chunk as capture finds it
+        while True:
+            start, samples = chunks.get()
+            if start is None:
+                return
+
+            stopped = False
+            partial = ""
+            with self._decoder_lock:
+                self._start_utterance()
+                while samples is not None:
+                    self.decoder.process_raw(samples.tobytes(), False, False)
+                    if self.on_partial is not None:
+                        hypothesis = self.decoder.hyp()
+                        text = "" if hypothesis is None else hypothesis.hypstr
+                        if text != partial:
+                            partial = text
+                            self.on_partial(start, text)
+                    chunk_start, samples = chunks.get()
+                    stopped = chunk_start is None
+                transcription = self._end_utterance()
+
+            with self._results_ready:
+                self._results[start] = transcription
+                while len(self._results) > SEGMENT_BACKLOG:
+                    self._results.popitem(last=False)
+                self._results_ready.notify_all()
+            if stopped:
+                return
+
+    def _streamed(self, start: int) -> Optional[Transcription]:
+        with self._results_ready:
+            self._results_ready.wait_for(
+                lambda: start in self._results, timeout=STREAM_TIMEOUT
+            )
+            return self._results.pop(start, None)
+
+
+@dataclass
+class Spotted:
+    segment: Segment
+    # Set for command words, which need no further recognition
+    keyword: Optional[str] = None
+
+
+# Always-on keyword spotting in front of an expensive recognizer. Every
+# captured utterance goes through the small int8 keyword model; command
+# words are returned as they are, and only a wake word, with the speech
+# following it, is passed on to the full recognizer (wake_listener_type).
+class KeywordListener(CaptureListener):
+    def __init__(
+        self,
+        config: Config,
+        source: Optional[AudioSource] = None,
+        bus: Optional[AudioBus] = None,
+    ):
+        # Checked before anything opens; the recognizer would be another
+        # keyword listener, without end
+        if config.wake_listener_type == "keyword":
+            raise ValueError("keyword is invalid as a wake_listener_type")
+        super().__init__(config, source, bus)
+        self.wake_words = set(config.wake_words)
+        self.spotter = KeywordSpotter(
+            KeywordModel(config.keyword_model_path),
+            threshold=config.keyword_threshold,
+        )
+        self.recognizer = ListenerFactory.create(
+            config.copy(update={"listener_type": config.wake_listener_type})
+        )
+        self._awake_until: Optional[float] = None
+
+    def to_audio(self, segment: Segment) -> Optional[Spotted]:
+        # None for speech that isn't addressed to us
+        if self._awake_until is not None:
+            awake = segment.started_at <= self._awake_until
+            self._awake_until = None
+            if awake:
+                return Spotted(segment)
+
+        samples = np.frombuffer(segment.clip.data, dtype="<i2")
+        detection = self.spotter.spot(samples)
+        if detection is None:
+            return None
+        logger.info(
+            "keyword.detected",
+            keyword=detection.keyword,
+            score=detection.score,
+        )
+
+        if detection.keyword not in self.wake_words:
+            return Spotted(segment, keyword=detection.keyword)
+        if segment.clip.duration > CLIP_SECONDS + SAME_BREATH_SECONDS:
+            return Spotted(segment)
+        self._awake_until = segment.ended_at + FOLLOW_UP_SECONDS
+        return None
+
+    def listen(self) -> Optional[Spotted]:
+        logger.info("listen.start")
+        while True:
+            segment = self.capture.next_segment()
+            if segment is None:
+                return None
+            spotted = self.to_audio(segment)
+            if spotted is not None:
+                logger.info("listen.done")
+                return spotted
+
+    async def utterances(self):
+        async for spotted in super().utterances():
+            if spotted is not None:
+                yield spotted
+
+    def transcribe(self, audio: Spotted) -> Transcription:
+        if audio.keyword is not None:
+            return Transcription(text=audio.keyword)
+        started_at = time.monotonic()
+        transcription = self.recognizer.transcribe(
+            self.recognizer.to_audio(audio.segment)
+        )
+        logger.info(
+            "keyword.transcribed",
+            seconds=time.monotonic() - started_at,
+            text=transcription.text,
+        )
+        return transcription
+
+    def close(self):
+        super().close()
+        self.recognizer.close()
 
 
 class ListenerFactory:
+    # Any other listener type is one of speech_recognition's recognize_*
+    LISTENERS = {
+        "pocketsphinx": PocketsphinxListener,
+        "keyword": KeywordListener,
+    }
+
     @classmethod
-    def create(cls, config: Config) -> Listener:
-        return SpeechRecognitionListener(config)
+    def create(
+        cls,
+        config: Config,
+        bus: Optional[AudioBus] = None,
+        source: Optional[AudioSource] = None,
+    ) -> Listener:
+        listener_type = config.listener_type
+        listener_class = cls.LISTENERS.get(
+            listener_type, SpeechRecognitionListener
+        )
+        return listener_class(config, source=source, bus=bus)
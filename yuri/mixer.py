@@ -0,0 +1,254 @@
+import threading
+import time
+import wave
+
+from abc import abstractmethod, ABCMeta
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import numpy as np
+
+from loguru import logger
+
+from yuri.audio import PCMClip, to_samples
+from yuri.config import Config
+
+SAMPLE_RATE = 24000
+BLOCK_FRAMES = 512
+
+
+class Sink(metaclass=ABCMeta):
+    @abstractmethod
+    def open(self, sample_rate: int, block_frames: int):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def write(self, block: bytes):
+        # Should block until the device wants the next block
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class PyAudioSink(Sink):
+    def __init__(self, config: Optional[Config] = None):
+        pass
+
+    def open(self, sample_rate: int, block_frames: int):
+        import pyaudio
+
+        self.audio = pyaudio.PyAudio()
+        self.stream = self.audio.open(
+            format=pyaudio.paInt16,
+            channels=1,
+            rate=sample_rate,
+            output=True,
+            frames_per_buffer=block_frames,
+        )
+
+    def write(self, block: bytes):
+        self.stream.write(block)
+
+    def close(self):
+        self.stream.stop_stream()
+        self.stream.close()
+        self.audio.terminate()
+
+
+# Sinks without a device clock pace themselves in real time, so the mixer
+# behaves (and can be benchmarked) the same as with a sound card
+class PacedSink(Sink):
+    def open(self, sample_rate: int, block_frames: int):
+        self.block_seconds = block_frames / sample_rate
+        self.deadline = time.monotonic()
+
+    def write(self, block: bytes):
+        self.deadline += self.block_seconds
+        delay = self.deadline - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self.deadline = time.monotonic()
+
+
+class NullSink(PacedSink):
+    def __init__(self, config: Optional[Config] = None):
+        pass
+
+
+class WaveFileSink(PacedSink):
+    def __init__(self, config: Config):
+        self.path = config.audio_sink_path or "yuri-output.wav"
+
+    def open(self, sample_rate: int, block_frames: int):
+        super().open(sample_rate, block_frames)
+        self.wav = wave.open(self.path, "wb")
+        self.wav.setnchannels(1)
+        self.wav.setsampwidth(2)
+        self.wav.setframerate(sample_rate)
+
+    def write(self, block: bytes):
+        self.wav.writeframes(block)
+        super().write(block)
+
+    def close(self):
+        self.wav.close()
+
+
+class SinkFactory:
+    SINKS = {
+        "pyaudio": PyAudioSink,
+        "wav": WaveFileSink,
+        "null": NullSink,
+    }
+
+    @classmethod
+    def create(cls, config: Config) -> Sink:
+        sink_type = config.audio_sink
+        if sink_type not in cls.SINKS:
+            raise ValueError(f"{sink_type} is invalid")
+
+        return cls.SINKS[sink_type](config)
+
+
+@dataclass(eq=False)
+class Voice:
+    samples: np.ndarray
+    # Absolute mixer frame of the first sample
+    start_frame: int
+    interrupted: threading.Event = field(default_factory=threading.Event)
+    done: threading.Event = field(default_factory=threading.Event)
+    position: int = 0
+    queued_at: float = field(default_factory=time.monotonic)
+    first_sample_at: Optional[float] = None
+
+    @property
+    def end_frame(self) -> int:
+        return self.start_frame + len(self.samples)
+
+    @property
+    def latency(self) -> Optional[float]:
+        if self.first_sample_at is None:
+            return None
+        return self.first_sample_at - self.queued_at
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self.done.wait(timeout)
+
+
+# One long-lived output stream shared by every speaker backend. Clips are
+# resampled to the mixer rate when queued and summed into fixed-size blocks,
+# so a new clip starts within one block and clips can overlap.
+class AudioMixer(threading.Thread):
+    def __init__(
+        self,
+        sink: Sink,
+        sample_rate: int = SAMPLE_RATE,
+        block_frames: int = BLOCK_FRAMES,
+    ):
+        super().__init__(name="audio-mixer", daemon=True)
+        self.sink = sink
+        self.sample_rate = sample_rate
+        self.block_frames = block_frames
+        self.frames_written = 0
+
+        self._voices: List[Voice] = []
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        # Set once the output stream is gone, with why if it failed
+        self._stopped = False
+        self.error: Optional[Exception] = None
+        self._mix = np.zeros(block_frames, dtype=np.float32)
+
+    def play(
+        self,
+        clip: PCMClip,
+        delay: float = 0.0,
+        interrupted: Optional[threading.Event] = None,
+        after: Optional[Voice] = None,
+    ) -> Voice:
+        # `delay` is in seconds, with sample accuracy, from the next block or
+        # from the end of `after` when chaining clips back to back
+        start_frame = self.frames_written
+        if after is not None:
+            start_frame = max(start_frame, after.end_frame)
+
+        voice = Voice(
+            samples=to_samples(clip, self.sample_rate),
+            start_frame=start_frame + int(round(delay * self.sample_rate)),
+            interrupted=interrupted or threading.Event(),
+        )
+        if not len(voice.samples):
+            voice.done.set()
+            return voice
+
+        with self._lock:
+            if self._stopped:
+                raise RuntimeError("audio mixer isn't running") from self.error
+            self._voices.append(voice)
+        return voice
+
+    def close(self):
+        self._closed.set()
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        opened = False
+        try:
+            self.sink.open(self.sample_rate, self.block_frames)
+            opened = True
+            while not self._closed.is_set():
+                self.sink.write(self.mix_block())
+        except Exception as error:  # pylint: disable=broad-except
+            logger.exception("mixer.failed")
+            self.error = error
+        finally:
+            if opened:
+                self.sink.close()
+            # Nothing will play what's queued, or anything queued later
+            with self._lock:
+                self._stopped = True
+                voices, self._voices = self._voices, []
+            for voice in voices:
+                voice.done.set()
+
+    def mix_block(self) -> bytes:
+        block_start = self.frames_written
+        mix = self._mix
+        mix.fill(0.0)
+
+        with self._lock:
+            voices = list(self._voices)
+
+        finished = []
+        for voice in voices:
+            if voice.interrupted.is_set():
+                finished.append(voice)
+                continue
+
+            offset = max(voice.start_frame - block_start, 0)
+            if offset >= self.block_frames:
+                continue
+
+            count = min(
+                self.block_frames - offset, len(voice.samples) - voice.position
+            )
+            mix[offset : offset + count] += voice.samples[
+                voice.position : voice.position + count
+            ]
+            if voice.first_sample_at is None:
+                voice.first_sample_at = time.monotonic()
+            voice.position += count
+            if voice.position >= len(voice.samples):
+                finished.append(voice)
+
+        if finished:
+            with self._lock:
+                self._voices = [v for v in self._voices if v not in finished]
+            for voice in finished:
+                voice.done.set()
+
+        self.frames_written = block_start + self.block_frames
+        return np.clip(mix, -32768, 32767).astype("<i2").tobytes()
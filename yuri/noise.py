@@ -0,0 +1,147 @@
+import json
+import os
+import tempfile
+
+from typing import Optional
+
+import numpy as np
+
+from loguru import logger
+
+BANDS = 16
+# Roughly a 1.5s memory at 30ms frames
+ALPHA = 0.02
+# Until this many frames have been seen the floor is a plain running mean,
+# so a cold start converges within the first second
+WARMUP_FRAMES = 33
+
+
+# Tracks the background noise from frames the VAD didn't classify as speech:
+# an exponentially weighted RMS energy plus a per-band power spectrum. The
+# profile is saved between runs, so a cold start is already calibrated.
+class NoiseFloor:
+    def __init__(
+        self,
+        frame_samples: int,
+        alpha: float = ALPHA,
+        threshold_ratio: float = 3.0,
+        min_threshold: float = 100.0,
+        snr_db: float = 12.0,
+        bands: int = BANDS,
+    ):
+        self.frame_samples = frame_samples
+        self.alpha = alpha
+        self.threshold_ratio = threshold_ratio
+        self.min_threshold = min_threshold
+        self.snr_db = snr_db
+        self.bands = bands
+
+        self.energy: Optional[float] = None
+        self.spectrum: Optional[np.ndarray] = None
+        self.frames = 0
+
+        # rfft bins are split into equal-width bands, DC excluded
+        bins = frame_samples // 2 + 1
+        self._band_edges = np.linspace(1, bins, bands + 1).astype(int)[:-1]
+
+    @property
+    def calibrated(self) -> bool:
+        return self.frames >= WARMUP_FRAMES
+
+    @property
+    def threshold(self) -> Optional[float]:
+        # RMS energy above which a frame counts as speech, in the same int16
+        # units as speech_recognition's energy_threshold
+        if self.energy is None:
+            return None
+        return max(self.energy * self.threshold_ratio, self.min_threshold)
+
+    def band_power(self, frames: np.ndarray) -> np.ndarray:
+        # frames: (n, frame_samples) -> (n, bands)
+        power = np.abs(np.fft.rfft(frames, axis=1)) ** 2
+        widths = np.diff(np.append(self._band_edges, power.shape[1]))
+        return np.add.reduceat(power, self._band_edges, axis=1) / widths
+
+    def snr(self, frames: np.ndarray) -> np.ndarray:
+        # Power over the noise profile in dB, averaged over each frame's
+        # loudest quarter of bands. Picks up speech the overall energy misses
+        # when the noise sits in a few bands (fans, mains hum).
+        if self.spectrum is None:
+            return np.zeros(len(frames))
+        ratio = (self.band_power(frames) + 1.0) / (self.spectrum + 1.0)
+        top = max(1, self.bands // 4)
+        loudest = np.sort(np.log10(ratio), axis=1)[:, -top:]
+        return 10.0 * np.mean(loudest, axis=1)
+
+    def voiced(self, frames: np.ndarray, energies: np.ndarray) -> np.ndarray:
+        threshold = self.threshold
+        if threshold is None or not self.calibrated:
+            return np.zeros(len(frames), dtype=bool)
+        loud = energies > threshold
+        distinct = (self.snr(frames) > self.snr_db) & (
+            energies > self.min_threshold
+        )
+        return loud | distinct
+
+    def update(self, frames: np.ndarray, energies: np.ndarray):
+        # Folds a block of non-speech frames in as one weighted observation
+        count = len(frames)
+        if not count:
+            return
+
+        weight = 1.0 - (1.0 - self.alpha) ** count
+        if self.frames < WARMUP_FRAMES:
+            weight = max(weight, count / (self.frames + count))
+        energy = float(np.mean(energies))
+        spectrum = np.mean(self.band_power(frames), axis=0)
+
+        if self.energy is None or self.spectrum is None:
+            self.energy, self.spectrum = energy, spectrum
+        else:
+            self.energy += weight * (energy - self.energy)
+            self.spectrum += weight * (spectrum - self.spectrum)
+        self.frames += count
+
+    def save(self, path: str):
+        if self.energy is None or self.spectrum is None:
+            return
+        profile = {
+            "frame_samples": self.frame_samples,
+            "energy": self.energy,
+            "spectrum": self.spectrum.tolist(),
+        }
+        directory = os.path.dirname(os.path.abspath(path))
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as profile_file:
+                json.dump(profile, profile_file)
+            os.replace(tmp_path, path)
+        except OSError:
+            logger.exception("noise.save_failed", path=path)
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def load(self, path: str) -> bool:
+        try:
+            with open(path) as profile_file:
+                profile = json.load(profile_file)
+            spectrum = np.array(profile["spectrum"], dtype=np.float64)
+            energy = float(profile["energy"])
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError, TypeError):
+            logger.warning("error parsing noise profile")
+            return False
+
+        if profile.get(
+            "frame_samples"
+        ) != self.frame_samples or spectrum.shape != (self.bands,):
+            return False
+
+        self.energy, self.spectrum = energy, spectrum
+        # A saved profile is trusted straight away; the average still drifts
+        # to follow the room if it has changed
+        self.frames = WARMUP_FRAMES
+        logger.debug(f"noise threshold = {self.threshold:.1f}")
+        return True
@@ -0,0 +1,504 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import signal
+import struct
+import time
+
+from dataclasses import dataclass
+from enum import IntEnum
+from multiprocessing.connection import Connection, wait
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+
+from loguru import logger
+
+from yuri.config_watch import SPEAKER_SECTIONS, ConfigFile, changed_sections
+from yuri.intents import INTENTS, PhraseIndex
+
+if TYPE_CHECKING:
+    from yuri.config import Config
+
+# Every message is a kind byte and the sender's monotonic clock (shared by
+# all processes on the machine) followed by a UTF-8 payload
+HEADER = struct.Struct("<Bd")
+# Heavy workers run at a lower priority so the scheduler favours motion
+WORKER_NICENESS = 10
+# Restart delay after a crash, doubling with each consecutive crash
+RESTART_SECONDS = 0.5
+MAX_RESTART_SECONDS = 30.0
+# A worker that stays up this long has its crash count forgiven
+STABLE_SECONDS = 60.0
+STOP_SECONDS = 5.0
+POLL_SECONDS = 1.0
+# p99 servo tick lateness the motion process should stay under
+JITTER_BUDGET_MS = 5.0
+IDLE_SECONDS = 30.0
+ATTEND_PRIORITY = 5
+# Which worker has each part of the robot that intents use
+PART_WORKERS = {"eyes": "motion", "lights": "motion", "speaker": "speak"}
+# Which worker applies each config section live; the rest take a restart
+CONFIG_WORKERS = {
+    "eyes": "motion",
+    **{section: "speak" for section in SPEAKER_SECTIONS},
+}
+
+
+class Kind(IntEnum):
+    STOP = 0
+    # JSON; servo tick jitter from the motion process
+    STATS = 1
+    # The listener caught an utterance and is transcribing it
+    HEARING = 2
+    HEARD = 3
+    SAY = 4
+    SPOKEN = 5
+    GENERATE = 6
+    GENERATED = 7
+    # The name of an intent for the worker to carry out
+    COMMAND = 8
+    # JSON; the config, after it changed on disk
+    CONFIG = 9
+
+
+@dataclass
+class Message:
+    kind: Kind
+    text: str = ""
+    sent_at: float = 0.0
+
+    def encode(self) -> bytes:
+        return HEADER.pack(self.kind, self.sent_at) + self.text.encode()
+
+    @classmethod
+    def decode(cls, data: bytes) -> "Message":
+        kind, sent_at = HEADER.unpack_from(data)
+        return cls(Kind(kind), data[HEADER.size :].decode(), sent_at)
+
+
+# One end of the pipe between the supervisor and a worker
+class Channel:
+    def __init__(self, connection: Connection):
+        self.connection = connection
+
+    def send(self, kind: Kind, text: str = ""):
+        message = Message(kind, text, time.monotonic())
+        self.connection.send_bytes(message.encode())
+
+    def recv(self) -> Message:
+        return Message.decode(self.connection.recv_bytes())
+
+    def stopped(self) -> bool:
+        # Drains pending messages without blocking; True once STOP arrived
+        # or the supervisor is gone
+        try:
+            while self.connection.poll():
+                if self.recv().kind == Kind.STOP:
+                    return True
+        except EOFError:
+            return True
+        return False
+
+    def close(self):
+        self.connection.close()
+
+
+async def receive(channel: Channel, handle: Callable[[Message], None]):
+    # Hands every message to `handle` from the event loop until STOP
+    loop = asyncio.get_event_loop()
+    fd = channel.connection.fileno()
+    stopped = loop.create_future()
+
+    def readable():
+        try:
+            while channel.connection.poll():
+                message = channel.recv()
+                if message.kind == Kind.STOP:
+                    raise EOFError()
+                handle(message)
+        except EOFError:
+            loop.remove_reader(fd)
+            if not stopped.done():
+                stopped.set_result(None)
+
+    loop.add_reader(fd, readable)
+    await stopped
+
+
+async def serve(
+    channel: Channel, handle: Callable[[Message], None], *loops
+) -> None:
+    # Runs a worker's loops until it's told to stop. A loop that fails
+    # takes the worker down with it so the supervisor restarts it.
+    receiving = asyncio.ensure_future(receive(channel, handle))
+    pending = {asyncio.ensure_future(loop) for loop in loops} | {receiving}
+    try:
+        while not receiving.done():
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def motion_worker(config_json: str, connection: Connection):
+    # Servos and lights: the only real-time work, alone on its own GIL
+    from yuri.config import Config
+    from yuri.config_watch import ConfigWatcher, watch_eyes
+    from yuri.intents import IntentRouter
+    from yuri.lights import Lights
+    from yuri.servos import STATS_INTERVAL, Servos
+
+    config = Config.parse_raw(config_json)
+    channel = Channel(connection)
+    servos = Servos(config)
+    lights = Lights(config)
+    router = IntentRouter(eyes=servos.eyes, lights=lights)
+    watcher = ConfigWatcher(config)
+    watch_eyes(watcher, servos.eyes)
+
+    def handle(message: Message):
+        if message.kind == Kind.HEARING:
+            asyncio.ensure_future(
+                servos.eyes.open(
+                    wide=True, source="attend", priority=ATTEND_PRIORITY
+                )
+            )
+        elif message.kind == Kind.COMMAND:
+            asyncio.ensure_future(router.run(message.text))
+        elif message.kind == Kind.CONFIG:
+            asyncio.ensure_future(
+                watcher.update(Config.parse_raw(message.text))
+            )
+
+    async def report():
+        reported = None
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            if servos.last_jitter is not reported:
+                reported = servos.last_jitter
+                channel.send(Kind.STATS, json.dumps(reported))
+
+    try:
+        asyncio.run(
+            serve(
+                channel, handle, servos.loop(), lights.cycle_colors(), report()
+            )
+        )
+    finally:
+        lights.close()
+
+
+def listen_worker(config_json: str, connection: Connection):
+    # Listening blocks, so STOP is only noticed between utterances; the
+    # supervisor terminates the process if it doesn't stop in time
+    from yuri.config import Config
+    from yuri.listener import ListenerFactory
+
+    config = Config.parse_raw(config_json)
+    channel = Channel(connection)
+    listener = ListenerFactory.create(config)
+    try:
+        while not channel.stopped():
+            audio = listener.listen()
+            if audio is None:
+                continue
+            channel.send(Kind.HEARING)
+            text = listener.transcribe(audio).text
+            if text:
+                channel.send(Kind.HEARD, text)
+    finally:
+        listener.close()
+
+
+def speak_worker(config_json: str, connection: Connection):
+    from yuri.config import Config
+    from yuri.config_watch import ConfigWatcher, watch_speaker
+    from yuri.intents import IntentRouter
+    from yuri.speaker import SpeakerFactory
+    from yuri.yuri import IDLE_PHRASES
+
+    config = Config.parse_raw(config_json)
+    channel = Channel(connection)
+    # The router holds the speaker, which a new config may swap out
+    router = IntentRouter(speaker=SpeakerFactory.create(config))
+    watcher = ConfigWatcher(config)
+    watch_speaker(watcher, [router])
+
+    async def say(text: str):
+        if await router.speaker.say(text):
+            channel.send(Kind.SPOKEN, text)
+
+    def handle(message: Message):
+        if message.kind == Kind.SAY:
+            asyncio.ensure_future(say(message.text))
+        elif message.kind == Kind.COMMAND:
+            asyncio.ensure_future(router.run(message.text))
+        elif message.kind == Kind.CONFIG:
+            asyncio.ensure_future(
+                watcher.update(Config.parse_raw(message.text))
+            )
+
+    async def idle():
+        while True:
+            await router.speaker.say(random.choice(IDLE_PHRASES))
+            await asyncio.sleep(random.random() * IDLE_SECONDS)
+
+    try:
+        asyncio.run(
+            serve(
+                channel, handle, idle(), router.speaker.prewarm(IDLE_PHRASES)
+            )
+        )
+    finally:
+        router.speaker.close()
+
+
+def textgen_worker(config_json: str, connection: Connection):
+    from yuri.config import Config
+    from yuri.textgen import TextGen
+
+    channel = Channel(connection)
+    textgen = TextGen(Config.parse_raw(config_json))
+    while True:
+        try:
+            message = channel.recv()
+        except EOFError:
+            return
+        if message.kind == Kind.STOP:
+            return
+        if message.kind == Kind.GENERATE:
+            reply = textgen.reply(message.text, conversation="runtime")
+            channel.send(Kind.GENERATED, reply)
+
+
+WorkerMain = Callable[[str, Connection], None]
+
+
+def _bootstrap(
+    main: WorkerMain, niceness: int, config_json: str, connection: Connection
+):
+    # Ctrl-C reaches the whole process group; only the supervisor acts on
+    # it and stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if niceness:
+        os.nice(niceness)
+    main(config_json, connection)
+
+
+@dataclass
+class Worker:
+    name: str
+    main: WorkerMain
+    niceness: int = 0
+    process: Optional[multiprocessing.process.BaseProcess] = None
+    channel: Optional[Channel] = None
+    started_at: float = 0.0
+    crashes: int = 0
+    # Set while the worker is down and waiting to be restarted
+    restart_at: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        return self.process is not None and self.restart_at is None
+
+
+# Runs each part of Yuri in its own process: motion (servos and lights) on
+# its own so nothing CPU-bound can hold its GIL, and listening, speech and
+# text generation niced in workers around it. Workers only talk to the
+# supervisor, over pipes, which routes messages between them and restarts
+# any worker that dies without touching the others.
+class Supervisor:
+    def __init__(
+        self,
+        workers: List[Worker],
+        config_json: str = "{}",
+        config_path: Optional[str] = None,
+    ):
+        # With config_path, edits to it are passed on to the workers
+        self.workers: Dict[str, Worker] = {
+            worker.name: worker for worker in workers
+        }
+        self.config_json = config_json
+        self.config_file = (
+            None if config_path is None else ConfigFile(config_path)
+        )
+        self.context = multiprocessing.get_context("spawn")
+        self.restarts = 0
+        self.motion_jitter: Optional[dict] = None
+
+        # Heard commands go straight to the worker that can carry them out
+        # rather than through text generation
+        self.commands = PhraseIndex()
+        self.command_workers: Dict[str, str] = {}
+        for intent in INTENTS:
+            parts = {PART_WORKERS.get(part) for part in intent.needs}
+            if len(parts) == 1 and None not in parts:
+                (self.command_workers[intent.name],) = parts
+                for phrase in intent.phrases:
+                    self.commands.add(phrase, intent.name)
+
+    @classmethod
+    def create(
+        cls,
+        config: "Config",
+        textgen: bool = False,
+        config_path: Optional[str] = None,
+    ) -> "Supervisor":
+        workers = [
+            Worker("motion", motion_worker),
+            Worker("listen", listen_worker, WORKER_NICENESS),
+            Worker("speak", speak_worker, WORKER_NICENESS),
+        ]
+        if textgen:
+            workers.append(Worker("textgen", textgen_worker, WORKER_NICENESS))
+        return cls(workers, config.json(), config_path)
+
+    def start(self, worker: Worker):
+        parent, child = self.context.Pipe()
+        worker.process = self.context.Process(
+            target=_bootstrap,
+            args=(worker.main, worker.niceness, self.config_json, child),
+            name=f"yuri-{worker.name}",
+            daemon=True,
+        )
+        worker.process.start()
+        child.close()
+        worker.channel = Channel(parent)
+        worker.started_at = time.monotonic()
+        worker.restart_at = None
+        logger.info(
+            "runtime.started", worker=worker.name, pid=worker.process.pid
+        )
+
+    def send(self, name: str, kind: Kind, text: str = ""):
+        worker = self.workers.get(name)
+        if worker is None or not worker.running:
+            logger.debug("runtime.dropped", worker=name, kind=kind.name)
+            return
+        try:
+            worker.channel.send(kind, text)
+        except OSError:
+            # It died; its sentinel will say so
+            logger.debug("runtime.dropped", worker=name, kind=kind.name)
+
+    def handle(self, worker: Worker, message: Message):
+        if message.kind == Kind.STATS:
+            self.motion_jitter = json.loads(message.text)
+            logger.info("runtime.motion_jitter", **self.motion_jitter)
+            if self.motion_jitter["p99_ms"] > JITTER_BUDGET_MS:
+                logger.warning(
+                    "runtime.jitter_over_budget",
+                    p99_ms=self.motion_jitter["p99_ms"],
+                    budget_ms=JITTER_BUDGET_MS,
+                )
+        elif message.kind == Kind.HEARING:
+            self.send("motion", Kind.HEARING)
+        elif message.kind == Kind.HEARD:
+            match = self.commands.match(message.text)
+            logger.info(
+                "runtime.heard",
+                text=message.text,
+                intent=match and match.intent,
+            )
+            if match is None:
+                self.send("textgen", Kind.GENERATE, message.text)
+            else:
+                name = self.command_workers[match.intent]
+                self.send(name, Kind.COMMAND, match.intent)
+        elif message.kind == Kind.GENERATED:
+            self.send("speak", Kind.SAY, message.text)
+        elif message.kind == Kind.SPOKEN:
+            logger.debug("runtime.spoken", text=message.text)
+
+    def died(self, worker: Worker):
+        worker.process.join()
+        worker.channel.close()
+        now = time.monotonic()
+        if now - worker.started_at >= STABLE_SECONDS:
+            worker.crashes = 0
+        delay = min(MAX_RESTART_SECONDS, RESTART_SECONDS * 2**worker.crashes)
+        worker.crashes += 1
+        worker.restart_at = now + delay
+        self.restarts += 1
+        logger.warning(
+            "runtime.died",
+            worker=worker.name,
+            exitcode=worker.process.exitcode,
+            restart_in=delay,
+        )
+
+    def step(self, timeout: float = POLL_SECONDS):
+        now = time.monotonic()
+        for worker in self.workers.values():
+            if worker.restart_at is not None:
+                if worker.restart_at <= now:
+                    self.start(worker)
+                else:
+                    timeout = min(timeout, worker.restart_at - now)
+
+        running = [w for w in self.workers.values() if w.running]
+        connections = {w.channel.connection: w for w in running}
+        sentinels = {w.process.sentinel: w for w in running}
+        ready = wait(list(connections) + list(sentinels), timeout)
+
+        # Messages first, so a worker's last words arrive before its death
+        for connection in ready:
+            if connection in connections:
+                worker = connections[connection]
+                try:
+                    while connection.poll():
+                        self.handle(worker, worker.channel.recv())
+                except EOFError:
+                    pass
+        for sentinel in ready:
+            if sentinel in sentinels:
+                self.died(sentinels[sentinel])
+
+    def reload(self):
+        # Workers restarted from now on start with the new config; running
+        # ones are sent it if they can apply what changed
+        from yuri.config import Config
+
+        config = self.config_file and self.config_file.changed()
+        if config is None:
+            return
+        changed = changed_sections(Config.parse_raw(self.config_json), config)
+        self.config_json = config.json()
+        live = changed & set(CONFIG_WORKERS)
+        for name in sorted({CONFIG_WORKERS[section] for section in live}):
+            self.send(name, Kind.CONFIG, self.config_json)
+        unapplied = changed - live
+        logger.info("runtime.config", changed=sorted(changed))
+        if unapplied:
+            logger.warning("config.needs_restart", sections=sorted(unapplied))
+
+    def run(self, seconds: Optional[float] = None):
+        stop_at = None if seconds is None else time.monotonic() + seconds
+        for worker in self.workers.values():
+            self.start(worker)
+        try:
+            while stop_at is None or time.monotonic() < stop_at:
+                self.step()
+                self.reload()
+        finally:
+            self.stop()
+
+    def stop(self):
+        running = [w for w in self.workers.values() if w.running]
+        for worker in running:
+            self.send(worker.name, Kind.STOP)
+        deadline = time.monotonic() + STOP_SECONDS
+        for worker in running:
+            worker.process.join(max(0.0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                logger.warning("runtime.terminated", worker=worker.name)
+                worker.process.terminate()
+                worker.process.join()
+            worker.channel.close()
+            worker.process = None
+        logger.info("runtime.stopped", restarts=self.restarts)
@@ -1,70 +1,138 @@
-from datetime import datetime, timedelta
-import board
-import busio
 import asyncio
-import math
 import random
+import time
 
-from typing import List, Optional
-from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Union
+from dataclasses import dataclass, field, replace
 
 from loguru import logger
-from adafruit_motor.servo import Servo
-from adafruit_pca9685 import PCA9685
 
+from yuri.arbiter import MotionArbiter
 from yuri.speaker import FakeSpeaker, Speaker
-from yuri.config import Config, EyesConfig
+from yuri.config import Config, EyeConfig, EyesConfig, LidsConfig
+from yuri.frames import FrameWriter
 from yuri.input import Input
+from yuri.kinematics import CLOSED, OPEN, WIDE_OPEN, EyeKinematics, Pose
+from yuri.timing import Ticker
+from yuri.trajectory import TrajectoryPlanner, settle_seconds
+
+if TYPE_CHECKING:
+    from adafruit_motor.servo import Servo
+
+TICK_SECONDS = 0.02
+PWM_FREQUENCY = 100
+STATS_INTERVAL = 30.0
+
+# Blinks take over the lids from the look loops while they're running
+LOOK_PRIORITY = 0
+BLINK_PRIORITY = 10
+
+CALIBRATION_PHRASES = [
+    "run calibration",
+    "calibrate left eye",
+    "calibrate right eye",
+    "calibrate upper eyelids",
+    "calibrate lower eyelids",
+    "done with calibration",
+]
+
+# PCA9685 channel for each eye servo
+EYE_CHANNELS = {
+    "lower_lids": 0,
+    "right_y": 1,
+    "right_x": 2,
+    "upper_lids": 4,
+    "left_y": 5,
+    "left_x": 6,
+}
 
-MOVE_TIMEOUT = timedelta(seconds=1)
 
+@dataclass
+class ServoStateStats:
+    hardware_reads: int = 0
+    reads_avoided: int = 0
+    writes: int = 0
+
+    def reset(self):
+        self.hardware_reads = 0
+        self.reads_avoided = 0
+        self.writes = 0
+
+
+# Write-through shadow of a servo's commanded angle. Reading Servo.angle goes
+# back over I2C to the PWM duty cycle registers, so reads are answered from
+# the last commanded angle and the hardware is only touched on writes (or an
+# explicit resync).
+class CachedServo:
+    def __init__(
+        self, servo: "Servo", stats: Optional[ServoStateStats] = None
+    ):
+        self.servo = servo
+        self.stats = stats or ServoStateStats()
+        self._angle: Optional[float] = None
+        self._synced = False
 
-def set_angle(servo: Servo, target_angle: Optional[float] = None):
-    if target_angle is None:
-        target_angle = servo.angle
+    @property
+    def actuation_range(self) -> float:
+        return self.servo.actuation_range
 
-    servo.angle = max(min(target_angle, servo.actuation_range), 0)
+    @property
+    def angle(self) -> Optional[float]:
+        if not self._synced:
+            return self.resync()
 
+        self.stats.reads_avoided += 1
+        return self._angle
 
-async def move(
-    servo: Servo, target_angle: float, smoothing_factor: float = 0.80
-):
-    start_time = datetime.utcnow()
-    target_angle = max(min(target_angle, servo.actuation_range), 0)
+    @angle.setter
+    def angle(self, new_angle: Optional[float]):
+        self.servo.angle = new_angle
+        self._angle = new_angle
+        self._synced = True
+        self.stats.writes += 1
 
-    # Keep iterating until the target angle's reached
-    while not math.isclose(servo.angle, target_angle, rel_tol=0.02):
-        last_angle = servo.angle
-        smoothed_angle = (target_angle * smoothing_factor) + (
-            last_angle * (1.0 - smoothing_factor)
-        )
+    def resync(self) -> Optional[float]:
+        self._angle = self.servo.angle
+        self._synced = True
+        self.stats.hardware_reads += 1
+        return self._angle
 
-        set_angle(servo, smoothed_angle)
-        await asyncio.sleep(0.02)
 
-        # Bail if there's not enough movement or a timeout
-        if (
-            math.isclose(servo.angle, last_angle, rel_tol=0.02)
-            or datetime.utcnow() - start_time > MOVE_TIMEOUT
-        ):
-            break
+def set_angle(servo: CachedServo, target_angle: Optional[float] = None):
+    if target_angle is None:
+        target_angle = servo.angle
+
+    servo.angle = max(min(target_angle, servo.actuation_range), 0)
+
+
+def clamp_angle(servo: CachedServo, angle: float) -> float:
+    return max(min(angle, servo.actuation_range), 0)
 
 
 @dataclass
 class Eyes:
     config: EyesConfig
 
-    upper_lids: Servo
-    lower_lids: Servo
+    upper_lids: CachedServo
+    lower_lids: CachedServo
+
+    left_y: CachedServo
+    left_x: CachedServo
+
+    right_y: CachedServo
+    right_x: CachedServo
 
-    left_y: Servo
-    left_x: Servo
+    planner: TrajectoryPlanner = field(
+        default_factory=lambda: TrajectoryPlanner(TICK_SECONDS)
+    )
+    arbiter: MotionArbiter = field(default_factory=MotionArbiter)
+    pose: Pose = Pose()
 
-    right_y: Servo
-    right_x: Servo
+    def __post_init__(self):
+        self.configure(self.config)
 
     @property
-    def servos(self) -> List[Servo]:
+    def servos(self) -> List[CachedServo]:
         return [
             self.upper_lids,
             self.lower_lids,
@@ -74,25 +142,10 @@ class Eyes:
             self.right_x,
         ]
 
-    def lid_offset(
-        self,
-        new_left: Optional[float] = None,
-        new_right: Optional[float] = None,
-    ) -> float:
-        left_offset = self.eye_y_offset("left", new_angle=new_left)
-        right_offset = self.eye_y_offset("right", new_angle=new_right)
-
-        logger.debug(f"leftoff:{left_offset} rightoff:{right_offset}")
-        return ((left_offset - right_offset) / 2.0) * 0.8
-
-    def eye_y_offset(
-        self, eye: str, new_angle: Optional[float] = None
-    ) -> float:
-        servo = getattr(self, f"{eye}_y")
-        config = getattr(self.config, f"{eye}_eye")
-
-        return (new_angle or servo.angle) - (
-            config.neutral_y or (servo.actuation_range * 0.5)
+    def configure(self, config: EyesConfig):
+        self.config = config
+        self.kinematics = EyeKinematics(
+            config, actuation_range=self.upper_lids.actuation_range
         )
 
     def init(self):
@@ -111,6 +164,7 @@ class Eyes:
         speaker: Speaker = FakeSpeaker(),
         helpers: bool = True,
     ):
+        prewarm = asyncio.ensure_future(speaker.prewarm(CALIBRATION_PHRASES))
         await speaker.say("run calibration")
 
         if helpers:
@@ -142,6 +196,7 @@ class Eyes:
                 config_eye = getattr(self.config, f"{eye}_eye")
                 config_eye.neutral_x = x.angle
                 config_eye.neutral_y = y.angle
+                self.configure(self.config)
             logger.info(f"Done calibrating {eye} eye")
 
             await asyncio.sleep(1.5)
@@ -175,73 +230,67 @@ class Eyes:
                     await asyncio.sleep(0.1)
                 if not skip:
                     setattr(lid_config, angle_type, lid_servo.angle)
+                    self.configure(self.config)
                 logger.info(f"Done calibrating {lid} eyelids {angle_type}")
                 await asyncio.sleep(1)
 
         await speaker.say("done with calibration")
+        await prewarm
 
-    async def open(self, wide: bool = False):
-        await asyncio.gather(
-            move(
-                self.lower_lids,
-                self.config.lower_lids.wide_open_y
-                if wide
-                else (self.config.lower_lids.open_y - self.lid_offset()),
-                smoothing_factor=self.config.lower_lids.movement_smoothing,
-            ),
-            move(
-                self.upper_lids,
-                self.config.upper_lids.wide_open_y
-                if wide
-                else (self.config.upper_lids.open_y + self.lid_offset()),
-                smoothing_factor=self.config.upper_lids.movement_smoothing,
-            ),
+    async def open(self, wide: bool = False, **kwargs):
+        await self.look(
+            replace(self.pose, openness=WIDE_OPEN if wide else OPEN),
+            ("upper_lids", "lower_lids"),
+            **kwargs,
         )
 
-    async def close(self):
-        await asyncio.gather(
-            move(
-                self.lower_lids,
-                self.config.lower_lids.closed_y,
-                smoothing_factor=self.config.lower_lids.movement_smoothing,
-            ),
-            move(
-                self.upper_lids,
-                self.config.upper_lids.closed_y,
-                smoothing_factor=self.config.upper_lids.movement_smoothing,
-            ),
+    async def close(self, **kwargs):
+        await self.look(
+            replace(self.pose, openness=CLOSED),
+            ("upper_lids", "lower_lids"),
+            **kwargs,
+        )
+
+    async def center(self, axis: str, **kwargs):
+        await self.look(
+            replace(self.pose, openness=OPEN, **{f"gaze_{axis}": 0.0}),
+            ("upper_lids", "lower_lids", f"left_{axis}", f"right_{axis}"),
+            **kwargs,
         )
 
     async def blink_loop(self):
+        motion = dict(source="blink", priority=BLINK_PRIORITY)
         while True:
-            await self.close()
+            await self.close(**motion)
             # if random.random() > 0.8:
             # await self.open(wide=True)
-            await self.open()
+            await self.open(**motion)
             await asyncio.sleep(random.random() * 3.0)
 
     async def horiz_look_loop(
         self, min_offset: float = 5.0, max_offset: float = 20.0
     ):
+        motion = dict(source="horiz_look", priority=LOOK_PRIORITY)
         while True:
             offset = min_offset + (random.random() * (max_offset - min_offset))
-            await self.horiz_look(offset)
+            await self.horiz_look(offset, **motion)
             await asyncio.sleep(random.random() * 2.0)
-            await self.horiz_look(-offset)
+            await self.horiz_look(-offset, **motion)
             await asyncio.sleep(random.random() * 2.0)
-            self.init()
+            await self.center("x", **motion)
             await asyncio.sleep(random.random())
 
     async def vert_look_loop(
         self, min_offset: float = 5.0, max_offset: float = 15.0
     ):
+        motion = dict(source="vert_look", priority=LOOK_PRIORITY)
         while True:
             offset = min_offset + (random.random() * (max_offset - min_offset))
-            await self.vert_look(offset)
+            await self.vert_look(offset, **motion)
             await asyncio.sleep(random.random() * 2.0)
-            await self.vert_look(-offset)
+            await self.vert_look(-offset, **motion)
             await asyncio.sleep(random.random() * 2.0)
-            self.init()
+            await self.center("y", **motion)
             await asyncio.sleep(random.random())
 
     async def loop(self):
@@ -251,79 +300,164 @@ class Eyes:
             self.blink_loop(),
         )
 
-    async def vert_look(self, offset: float):
-        new_left = self.left_y.angle + offset
-        new_right = self.right_y.angle - offset
-        lid_offset = self.lid_offset(new_left=new_left, new_right=new_right)
-        logger.debug(f"offset = {lid_offset}")
+    async def vert_look(self, offset: float, **kwargs):
+        pose = self.pose
+        await self.look(
+            replace(pose, gaze_y=pose.gaze_y + offset, openness=OPEN),
+            ("upper_lids", "lower_lids", "left_y", "right_y"),
+            **kwargs,
+        )
 
-        await asyncio.gather(
-            move(
-                self.lower_lids,
-                self.config.lower_lids.open_y - lid_offset,
-                smoothing_factor=self.config.lower_lids.movement_smoothing,
-            ),
-            move(
-                self.upper_lids,
-                self.config.upper_lids.open_y + lid_offset,
-                smoothing_factor=self.config.upper_lids.movement_smoothing,
-            ),
-            move(
-                self.left_y,
-                new_left,
-                smoothing_factor=self.config.left_eye.movement_smoothing,
-            ),
-            move(
-                self.right_y,
-                new_right,
-                smoothing_factor=self.config.right_eye.movement_smoothing,
-            ),
+    async def horiz_look(self, offset: float, **kwargs):
+        pose = self.pose
+        await self.look(
+            replace(pose, gaze_x=pose.gaze_x + offset, openness=OPEN),
+            ("upper_lids", "lower_lids", "left_x", "right_x"),
+            **kwargs,
         )
 
-    async def horiz_look(self, offset: float):
-        await asyncio.gather(
-            move(
-                self.lower_lids,
-                self.config.lower_lids.open_y - self.lid_offset(),
-                smoothing_factor=self.config.lower_lids.movement_smoothing,
-            ),
-            move(
-                self.upper_lids,
-                self.config.upper_lids.open_y + self.lid_offset(),
-                smoothing_factor=self.config.upper_lids.movement_smoothing,
-            ),
-            move(
-                self.left_x,
-                self.left_x.angle + offset,
-                smoothing_factor=self.config.left_eye.movement_smoothing,
-            ),
-            move(
-                self.right_x,
-                self.right_x.angle + offset,
-                smoothing_factor=self.config.right_eye.movement_smoothing,
-            ),
+    async def look(self, pose: Pose, servos: Sequence[str], **kwargs) -> bool:
+        # Solves the whole pose but only moves the servos the caller owns;
+        # the others are left to whichever loop is driving them.
+        self.pose = pose
+        angles = self.kinematics.solve(pose)
+        logger.debug(f"pose = {pose}")
+        return await self.gesture(
+            {name: angles[name] for name in servos}, **kwargs
+        )
+
+    def servo_config(self, name: str) -> Union[EyeConfig, LidsConfig]:
+        if name.endswith("_lids"):
+            return getattr(self.config, name)
+        eye, _ = name.split("_")
+        return getattr(self.config, f"{eye}_eye")
+
+    def movement_seconds(self, name: str) -> float:
+        config = self.servo_config(name)
+        if config.movement_seconds is not None:
+            return config.movement_seconds
+        return settle_seconds(config.movement_smoothing, TICK_SECONDS)
+
+    async def gesture(
+        self,
+        targets: Dict[str, float],
+        source: str = "gesture",
+        priority: int = 0,
+    ) -> bool:
+        # Every servo in a gesture follows one precomputed trajectory and
+        # they all arrive together, after the slowest servo's duration. The
+        # arbiter decides what actually reaches the servos each tick.
+        servos = [getattr(self, name) for name in targets]
+        trajectory = self.planner.plan(
+            [servo.angle for servo in servos],
+            [
+                clamp_angle(servo, target)
+                for servo, target in zip(servos, targets.values())
+            ],
+            max(self.movement_seconds(name) for name in targets),
+        )
+        return await self.arbiter.submit(
+            source, servos, trajectory, priority=priority
         )
 
 
 class Servos:
     def __init__(self, config: Config):
+        import board
+        import busio
+        from adafruit_motor.servo import Servo
+        from adafruit_pca9685 import PCA9685
+
         i2c = busio.I2C(board.SCL, board.SDA)
         pca = PCA9685(i2c)
-        pca.frequency = 100
+        pca.frequency = PWM_FREQUENCY
 
+        # Every servo write is staged on the frame and goes out to the
+        # PCA9685 in one I2C transaction per tick (see control_loop).
+        self.frame = FrameWriter(
+            pca, EYE_CHANNELS.values(), frequency=PWM_FREQUENCY
+        )
+        self.state_stats = ServoStateStats()
         self.eyes = Eyes(
             config=config.eyes,
-            lower_lids=Servo(pca.channels[0]),
-            right_y=Servo(pca.channels[1]),
-            right_x=Servo(pca.channels[2]),
-            upper_lids=Servo(pca.channels[4]),
-            left_y=Servo(pca.channels[5]),
-            left_x=Servo(pca.channels[6]),
+            **{
+                name: CachedServo(
+                    Servo(self.frame.channel(channel)), self.state_stats
+                )
+                for name, channel in EYE_CHANNELS.items()
+            },
         )
         self.eyes.init()
+        self.frame.flush()
+        self.ticker = Ticker(TICK_SECONDS)
+        # Tick jitter over the last stats interval
+        self.last_jitter: Optional[dict] = None
 
     async def loop(self):
-        await self.eyes.loop()
+        await asyncio.gather(self.eyes.loop(), self.control_loop())
+
+    async def control_loop(self):
+        log_at = time.monotonic() + STATS_INTERVAL
+        while True:
+            self.eyes.arbiter.step()
+            self.frame.flush()
+            await self.ticker.wait()
+
+            if time.monotonic() >= log_at:
+                self.log_stats()
+                log_at = time.monotonic() + STATS_INTERVAL
+
+    def resync(self):
+        for servo in self.eyes.servos:
+            servo.resync()
+
+    def log_stats(self):
+        stats = self.frame.stats
+        logger.info(
+            "frames.stats",
+            frames=stats.frames,
+            transactions_per_second=round(stats.transactions_per_second, 1),
+            bytes_per_second=round(stats.bytes_per_second, 1),
+        )
+        stats.reset()
+
+        logger.info(
+            "servo_state.stats",
+            hardware_reads=self.state_stats.hardware_reads,
+            reads_avoided=self.state_stats.reads_avoided,
+            writes=self.state_stats.writes,
+        )
+        self.state_stats.reset()
+
+        logger.info(
+            "trajectory.stats",
+            cache_hits=self.eyes.planner.hits,
+            cache_misses=self.eyes.planner.misses,
+        )
+
+        arbiter_stats = self.eyes.arbiter.stats
+        logger.info(
+            "arbiter.stats",
+            requests=arbiter_stats.requests,
+            merged=arbiter_stats.merged,
+            overridden=arbiter_stats.overridden,
+            cancelled=arbiter_stats.cancelled,
+            writes=arbiter_stats.writes,
+            writes_skipped=arbiter_stats.writes_skipped,
+        )
+        arbiter_stats.reset()
+
+        self.last_jitter = self.ticker.jitter.summary()
+        logger.info("control.jitter", **self.last_jitter)
+        self.ticker.jitter.reset()
+
+    async def calibrate(self, inputs: Input, speaker: Speaker = FakeSpeaker()):
+        control = asyncio.ensure_future(self.control_loop())
+        try:
+            await self.eyes.calibrate(inputs, speaker=speaker)
+        finally:
+            control.cancel()
+            self.frame.flush()
 
     def rotate(self):
         logger.info("triggering servos")
@@ -1,63 +1,456 @@
+import asyncio
+import itertools
+import os
+import queue
+import re
+import tempfile
+import threading
+import time
+
 from abc import abstractmethod, ABCMeta
+from dataclasses import dataclass, field
 from io import BytesIO
+from typing import Iterable, List, Optional, Tuple
 
-import pyttsx3
-
-from gtts import gTTS
 from loguru import logger
-from pydub import AudioSegment
-from pydub.playback import play
 
+from yuri.audio import PCMClip
 from yuri.config import Config
+from yuri.mixer import AudioMixer, SinkFactory, Voice
+from yuri.tts_cache import TTSCache
+
+PREWARM_PRIORITY = -100
+
+# Long messages are spoken clause by clause so audio can start as soon as
+# the first clause is ready
+CLAUSE_BREAK = re.compile(r"(?<=[.!?;:,])\s+")
+MIN_CLAUSE_CHARS = 20
+# How many encoded clauses can wait for the decoder
+PIPELINE_DEPTH = 2
+
+
+def split_clauses(text: str, min_chars: int = MIN_CLAUSE_CHARS) -> List[str]:
+    clauses = []
+    pending = ""
+    for piece in CLAUSE_BREAK.split(text.strip()):
+        pending = f"{pending} {piece}".strip()
+        if len(pending) >= min_chars:
+            clauses.append(pending)
+            pending = ""
+
+    if pending:
+        clauses.append(pending)
+    return clauses or [text]
+
+
+@dataclass
+class SpeechTiming:
+    started_at: float = field(default_factory=time.monotonic)
+    first_audio_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    clauses: int = 0
+
+    @property
+    def time_to_first_audio(self) -> Optional[float]:
+        if self.first_audio_at is None:
+            return None
+        return self.first_audio_at - self.started_at
+
+    @property
+    def wall_time(self) -> Optional[float]:
+        if self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+
+@dataclass
+class Utterance:
+    message: str
+    priority: int
+    done: asyncio.Future
+    interrupted: threading.Event = field(default_factory=threading.Event)
+    # Prewarm jobs only render into the cache
+    play: bool = True
+    timing: Optional["SpeechTiming"] = None
+
+    def cancel(self):
+        # Skipped if it's still queued, cut off if it's being spoken
+        self.interrupted.set()
+
+
+# Synthesis and playback block for as long as the robot is talking, so they
+# run here rather than on the event loop. Utterances are spoken highest
+# priority first, then in submission order.
+class SpeechWorker(threading.Thread):
+    def __init__(self, speaker: "Speaker"):
+        super().__init__(name="speech-worker", daemon=True)
+        self.speaker = speaker
+        self.current: Optional[Utterance] = None
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._order = itertools.count()
+
+    def submit(self, utterance: Utterance):
+        self._queue.put((-utterance.priority, next(self._order), utterance))
+
+    def interrupt(self, flush: bool = True):
+        if flush:
+            while True:
+                try:
+                    _, _, utterance = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                self._resolve(utterance, False)
+
+        current = self.current
+        if current is not None:
+            current.cancel()
+
+    def close(self):
+        self.interrupt()
+        self._queue.put((float("inf"), next(self._order), None))
+        self.join()
+
+    def run(self):
+        while True:
+            _, _, utterance = self._queue.get()
+            if utterance is None:
+                return
+            if utterance.interrupted.is_set():
+                self._resolve(utterance, False)
+                continue
+
+            self.current = utterance
+            try:
+                if utterance.play:
+                    utterance.timing = self.speaker.speak(
+                        utterance.message, utterance.interrupted
+                    )
+                else:
+                    self.speaker.render(utterance.message)
+            except Exception as error:  # pylint: disable=broad-except
+                logger.exception("say.failed")
+                self._resolve(utterance, error=error)
+            else:
+                self._resolve(utterance, not utterance.interrupted.is_set())
+            finally:
+                self.current = None
+
+    @staticmethod
+    def _resolve(
+        utterance: Utterance,
+        spoken: bool = False,
+        error: Optional[Exception] = None,
+    ):
+        def resolve():
+            if utterance.done.done():
+                return
+            if error is not None:
+                utterance.done.set_exception(error)
+            else:
+                utterance.done.set_result(spoken)
+
+        utterance.done.get_loop().call_soon_threadsafe(resolve)
 
 
 class Speaker(metaclass=ABCMeta):
     def __init__(self, config: Config):
         self.config = config
+        self._worker: Optional[SpeechWorker] = None
+        self._mixer: Optional[AudioMixer] = None
 
+        self.cache = TTSCache()
+        if config is not None:
+            self.cache = TTSCache(
+                config.tts_cache_dir,
+                max_memory_bytes=config.tts_cache_memory_mb * 1024 * 1024,
+            )
+
+    @property
     @abstractmethod
-    async def say(self, message: str):
+    def voice(self) -> Tuple:
+        # Everything besides the text that changes the synthesized audio:
+        # engine, voice, rate, language...
         raise NotImplementedError()
 
+    @abstractmethod
+    def encode(self, message: str) -> bytes:
+        # Runs the engine, returning audio in whatever format it produces
+        raise NotImplementedError()
+
+    @abstractmethod
+    def decode(self, data: bytes) -> PCMClip:
+        raise NotImplementedError()
+
+    def synthesize(self, message: str) -> PCMClip:
+        return self.decode(self.encode(message))
+
+    def render(self, message: str) -> List[PCMClip]:
+        # Cached clause by clause, under the same keys speak() looks up
+        clips = []
+        for clause in split_clauses(message):
+            key = self.cache.key(clause, self.voice)
+            clip = self.cache.get(key)
+            if clip is None:
+                clip = self.synthesize(clause)
+                self.cache.put(key, clip)
+            clips.append(clip)
+        return clips
+
+    def speak(
+        self, message: str, interrupted: threading.Event
+    ) -> SpeechTiming:
+        # Blocking synthesis and playback, run on the speech worker. Stops
+        # early once `interrupted` is set.
+        #
+        # The message is split into clauses and three stages overlap: this
+        # thread encodes clause N+1 while the decoder thread decodes clause N
+        # and the mixer plays clause N-1. Each clause is queued on the mixer
+        # to start on the exact frame the previous one ends.
+        logger.info("say.start", message=message)
+        timing = SpeechTiming()
+        encoded: "queue.Queue" = queue.Queue(maxsize=PIPELINE_DEPTH)
+        voices: List[Voice] = []
+        errors: List[Exception] = []
+
+        decoder = threading.Thread(
+            target=self._decode_stage,
+            args=(encoded, voices, errors, interrupted),
+            name="speech-decoder",
+            daemon=True,
+        )
+        decoder.start()
+        try:
+            for clause in split_clauses(message):
+                if interrupted.is_set() or errors:
+                    break
+                key = self.cache.key(clause, self.voice)
+                clip = self.cache.get(key)
+                data = self.encode(clause) if clip is None else None
+                encoded.put((key, clip, data))
+                timing.clauses += 1
+        finally:
+            encoded.put(None)
+            decoder.join()
+
+        if errors:
+            raise errors[0]
+        if voices:
+            voices[-1].wait()
+            timing.first_audio_at = voices[0].first_sample_at
+        timing.finished_at = time.monotonic()
+
+        logger.info(
+            "say.done",
+            message=message,
+            clauses=timing.clauses,
+            time_to_first_audio=timing.time_to_first_audio,
+            wall_time=timing.wall_time,
+            cache_hits=self.cache.stats.hits,
+            cache_misses=self.cache.stats.misses,
+            cache_evictions=self.cache.stats.evictions,
+        )
+        return timing
+
+    def _decode_stage(
+        self,
+        encoded: "queue.Queue",
+        voices: List[Voice],
+        errors: List[Exception],
+        interrupted: threading.Event,
+    ):
+        previous: Optional[Voice] = None
+        while True:
+            item = encoded.get()
+            if item is None:
+                return
+            if interrupted.is_set() or errors:
+                continue
+
+            # Any failure is handed back to speak(); the queue is still
+            # drained so it never blocks putting the next clause
+            key, clip, data = item
+            try:
+                if clip is None:
+                    clip = self.decode(data)
+                    self.cache.put(key, clip)
+                previous = self.mixer.play(
+                    clip, interrupted=interrupted, after=previous
+                )
+            except Exception as error:  # pylint: disable=broad-except
+                errors.append(error)
+                continue
+            voices.append(previous)
+
+    @property
+    def mixer(self) -> AudioMixer:
+        # The output stream stays open for the life of the speaker
+        if self._mixer is None:
+            self._mixer = AudioMixer(SinkFactory.create(self.config))
+            self._mixer.start()
+        return self._mixer
+
+    @property
+    def worker(self) -> SpeechWorker:
+        if self._worker is None:
+            self._worker = SpeechWorker(self)
+            self._worker.start()
+        return self._worker
+
+    def submit(
+        self,
+        message: str,
+        priority: int = 0,
+        interrupt: bool = False,
+        play: bool = True,
+    ) -> Utterance:
+        utterance = Utterance(
+            message=message,
+            priority=priority,
+            done=asyncio.get_event_loop().create_future(),
+            play=play,
+        )
+        if interrupt:
+            self.interrupt(flush=False)
+        self.worker.submit(utterance)
+        return utterance
+
+    async def say(
+        self, message: str, priority: int = 0, interrupt: bool = False
+    ) -> bool:
+        utterance = self.submit(
+            message, priority=priority, interrupt=interrupt
+        )
+        try:
+            return await utterance.done
+        except asyncio.CancelledError:
+            utterance.cancel()
+            raise
+
+    async def prewarm(self, messages: Iterable[str]):
+        # Renders known phrases into the cache in the background, behind
+        # anything that actually needs saying. Best effort: a phrase that
+        # fails to render is just synthesized again when it's said.
+        utterances = [
+            self.submit(message, priority=PREWARM_PRIORITY, play=False)
+            for message in messages
+        ]
+        results = await asyncio.gather(
+            *(utterance.done for utterance in utterances),
+            return_exceptions=True,
+        )
+        for utterance, result in zip(utterances, results):
+            if isinstance(result, Exception):
+                logger.warning(
+                    "say.prewarm_failed",
+                    message=utterance.message,
+                    error=str(result),
+                )
+
+    def interrupt(self, flush: bool = True):
+        # Barge-in: stop talking, and by default drop everything queued
+        if self._worker is not None:
+            self._worker.interrupt(flush=flush)
+
+    def close(self):
+        if self._worker is not None:
+            self._worker.close()
+            self._worker = None
+        if self._mixer is not None:
+            self._mixer.close()
+            self._mixer = None
+
 
 class FakeSpeaker(Speaker):
     def __init__(self, *args):
         super().__init__(None)
 
-    async def say(self, message: str):
+    @property
+    def voice(self) -> Tuple:
+        return ("fake",)
+
+    def encode(self, message: str) -> bytes:
+        return b""
+
+    def decode(self, data: bytes) -> PCMClip:
+        return PCMClip(data=data, sample_rate=16000)
+
+    def speak(
+        self, message: str, interrupted: threading.Event
+    ) -> SpeechTiming:
         logger.info(message)
+        return SpeechTiming(finished_at=time.monotonic())
 
 
 class GoogleSpeaker(Speaker):
-    async def say(self, message: str):
-        logger.info("say.start", message=message)
+    LANG = "en"
+    TLD = "ru"
+
+    @property
+    def voice(self) -> Tuple:
+        return ("google", self.LANG, self.TLD)
+
+    def encode(self, message: str) -> bytes:
+        from gtts import gTTS
 
         mp3_fp = BytesIO()
-        tts = gTTS(message, lang="en", tld="ru")
+        tts = gTTS(message, lang=self.LANG, tld=self.TLD)
         tts.write_to_fp(mp3_fp)
-        mp3_fp.seek(0)
+        return mp3_fp.getvalue()
 
-        play(AudioSegment.from_mp3(mp3_fp))
-        logger.info("say.done", message=message)
+    def decode(self, data: bytes) -> PCMClip:
+        from pydub import AudioSegment
+
+        segment = AudioSegment.from_mp3(BytesIO(data))
+        return PCMClip(
+            data=segment.raw_data,
+            sample_rate=segment.frame_rate,
+            channels=segment.channels,
+            sample_width=segment.sample_width,
+        )
 
 
 class Ttsx3Speaker(Speaker):
+    # voices 2, 13, 14, 17
+    # 61 = Russian
+    # 62 = Slovak
+    VOICE_INDEX = 15
+    RATE = 160
+
     def __init__(self, config: Config):
-        self.config = config
-        self.engine = pyttsx3.init()
-        # voices 2, 13, 14, 17
-        # 61 = Russian
-        # 62 = Slovak
-        self.engine.setProperty(
-            "voice", self.engine.getProperty("voices")[15].id
-        )
-        self.engine.setProperty("rate", 160)
+        super().__init__(config)
+        self._engine = None
 
-    async def say(self, message: str):
-        logger.info("say.start", message=message)
-        self.engine.say(message)
-        self.engine.runAndWait()
-        logger.info("say.done", message=message)
+    @property
+    def engine(self):
+        # Created lazily so it lives on the speech worker's thread
+        if self._engine is None:
+            import pyttsx3
+
+            self._engine = pyttsx3.init()
+            self._engine.setProperty(
+                "voice",
+                self._engine.getProperty("voices")[self.VOICE_INDEX].id,
+            )
+            self._engine.setProperty("rate", self.RATE)
+        return self._engine
+
+    @property
+    def voice(self) -> Tuple:
+        return ("pyttsx3", self.engine.getProperty("voice"), self.RATE)
+
+    def encode(self, message: str) -> bytes:
+        fd, wav_path = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        try:
+            self.engine.save_to_file(message, wav_path)
+            self.engine.runAndWait()
+            with open(wav_path, "rb") as wav_file:
+                return wav_file.read()
+        finally:
+            os.remove(wav_path)
+
+    def decode(self, data: bytes) -> PCMClip:
+        return PCMClip.from_wav(BytesIO(data))
 
 
 class SpeakerFactory:
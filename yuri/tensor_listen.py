@@ -1,104 +1,454 @@
+import functools
+import hashlib
+import json
+import multiprocessing
 import os
 import pathlib
+import time
+
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 
-import matplotlib.pyplot as plt
 import numpy as np
-import seaborn as sns
 import tensorflow as tf
 
+from loguru import logger
 from tensorflow.keras import layers
 from tensorflow.keras import models
-from IPython import display
 
-# Set the seed value for experiment reproducibility.
-seed = 42
-np.random.seed(seed)
+from yuri.audio import PCMClip, to_samples
+from yuri.features import SAMPLE_RATE, LogMelFrontend
+from yuri.kws import BACKGROUND, CLIP_SECONDS, KeywordModel, metadata_path
+
+# Trains the keyword spotting model used by yuri.kws and exports it as an
+# int8 TFLite model, with its labels and feature statistics in a .json
+# beside it.
 
 DATASET_PATH = "data/mini_speech_commands"
+DATASET_URL = (
+    "http://storage.googleapis.com/download.tensorflow.org/data/"
+    "mini_speech_commands.zip"
+)
+MODEL_PATH = "models/kws.tflite"
+STORE_PATH = "data/kws_features"
+STORE_SHARD_SIZE = 2048
+# Rows read from the store per call
+READ_BLOCK = 256
+SHUFFLE_BUFFER = 8192
+AUTOTUNE = tf.data.AUTOTUNE
+CLIP_SAMPLES = int(CLIP_SECONDS * SAMPLE_RATE)
+# Background examples generated per keyword example
+BACKGROUND_RATIO = 0.15
+# Examples used to calibrate the int8 quantization
+CALIBRATION_EXAMPLES = 200
+
+# Set the seed value for experiment reproducibility.
+SEED = 42
+
 
-data_dir = pathlib.Path(DATASET_PATH)
-if not data_dir.exists():
+def download(data_dir: pathlib.Path):
+    if data_dir.exists():
+        return
     tf.keras.utils.get_file(
         "mini_speech_commands.zip",
-        origin="http://storage.googleapis.com/download.tensorflow.org/data/mini_speech_commands.zip",
+        origin=DATASET_URL,
         extract=True,
         cache_dir=".",
         cache_subdir="data",
     )
 
-commands = np.array(tf.io.gfile.listdir(str(data_dir)))
-commands = commands[commands != "README.md"]
-print("Commands:", commands)
-
-filenames = tf.io.gfile.glob(str(data_dir) + "/*/*")
-filenames = tf.random.shuffle(filenames)
-num_samples = filenames.shape
-print("Number of total examples:", num_samples)
-print(
-    "Number of examples per label:",
-    len(tf.io.gfile.listdir(str(data_dir / commands[0]))),
-)
-print("Example file tensor:", filenames[0])
 
-train_files = filenames[:6400]
-val_files = filenames[6400 : 6400 + 800]
-test_files = filenames[-800:]
+def load_clip(path: str) -> np.ndarray:
+    # One second, padded with silence or trimmed
+    samples = to_samples(PCMClip.from_wav(path), SAMPLE_RATE)
+    clip = np.zeros(CLIP_SAMPLES, dtype=np.float32)
+    clip[: min(len(samples), CLIP_SAMPLES)] = samples[:CLIP_SAMPLES]
+    return clip
 
-print("Training set size", train_files.shape)
-print("Validation set size", val_files.shape)
-print("Test set size", test_files.shape)
 
-test_file = tf.io.read_file(DATASET_PATH + "/down/0a9f9af7_nohash_0.wav")
-test_audio, _ = tf.audio.decode_wav(contents=test_file)
-test_audio.shape
+def background_clips(
+    count: int,
+    rng: np.random.Generator,
+    background_dir: Optional[str] = None,
+) -> List[np.ndarray]:
+    # Noise at random levels, and random crops of any recordings of the
+    # robot's surroundings
+    recordings = []
+    if background_dir is not None:
+        for path in sorted(pathlib.Path(background_dir).glob("*.wav")):
+            samples = to_samples(PCMClip.from_wav(str(path)), SAMPLE_RATE)
+            if len(samples) >= CLIP_SAMPLES:
+                recordings.append(samples)
 
+    clips = []
+    for _ in range(count):
+        level = 10.0 ** rng.uniform(0.0, 3.0)
+        clip = rng.standard_normal(CLIP_SAMPLES) * level
+        if recordings and rng.random() < 0.5:
+            recording = recordings[rng.integers(len(recordings))]
+            start = rng.integers(len(recording) - CLIP_SAMPLES + 1)
+            clip = recording[start : start + CLIP_SAMPLES] * rng.uniform(
+                0.1, 1.0
+            )
+        clips.append(clip.astype(np.float32))
+    return clips
 
-def decode_audio(audio_binary):
-    # Decode WAV-encoded audio files to `float32` tensors, normalized
-    # to the [-1.0, 1.0] range. Return `float32` audio and a sample rate.
-    audio, _ = tf.audio.decode_wav(contents=audio_binary)
-    # Since all the data is single channel (mono), drop the `channels`
-    # axis from the array.
-    return tf.squeeze(audio, axis=-1)
 
+def featurize_file(path: str, mfcc: Optional[int]) -> np.ndarray:
+    return LogMelFrontend(mfcc=mfcc)(load_clip(path))
 
-def get_label(file_path):
-    parts = tf.strings.split(input=file_path, sep=os.path.sep)
-    # Note: You'll use indexing here instead of tuple unpacking to enable this
-    # to work in a TensorFlow graph.
-    return parts[-2]
 
+def fingerprint(paths: Sequence[str], settings: dict) -> str:
+    digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode())
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
 
-def get_waveform_and_label(file_path):
-    label = get_label(file_path)
-    audio_binary = tf.io.read_file(file_path)
-    waveform = decode_audio(audio_binary)
-    return waveform, label
 
+# The corpus decoded and featurized once, as .npy shards that are memory
+# mapped rather than loaded. Rebuilt only when the recordings or the
+# frontend settings change.
+class FeatureStore:
+    def __init__(self, directory: str):
+        self.directory = pathlib.Path(directory)
+        with open(self.directory / "index.json") as index_file:
+            self.index = json.load(index_file)
+        self.labels: List[str] = self.index["labels"]
+        self.mfcc: Optional[int] = self.index["mfcc"]
 
-import ipdb
+        self.shards = [
+            np.load(str(self.directory / name), mmap_mode="r")
+            for name in self.index["shards"]
+        ]
+        self.targets = np.concatenate(
+            [
+                np.load(str(self.directory / name))
+                for name in self.index["targets"]
+            ]
+        )
+        self.offsets = np.cumsum([0] + [len(shard) for shard in self.shards])
 
-ipdb.set_trace()
-# AUTOTUNE = tf.data.AUTOTUNE
+    def __len__(self) -> int:
+        return len(self.targets)
 
-files_ds = tf.data.Dataset.from_tensor_slices(train_files)
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.shards[0].shape[1:]
+
+    def read(self, rows: np.ndarray) -> np.ndarray:
+        # Features for `rows`, in the order given
+        rows = np.asarray(rows)
+        features = np.empty((len(rows),) + self.shape, dtype=np.float32)
+        shard_of = np.searchsorted(self.offsets, rows, side="right") - 1
+        for shard in np.unique(shard_of):
+            mask = shard_of == shard
+            local = rows[mask] - self.offsets[shard]
+            order = np.argsort(local)
+            # Sorted reads keep memory mapped access sequential
+            block = self.shards[shard][local[order]]
+            features[np.flatnonzero(mask)[order]] = block
+        return features
+
+    def stats(self, rows: np.ndarray) -> Tuple[float, float]:
+        # Mean and std over `rows`, one shard at a time
+        total = total_squares = count = 0.0
+        for start in range(0, len(rows), STORE_SHARD_SIZE):
+            block = self.read(rows[start : start + STORE_SHARD_SIZE])
+            total += float(block.sum(dtype=np.float64))
+            total_squares += float(np.square(block, dtype=np.float64).sum())
+            count += block.size
+        mean = total / count
+        return mean, float(np.sqrt(total_squares / count - mean**2))
+
+
+def build_feature_store(
+    data_dir: pathlib.Path,
+    store_dir: str,
+    mfcc: Optional[int] = None,
+    background_dir: Optional[str] = None,
+    processes: Optional[int] = None,
+) -> FeatureStore:
+    commands = sorted(
+        path.name for path in data_dir.iterdir() if path.is_dir()
+    )
+    labels = [BACKGROUND] + commands
+    paths, targets = [], []
+    for index, command in enumerate(commands, 1):
+        for path in sorted((data_dir / command).glob("*.wav")):
+            paths.append(str(path))
+            targets.append(index)
+
+    settings = {
+        "labels": labels,
+        "mfcc": mfcc,
+        "background_dir": background_dir,
+        "background_ratio": BACKGROUND_RATIO,
+        "seed": SEED,
+    }
+    key = fingerprint(paths, settings)
+    store = pathlib.Path(store_dir)
+    index_path = store / "index.json"
+    if index_path.exists():
+        with open(index_path) as index_file:
+            if json.load(index_file).get("fingerprint") == key:
+                logger.info(f"feature store {store_dir} is up to date")
+                return FeatureStore(store_dir)
+
+    logger.info(f"commands: {commands}")
+    started_at = time.monotonic()
+    store.mkdir(parents=True, exist_ok=True)
+    if index_path.exists():
+        index_path.unlink()
+    for stale in store.glob("*.npy"):
+        stale.unlink()
+
+    rng = np.random.default_rng(SEED)
+    count = int(len(paths) * BACKGROUND_RATIO)
+    backgrounds = background_clips(count, rng, background_dir)
+    frontend = LogMelFrontend(mfcc=mfcc)
+    targets += [0] * len(backgrounds)
+
+    def featurized() -> Iterator[np.ndarray]:
+        # Decoding and featurizing is the expensive part, so it's spread
+        # over every core
+        with multiprocessing.Pool(processes) as pool:
+            yield from pool.imap(
+                functools.partial(featurize_file, mfcc=mfcc), paths, 16
+            )
+        for clip in backgrounds:
+            yield frontend(clip)
+
+    shards, shard_targets = [], []
+    pending: List[np.ndarray] = []
+
+    def flush():
+        number = len(shards)
+        name = f"features-{number:05d}.npy"
+        target_name = f"targets-{number:05d}.npy"
+        start = number * STORE_SHARD_SIZE
+        np.save(str(store / name), np.stack(pending))
+        np.save(
+            str(store / target_name),
+            np.array(targets[start : start + len(pending)]),
+        )
+        shards.append(name)
+        shard_targets.append(target_name)
+        pending.clear()
+
+    for features in featurized():
+        pending.append(features)
+        if len(pending) == STORE_SHARD_SIZE:
+            flush()
+    if pending:
+        flush()
+
+    # Written last, so an interrupted build is never mistaken for a store
+    with open(index_path, "w") as index_file:
+        json.dump(
+            dict(
+                settings,
+                fingerprint=key,
+                shards=shards,
+                targets=shard_targets,
+            ),
+            index_file,
+            indent=2,
+        )
+    logger.info(
+        f"featurized {len(targets)} examples into {len(shards)} shards "
+        f"in {time.monotonic() - started_at:.1f}s"
+    )
+    return FeatureStore(store_dir)
+
+
+def dataset(
+    store: FeatureStore,
+    rows: np.ndarray,
+    mean: float,
+    std: float,
+    batch_size: int,
+    training: bool = False,
+) -> tf.data.Dataset:
+    # Rows are read from the store in blocks in parallel, normalised,
+    # cached in memory after the first epoch, then shuffled and batched
+    # with the next batches prefetched while the model trains
+    frames, features = store.shape
+    targets = store.targets[rows]
+
+    def load(block: np.ndarray) -> np.ndarray:
+        return ((store.read(block) - mean) / std).astype(np.float32)
+
+    def load_block(block, block_targets):
+        examples = tf.numpy_function(load, [block], tf.float32)
+        examples.set_shape([None, frames, features])
+        return examples, block_targets
+
+    data = tf.data.Dataset.from_tensor_slices((rows, targets))
+    data = data.batch(READ_BLOCK)
+    data = data.map(load_block, num_parallel_calls=AUTOTUNE)
+    data = data.unbatch().cache()
+    if training:
+        data = data.shuffle(SHUFFLE_BUFFER, seed=SEED)
+    return data.batch(batch_size).prefetch(AUTOTUNE)
+
+
+def throughput(data: tf.data.Dataset, epochs: int = 2) -> List[float]:
+    # Examples per second for each pass over the dataset
+    rates = []
+    for _ in range(epochs):
+        count = 0
+        started_at = time.monotonic()
+        for _, targets in data:
+            count += int(targets.shape[0])
+        rates.append(round(count / (time.monotonic() - started_at), 1))
+    return rates
+
+
+def wav_throughput(
+    store_dir: str, data_dir: str = DATASET_PATH, examples: int = 500
+) -> Dict[str, object]:
+    # The old input path, decoding and featurizing every WAV every epoch,
+    # against the feature store pipeline
+    store = FeatureStore(store_dir)
+    paths = sorted(pathlib.Path(data_dir).glob("*/*.wav"))[:examples]
+    started_at = time.monotonic()
+    for path in paths:
+        featurize_file(str(path), store.mfcc)
+    wav_rate = len(paths) / (time.monotonic() - started_at)
+
+    rows = np.arange(len(store))
+    mean, std = store.stats(rows[:examples])
+    data = dataset(store, rows, mean, std, batch_size=64, training=True)
+    return {
+        "wav_examples_per_second": round(wav_rate, 1),
+        "store_examples_per_second": throughput(data),
+    }
+
+
+def split(
+    count: int, rng: np.random.Generator
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # 80% train, 10% validation, 10% test
+    order = rng.permutation(count)
+    train_end = int(count * 0.8)
+    val_end = int(count * 0.9)
+    return order[:train_end], order[train_end:val_end], order[val_end:]
+
+
+def build_model(frames: int, features: int, labels: int) -> models.Model:
+    # A small depthwise separable CNN; a few tens of thousands of weights
+    inputs = layers.Input(shape=(frames, features))
+    x = layers.Reshape((frames, features, 1))(inputs)
+    x = layers.Conv2D(32, 3, strides=2, padding="same", use_bias=False)(x)
+    x = layers.BatchNormalization()(x)
+    x = layers.ReLU()(x)
+    for filters in (32, 64, 64):
+        x = layers.DepthwiseConv2D(3, padding="same", use_bias=False)(x)
+        x = layers.BatchNormalization()(x)
+        x = layers.ReLU()(x)
+        x = layers.Conv2D(filters, 1, use_bias=False)(x)
+        x = layers.BatchNormalization()(x)
+        x = layers.ReLU()(x)
+    x = layers.GlobalAveragePooling2D()(x)
+    x = layers.Dropout(0.2)(x)
+    outputs = layers.Dense(labels, activation="softmax")(x)
+    return models.Model(inputs, outputs)
+
+
+def export_tflite(
+    model: models.Model, calibration: np.ndarray, model_path: str
+):
+    def representative_dataset():
+        for example in calibration:
+            yield [example[np.newaxis].astype(np.float32)]
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.int8
+    converter.inference_output_type = tf.int8
+
+    os.makedirs(os.path.dirname(model_path) or ".", exist_ok=True)
+    with open(model_path, "wb") as model_file:
+        model_file.write(converter.convert())
+
+
+def accuracy(model: KeywordModel, features: np.ndarray, targets) -> float:
+    # Scored through the exported model, as the robot will run it
+    correct = sum(
+        int(np.argmax(model.predict(example)) == target)
+        for example, target in zip(features, targets)
+    )
+    return correct / len(targets)
+
+
+def train(
+    data_dir: str = DATASET_PATH,
+    model_path: str = MODEL_PATH,
+    epochs: int = 20,
+    batch_size: int = 64,
+    mfcc: Optional[int] = None,
+    background_dir: Optional[str] = None,
+    store_dir: str = STORE_PATH,
+) -> Dict[str, float]:
+    tf.random.set_seed(SEED)
+    rng = np.random.default_rng(SEED)
+    data_path = pathlib.Path(data_dir)
+    if data_dir == DATASET_PATH:
+        download(data_path)
+
+    store = build_feature_store(data_path, store_dir, mfcc, background_dir)
+    labels = store.labels
+    train_rows, val_rows, test_rows = split(len(store), rng)
+
+    # Normalisation statistics come from the training split only
+    mean, std = store.stats(train_rows)
+    train_data = dataset(store, train_rows, mean, std, batch_size, True)
+    val_data = dataset(store, val_rows, mean, std, batch_size)
+    test_data = dataset(store, test_rows, mean, std, batch_size)
+
+    frames, features = store.shape
+    model = build_model(frames, features, len(labels))
+    model.compile(
+        optimizer=tf.keras.optimizers.Adam(),
+        loss=tf.keras.losses.SparseCategoricalCrossentropy(),
+        metrics=["accuracy"],
+    )
+    model.fit(
+        train_data,
+        validation_data=val_data,
+        epochs=epochs,
+        callbacks=[
+            tf.keras.callbacks.EarlyStopping(
+                patience=3, restore_best_weights=True
+            )
+        ],
+    )
+    _, float_accuracy = model.evaluate(test_data, verbose=0)
+
+    calibration = train_rows[:CALIBRATION_EXAMPLES]
+    export_tflite(model, (store.read(calibration) - mean) / std, model_path)
+    with open(metadata_path(model_path), "w") as metadata_file:
+        json.dump(
+            {"labels": labels, "mean": mean, "std": std, "mfcc": mfcc},
+            metadata_file,
+            indent=2,
+        )
+
+    int8_accuracy = accuracy(
+        KeywordModel(model_path),
+        store.read(test_rows),
+        store.targets[test_rows],
+    )
+    results = {
+        "float_accuracy": round(float(float_accuracy), 4),
+        "int8_accuracy": round(int8_accuracy, 4),
+        "model_bytes": os.path.getsize(model_path),
+    }
+    logger.info(f"keyword model: {results}")
+    return results
 
-waveform_ds = files_ds.map(
-    map_func=get_waveform_and_label, num_parallel_calls=AUTOTUNE
-)
 
-rows = 3
-cols = 3
-n = rows * cols
-fig, axes = plt.subplots(rows, cols, figsize=(10, 12))
-
-for i, (audio, label) in enumerate(waveform_ds.take(n)):
-    r = i // cols
-    c = i % cols
-    ax = axes[r][c]
-    ax.plot(audio.numpy())
-    ax.set_yticks(np.arange(-1.2, 1.2, 0.2))
-    label = label.numpy().decode("utf-8")
-    ax.set_title(label)
-
-plt.show()
+if __name__ == "__main__":
+    train()
@@ -1,20 +1,92 @@
-from typing import Optional
-from aitextgen import aitextgen
-from yuri.config import Config
+import os
+import re
+import subprocess
+import sys
+import time
+
+from typing import Iterator, List, Optional
 
-# Without any parameters, aitextgen() will download, cache, and load the 124M GPT-2 "small" model
-# ai = aitextgen()
+from loguru import logger
 
-# ai.generate()
-# ai.generate(n=3, max_length=100)
-# ai.generate(n=3, prompt="I believe in unicorns because", max_length=100)
-# ai.generate_to_file(n=10, prompt="I believe in unicorns because", max_length=100, temperature=1.2)
+from yuri.config import Config
+from yuri.textgen_server import TextGenClient
 
+# Loading GPT-2 takes a while on a Pi
+SERVER_START_SECONDS = 180.0
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
 
+
+# GPT-2 stays loaded in a server process shared by every caller. The first
+# TextGen to find no server starts one in the background and waits for it;
+# everyone after that pays generation time only.
 class TextGen:
     def __init__(self, config: Config):
         self.config = config
-        self.ai = aitextgen()
+        self.socket_path = os.path.expanduser(config.textgen_socket)
+        self.client = TextGenClient(self.socket_path)
+
+    def server_command(self) -> List[str]:
+        command = [
+            sys.executable,
+            "-m",
+            "yuri.textgen_server",
+            self.socket_path,
+            f"--max-context={self.config.textgen_max_context}",
+            f"--cache-mb={self.config.textgen_cache_mb}",
+        ]
+        if self.config.textgen_int8:
+            command.append("--int8")
+        if self.config.textgen_threads:
+            command.append(f"--threads={self.config.textgen_threads}")
+        return command
+
+    def ensure_server(self):
+        if self.client.available:
+            return
+
+        logger.info("textgen.starting_server", socket=self.socket_path)
+        os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+        with open(f"{self.socket_path}.log", "a") as log:
+            server = subprocess.Popen(
+                self.server_command(),
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                cwd=os.path.dirname(
+                    os.path.dirname(os.path.abspath(__file__))
+                ),
+                # Outlives this process for the next caller
+                start_new_session=True,
+            )
+        deadline = time.monotonic() + SERVER_START_SECONDS
+        while not self.client.available:
+            if server.poll() is not None:
+                raise RuntimeError(
+                    f"text generation server exited, see {log.name}"
+                )
+            if time.monotonic() > deadline:
+                raise TimeoutError("text generation server didn't start")
+            time.sleep(0.1)
+
+    def stream(self, prompt: str, **kwargs) -> Iterator[str]:
+        self.ensure_server()
+        yield from self.client.stream(prompt, **kwargs)
+
+    def generate(self, prompt: Optional[str] = None, **kwargs) -> str:
+        return "".join(self.stream(prompt or "", **kwargs))
+
+    def reply(self, prompt: str, conversation: Optional[str] = None) -> str:
+        # Just the continuation, without the prompt it was given
+        return self.generate(prompt, conversation=conversation).strip()
 
-    def generate(self, prompt: Optional[str] = None):
-        return self.ai.generate(prompt=prompt)
+    def sentences(self, prompt: str, **kwargs) -> Iterator[str]:
+        # Whole sentences as soon as they're generated, so speaking can
+        # start before generation ends
+        pending = ""
+        for token in self.stream(prompt, **kwargs):
+            pending += token
+            *complete, pending = SENTENCE_END.split(pending)
+            for sentence in complete:
+                if sentence.strip():
+                    yield sentence.strip()
+        if pending.strip():
+            yield pending.strip()
@@ -0,0 +1,265 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import time
+
+from dataclasses import dataclass
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from loguru import logger
+
+MAX_TOKENS = 40
+TEMPERATURE = 0.7
+# Prompts that arrive within this long of each other share a batch
+BATCH_WINDOW = 0.01
+MAX_BATCH = 8
+# Tokens of conversation (prompts and replies) the model is given at most
+MAX_CONTEXT = 512
+# Attention keys and values kept for conversations
+CACHE_MB = 128
+
+
+@dataclass
+class Request:
+    prompt: str
+    max_tokens: int
+    temperature: float
+    # Called from the generation thread with each new piece of text
+    emit: Callable[[str], None]
+    # Turns of one conversation share the model's context, so each turn's
+    # prompt is just what's new since the last reply
+    conversation: Optional[str] = None
+    # False leaves the conversation as it was, for replies that may be
+    # thrown away. The turn can be added afterwards with max_tokens=0.
+    commit: bool = True
+    # Set if the client went away; the generator stops sampling for it
+    cancelled: bool = False
+    error: Optional[str] = None
+
+
+def listening(socket_path: str) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            return False
+    return True
+
+
+# Talks to a TextGenServer over its socket
+class TextGenClient:
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+
+    @property
+    def available(self) -> bool:
+        return listening(self.socket_path)
+
+    def stream(
+        self,
+        prompt: str,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        conversation: Optional[str] = None,
+        commit: bool = True,
+    ) -> Iterator[str]:
+        body = {"prompt": prompt}
+        if conversation is not None:
+            body["conversation"] = conversation
+            if not commit:
+                body["commit"] = False
+        if max_tokens is not None:
+            body["max_tokens"] = max_tokens
+        if temperature is not None:
+            body["temperature"] = temperature
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(self.socket_path)
+            sock.sendall(json.dumps(body).encode() + b"\n")
+            with sock.makefile(encoding="utf-8") as lines:
+                for line in lines:
+                    message = json.loads(line)
+                    if "error" in message:
+                        raise RuntimeError(message["error"])
+                    if "token" not in message:
+                        logger.debug("textgen.done", **message)
+                        return
+                    yield message["token"]
+
+
+# Keeps one generator (and so one copy of the model) warm behind a Unix
+# socket. Each connection sends one JSON line, {"prompt": ..., and
+# optionally "max_tokens", "temperature", "conversation" and "commit"}, and
+# gets back a JSON line per piece of text as it's generated,
+# {"token": ...}, then a final
+# {"done": true, ...}. Prompts that arrive together are generated as one
+# batch on a worker thread so the event loop keeps streaming.
+class TextGenServer:
+    def __init__(
+        self,
+        generator,
+        socket_path: str,
+        max_batch: int = MAX_BATCH,
+        batch_window: float = BATCH_WINDOW,
+    ):
+        # `generator` has generate(requests), like BatchGenerator
+        self.generator = generator
+        self.socket_path = socket_path
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.batches = 0
+        self.requests = 0
+        self._queue: Optional[asyncio.Queue] = None
+
+    async def serve(self):
+        # Until cancelled
+        if os.path.exists(self.socket_path):
+            if listening(self.socket_path):
+                raise RuntimeError(f"{self.socket_path} is already served")
+            os.remove(self.socket_path)
+
+        self._queue = asyncio.Queue()
+        server = await asyncio.start_unix_server(
+            self.handle, path=self.socket_path
+        )
+        batching = asyncio.ensure_future(self.batch_loop())
+        logger.info("textgen.serving", socket=self.socket_path)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batching.cancel()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        loop = asyncio.get_event_loop()
+        received_at = time.monotonic()
+        tokens: asyncio.Queue = asyncio.Queue()
+        try:
+            body = json.loads(await reader.readline())
+            request = Request(
+                prompt=body["prompt"],
+                max_tokens=body.get("max_tokens", MAX_TOKENS),
+                temperature=body.get("temperature", TEMPERATURE),
+                conversation=body.get("conversation"),
+                commit=body.get("commit", True),
+                emit=lambda text: loop.call_soon_threadsafe(
+                    tokens.put_nowait, text
+                ),
+            )
+        except (ValueError, KeyError) as error:
+            writer.write(json.dumps({"error": repr(error)}).encode() + b"\n")
+            writer.close()
+            return
+
+        await self._queue.put((request, tokens))
+        first_token_at = None
+        count = 0
+        try:
+            while True:
+                text = await tokens.get()
+                if text is None:
+                    break
+                if first_token_at is None:
+                    first_token_at = time.monotonic()
+                count += 1
+                writer.write(json.dumps({"token": text}).encode() + b"\n")
+                await writer.drain()
+
+            done = {"done": True, "tokens": count}
+            if request.error is not None:
+                done["error"] = request.error
+            if first_token_at is not None:
+                done["first_token_ms"] = round(
+                    1000.0 * (first_token_at - received_at), 1
+                )
+            done["seconds"] = round(time.monotonic() - received_at, 3)
+            writer.write(json.dumps(done).encode() + b"\n")
+            await writer.drain()
+        except ConnectionError:
+            request.cancelled = True
+        finally:
+            writer.close()
+
+    async def next_batch(self) -> List[Tuple[Request, asyncio.Queue]]:
+        # Blocks for the first request, then takes whatever else arrives
+        # within the batch window
+        loop = asyncio.get_event_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.batch_window
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(
+                    await asyncio.wait_for(
+                        self._queue.get(), max(0.0, deadline - loop.time())
+                    )
+                )
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def batch_loop(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = await self.next_batch()
+            requests = [request for request, _ in batch]
+            self.batches += 1
+            self.requests += len(requests)
+            logger.debug("textgen.batch", size=len(requests))
+            try:
+                await loop.run_in_executor(
+                    None, self.generator.generate, requests
+                )
+            except Exception as error:  # pylint: disable=broad-except
+                logger.exception("textgen.failed")
+                for request in requests:
+                    request.error = repr(error)
+            for _, tokens in batch:
+                tokens.put_nowait(None)
+
+
+def main(
+    socket_path: str,
+    model: Optional[str] = None,
+    int8: bool = False,
+    max_context: int = MAX_CONTEXT,
+    cache_mb: int = CACHE_MB,
+    threads: Optional[int] = None,
+):
+    import torch
+
+    from yuri.generation import BatchGenerator
+
+    if threads:
+        torch.set_num_threads(threads)
+    started_at = time.monotonic()
+    generator = BatchGenerator.load(
+        model, int8=int8, max_context=max_context, cache_mb=cache_mb
+    )
+    logger.info(
+        "textgen.loaded",
+        int8=int8,
+        seconds=round(time.monotonic() - started_at, 2),
+    )
+    # The socket only appears once the model is ready to use
+    server = TextGenServer(generator, socket_path)
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("socket_path")
+    parser.add_argument("--model")
+    parser.add_argument("--int8", action="store_true")
+    parser.add_argument("--max-context", type=int, default=MAX_CONTEXT)
+    parser.add_argument("--cache-mb", type=int, default=CACHE_MB)
+    parser.add_argument("--threads", type=int)
+    main(**vars(parser.parse_args()))
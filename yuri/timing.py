@@ -0,0 +1,67 @@
+import asyncio
+import time
+
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque
+
+
+@dataclass
+class JitterStats:
+    # Most recent tick lateness samples, in seconds
+    samples: Deque[float] = field(default_factory=lambda: deque(maxlen=10000))
+
+    def record(self, lateness: float):
+        self.samples.append(lateness)
+
+    def percentile(self, percent: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(len(ordered) * percent / 100.0))
+        return ordered[index]
+
+    @property
+    def mean(self) -> float:
+        if not self.samples:
+            return 0.0
+        return sum(self.samples) / len(self.samples)
+
+    @property
+    def max(self) -> float:
+        return max(self.samples, default=0.0)
+
+    def summary(self) -> dict:
+        return {
+            "ticks": len(self.samples),
+            "mean_ms": round(self.mean * 1000.0, 3),
+            "p99_ms": round(self.percentile(99) * 1000.0, 3),
+            "max_ms": round(self.max * 1000.0, 3),
+        }
+
+    def reset(self):
+        self.samples.clear()
+
+
+# Fixed-rate scheduling against the monotonic clock. Deadlines advance by
+# exactly one period per tick so sleep overshoot doesn't accumulate; if we
+# fall more than a period behind, the schedule restarts from now instead of
+# firing a burst of catch-up ticks.
+class Ticker:
+    def __init__(self, period: float):
+        self.period = period
+        self.deadline = time.monotonic() + period
+        self.jitter = JitterStats()
+
+    async def wait(self) -> float:
+        now = time.monotonic()
+        if self.deadline > now:
+            await asyncio.sleep(self.deadline - now)
+
+        lateness = time.monotonic() - self.deadline
+        self.jitter.record(lateness)
+        if lateness > self.period:
+            self.deadline = time.monotonic() + self.period
+        else:
+            self.deadline += self.period
+        return lateness
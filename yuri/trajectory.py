@@ -0,0 +1,129 @@
+import math
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Dict, Sequence, Tuple
+
+import numpy as np
+
+# Positions are rounded to this many decimals when looking up cached
+# trajectories; a hundredth of a degree is well below servo resolution.
+CACHE_PRECISION = 2
+SETTLE_TOLERANCE = 0.02
+
+
+def min_jerk(t: np.ndarray) -> np.ndarray:
+    return t**3 * (10.0 - 15.0 * t + 6.0 * t**2)
+
+
+def ease(t: np.ndarray) -> np.ndarray:
+    return 0.5 - 0.5 * np.cos(np.pi * t)
+
+
+def linear(t: np.ndarray) -> np.ndarray:
+    return t
+
+
+CURVES: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    "min_jerk": min_jerk,
+    "ease": ease,
+    "linear": linear,
+}
+
+
+@lru_cache(maxsize=64)
+def profile(ticks: int, curve: str) -> np.ndarray:
+    # Normalised progress (0 -> 1) at the end of each tick
+    if curve not in CURVES:
+        raise ValueError(f"{curve} is not a valid curve")
+
+    progress = CURVES[curve](np.arange(1, ticks + 1) / ticks)
+    progress.setflags(write=False)
+    return progress
+
+
+def settle_seconds(
+    smoothing_factor: float,
+    tick_seconds: float,
+    tolerance: float = SETTLE_TOLERANCE,
+) -> float:
+    # How long the old per-tick exponential smoothing took to get within
+    # `tolerance` of its target. Used as the default movement duration so
+    # existing movement_smoothing values keep their feel.
+    if smoothing_factor >= 1.0:
+        return tick_seconds
+    if smoothing_factor <= 0.0:
+        raise ValueError("smoothing_factor must be positive")
+
+    ticks = math.ceil(math.log(tolerance) / math.log(1.0 - smoothing_factor))
+    return ticks * tick_seconds
+
+
+@dataclass(frozen=True)
+class Trajectory:
+    # One row per tick, one column per servo
+    points: np.ndarray
+    tick_seconds: float
+
+    @property
+    def ticks(self) -> int:
+        return self.points.shape[0]
+
+    @property
+    def duration(self) -> float:
+        return self.ticks * self.tick_seconds
+
+    @property
+    def targets(self) -> np.ndarray:
+        return self.points[-1]
+
+
+class TrajectoryPlanner:
+    def __init__(
+        self,
+        tick_seconds: float,
+        curve: str = "min_jerk",
+        cache_size: int = 128,
+    ):
+        if curve not in CURVES:
+            raise ValueError(f"{curve} is not a valid curve")
+
+        self.tick_seconds = tick_seconds
+        self.curve = curve
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[Tuple, Trajectory]" = OrderedDict()
+
+    def ticks(self, duration: float) -> int:
+        return max(1, int(round(duration / self.tick_seconds)))
+
+    def plan(
+        self,
+        starts: Sequence[float],
+        targets: Sequence[float],
+        duration: float,
+    ) -> Trajectory:
+        starts = np.round(np.asarray(starts, dtype=float), CACHE_PRECISION)
+        targets = np.round(np.asarray(targets, dtype=float), CACHE_PRECISION)
+        ticks = self.ticks(duration)
+
+        key = (tuple(starts), tuple(targets), ticks)
+        trajectory = self._cache.get(key)
+        if trajectory is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return trajectory
+
+        self.misses += 1
+        points = starts + np.outer(
+            profile(ticks, self.curve), targets - starts
+        )
+        points.setflags(write=False)
+        trajectory = Trajectory(points=points, tick_seconds=self.tick_seconds)
+
+        self._cache[key] = trajectory
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return trajectory
@@ -0,0 +1,109 @@
+import hashlib
+import os
+import tempfile
+import threading
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+from loguru import logger
+
+from yuri.audio import PCMClip
+
+
+@dataclass
+class TTSCacheStats:
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hits(self) -> int:
+        return self.memory_hits + self.disk_hits
+
+
+# Decoded speech keyed by everything that affects how it sounds. Recently used
+# clips stay in memory up to `max_memory_bytes`; every clip is also written to
+# `directory` (if set) so the cache survives restarts.
+class TTSCache:
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        max_memory_bytes: int = 32 * 1024 * 1024,
+    ):
+        self.directory = os.path.expanduser(directory) if directory else None
+        self.max_memory_bytes = max_memory_bytes
+        self.memory_bytes = 0
+        self.stats = TTSCacheStats()
+        self._clips: "OrderedDict[str, PCMClip]" = OrderedDict()
+        # Speech pipelines read and write from more than one thread
+        self._lock = threading.RLock()
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(text: str, voice: Sequence) -> str:
+        # `voice` is whatever identifies the engine, voice, rate and language
+        parts = [text, *(str(part) for part in voice)]
+        return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[PCMClip]:
+        with self._lock:
+            return self._get(key)
+
+    def put(self, key: str, clip: PCMClip):
+        with self._lock:
+            self._put(key, clip)
+
+    def _get(self, key: str) -> Optional[PCMClip]:
+        clip = self._clips.get(key)
+        if clip is not None:
+            self._clips.move_to_end(key)
+            self.stats.memory_hits += 1
+            return clip
+
+        path = self._path(key)
+        if path and os.path.exists(path):
+            try:
+                clip = PCMClip.from_wav(path)
+            except (EOFError, OSError) as error:
+                logger.warning(f"unreadable tts cache entry {path}: {error}")
+            else:
+                self.stats.disk_hits += 1
+                self._remember(key, clip)
+                return clip
+
+        self.stats.misses += 1
+        return None
+
+    def _put(self, key: str, clip: PCMClip):
+        self._remember(key, clip)
+
+        path = self._path(key)
+        if path and not os.path.exists(path):
+            # Write then rename so a crash never leaves a truncated entry
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(clip.to_wav())
+            os.replace(tmp_path, path)
+
+    def _remember(self, key: str, clip: PCMClip):
+        if key in self._clips:
+            self.memory_bytes -= len(self._clips.pop(key).data)
+        self._clips[key] = clip
+        self.memory_bytes += len(clip.data)
+
+        while (
+            self.memory_bytes > self.max_memory_bytes and len(self._clips) > 1
+        ):
+            _, evicted = self._clips.popitem(last=False)
+            self.memory_bytes -= len(evicted.data)
+            self.stats.evictions += 1
+
+    def _path(self, key: str) -> Optional[str]:
+        if not self.directory:
+            return None
+        return os.path.join(self.directory, f"{key}.wav")
@@ -1,32 +1,41 @@
 import asyncio
 import random
 
+from typing import Optional
+
 from yuri.config import Config
+from yuri.config_watch import ConfigWatcher, watch_eyes, watch_speaker
 from yuri.listener import ListenerFactory
 from yuri.speaker import SpeakerFactory
 from yuri.lights import Lights
 from yuri.input import Input
 from yuri.servos import Servos
 
+IDLE_PHRASES = ["hmm", "interesting", "where am I?"]
+
 
 class Yuri:
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, config_path: Optional[str] = None):
         self.servos = Servos(config)
         self.inputs = Input(config)
         self.lights = Lights(config)
         self.speaker = SpeakerFactory.create(config)
         self.listener = ListenerFactory.create(config)
+        # Edits to config_path are applied while running
+        self.watcher = ConfigWatcher(config, config_path)
+        watch_eyes(self.watcher, self.servos.eyes)
+        watch_speaker(self.watcher, [self])
 
     async def run(self):
         await asyncio.gather(
+            self.watcher.run(),
             self.servos.loop(),
             self.lights.cycle_colors(),
             self.speech_loop(),
+            self.speaker.prewarm(IDLE_PHRASES),
         )
 
     async def speech_loop(self):
         while True:
-            await self.speaker.say(
-                random.choice(["hmm", "interesting", "where am I?"])
-            )
+            await self.speaker.say(random.choice(IDLE_PHRASES))
             await asyncio.sleep(random.random() * 30.0)